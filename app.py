@@ -15,50 +15,104 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import os
+import sys
+import hmac
 import time
 import atexit
+import signal
 import logging
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify
 import use_sql
 import init_sql
-from syno_func import get_syno_sid, get_user_info, write_channel_info_sql, main_run, cleanup_old_messages
+import mem_debug
+from syno_func import get_syno_sid, get_user_info, write_channel_info_sql, main_run, get_health_snapshot, \
+    monitor_stop_event, request_monitor_stop, request_monitor_reload, ingest_webhook_post, push_dispatcher, \
+    sync_directory, MONITOR_DRAIN_TIMEOUT
+from monitor_worker import run_maintenance, STARTUP_DIRECTORY_SYNC
+from startup import startup_tracker
+from log_setup import setup_logging
+from export import export_lines, parse_time
+from storage import init_storage, get_storage, MONITOR_RUNS_MAX, MONITOR_ROLLUP_DAYS
+from user_registry import publish_user_change
+from push_backends import PUSH_BACKENDS, DEFAULT_BACKEND
 from threading import Thread
 
 app = Flask(__name__)
 
 # 配置日志
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 DB_FILE = "push_gateway.db"
 
+# 进程角色:
+#   all  - Web 服务 + 监控线程（默认，单进程部署）
+#   web  - 只提供 Web 服务，不启动监控线程，可在多 worker 的 WSGI 服务器下运行
+# 监控进程单独通过 monitor_worker.py 启动
+GATEWAY_ROLE = os.environ.get("GATEWAY_ROLE", "all")
+
+# 数据库结构是否已迁移到最新版本，启动时检查一次，请求处理时只读取该标志
+database_ready = False
+
 # 全局变量来跟踪线程状态
 monitor_thread = None
 monitor_running = False
 
+# 用户列表分页大小
+USERS_PAGE_SIZE = 50
+USERS_PAGE_SIZE_MAX = 500
+
+# 消息检索分页大小
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE_MAX = 200
+
+# /api/status 缓存，避免仪表盘频繁轮询时反复查询数据库
+STATUS_CACHE_TTL = 5  # 秒
+status_cache = None
+status_cache_time = 0.0
+
 
 def is_db_exist():
     return os.path.exists(DB_FILE)
 
 
 def ensure_database_integrity():
-    """确保数据库完整性"""
+    """
+    确保数据库完整性
+
+    启动时迁移成功后只检查内存标志；尚未就绪时（例如其他进程仍在迁移）每次重新检查表结构
+    """
+    global database_ready
     if not is_db_exist():
-        logger.info("数据库文件不存在")
         return False
+    if not database_ready:
+        database_ready = init_sql.check_tables_exist()
+    return database_ready
 
-    # 检查表结构是否完整
-    if not init_sql.check_tables_exist():
-        logger.warning("数据库表结构不完整，重新初始化")
-        return init_sql.init_app()
 
-    return True
+def prepare_database(create=False):
+    """启动时执行一次数据库迁移，并缓存结果"""
+    global database_ready
+
+    if not create and not is_db_exist():
+        logger.info("数据库文件不存在")
+        database_ready = False
+        return False
+
+    database_ready = init_sql.init_app()
+    if not database_ready:
+        logger.error("数据库迁移失败")
+    return database_ready
 
 
 def start_monitor_thread():
     """启动消息监控线程"""
     global monitor_thread, monitor_running
 
+    if GATEWAY_ROLE != "all":
+        logger.info(f"当前进程角色为 {GATEWAY_ROLE}，监控由独立进程运行")
+        return False
+
     if not is_db_exist():
         logger.info("数据库不存在，跳过启动监控线程")
         return False
@@ -69,16 +123,20 @@ def start_monitor_thread():
         return False
 
     if monitor_thread and monitor_thread.is_alive():
+        if monitor_stop_event.is_set():
+            logger.warning("监控线程正在停止，请稍后再启动")
+            return False
         logger.info("监控线程已在运行")
         return True
 
     try:
         # 检查数据库中是否有用户数据
-        users = use_sql.get_user_info()
-        if not users:
+        users_count, _ = use_sql.count_push_users()
+        if not users_count:
             logger.warning("数据库中没有用户数据，跳过启动监控线程")
             return False
 
+        monitor_stop_event.clear()
         monitor_thread = Thread(target=main_run, daemon=True, name="MessageMonitor")
         monitor_thread.start()
         monitor_running = True
@@ -90,37 +148,282 @@ def start_monitor_thread():
         return False
 
 
-def stop_monitor_thread():
-    """停止监控线程"""
+def stop_monitor_thread(timeout=None):
+    """
+    停止监控线程，等待正在进行的推送完成
+
+    没有监控线程时（如 GATEWAY_ROLE=web）同样等待本进程推送队列中的 Webhook 推送和合并缓冲区发送完成
+
+    Args:
+        timeout: 最长等待时间（秒），默认 MONITOR_DRAIN_TIMEOUT
+
+    Returns:
+        bool: 是否在超时前停止并发送完成
+    """
     global monitor_running
     monitor_running = False
-    logger.info("监控线程停止")
+
+    timeout = MONITOR_DRAIN_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+
+    if monitor_thread and monitor_thread.is_alive():
+        logger.info(f"正在停止监控线程，最多等待 {timeout} 秒")
+        request_monitor_stop()
+        monitor_thread.join(timeout)
+
+        if monitor_thread.is_alive():
+            logger.warning("监控线程未能在超时时间内停止")
+            return False
+        logger.info("监控线程停止")
+
+    # 等待推送队列中已排队的消息发送完成
+    return push_dispatcher.drain(max(deadline - time.monotonic(), 0))
+
+
+def reload_monitor_thread():
+    """通知监控线程重新加载配置并立即开始下一轮"""
+    if not monitor_thread or not monitor_thread.is_alive():
+        return False
+    request_monitor_reload()
+    logger.info("已通知监控线程重新加载")
+    return True
 
 
 # 注册退出时的清理函数
 atexit.register(stop_monitor_thread)
 
 
+@app.route('/api/monitor/<action>', methods=['POST'])
+def control_monitor(action):
+    """监控线程控制接口: start / stop / restart / reload"""
+    if GATEWAY_ROLE != "all":
+        return jsonify({"success": False, "message": f"当前进程角色为 {GATEWAY_ROLE}，监控由独立进程运行"})
+
+    if action == "start":
+        success = start_monitor_thread()
+    elif action == "stop":
+        success = stop_monitor_thread()
+    elif action == "restart":
+        success = stop_monitor_thread() and start_monitor_thread()
+    elif action == "reload":
+        success = reload_monitor_thread()
+    else:
+        return jsonify({"success": False, "message": f"不支持的操作: {action}"}), 400
+
+    return jsonify({
+        "success": success,
+        "monitor_running": monitor_thread.is_alive() if monitor_thread else False,
+    })
+
+
 @app.route('/api/status')
 def system_status():
     """系统状态检查接口"""
-    status = {
-        'database_exists': is_db_exist(),
-        'database_integrity': ensure_database_integrity(),
-        'monitor_running': monitor_thread.is_alive() if monitor_thread else False,
-        'users_count': len(use_sql.get_user_info()) if is_db_exist() and ensure_database_integrity() else 0
-    }
+    global status_cache, status_cache_time
+
+    now = time.time()
+    if status_cache is None or now - status_cache_time > STATUS_CACHE_TTL:
+        db_ok = ensure_database_integrity()
+        users_count, active_users_count = use_sql.count_push_users() if db_ok else (0, 0)
+        status_cache = {
+            'database_exists': is_db_exist(),
+            'database_integrity': db_ok,
+            'users_count': users_count,
+            'active_users_count': active_users_count,
+        }
+        status_cache_time = now
+
+    status = dict(status_cache)
+    # 数据库未就绪时不报告 ready；其他 worker 通过初始化页面完成初始化后本进程也视为就绪
+    if not status['database_integrity']:
+        status['status'] = "uninitialized"
+    else:
+        status['status'] = "starting" if startup_tracker.phase == "starting" else "ready"
+    status['startup'] = startup_tracker.snapshot()
+    status['role'] = GATEWAY_ROLE
+    status['storage'] = get_storage().name
+    if GATEWAY_ROLE == "all":
+        status['monitor_running'] = monitor_thread.is_alive() if monitor_thread else False
+        status['monitor'] = get_health_snapshot()
+    else:
+        # 监控在独立进程中运行，本进程的健康快照始终为空，改为返回数据库中最近一轮的统计
+        last_runs = get_storage().runs.recent(limit=1) if status['database_integrity'] else []
+        last_run = last_runs[-1] if last_runs else None
+        if last_run:
+            last_run['age_seconds'] = round(now - last_run['started_at'] - last_run['duration'], 1)
+        status['last_monitor_run'] = last_run
+    status['dispatcher'] = push_dispatcher.snapshot()
     return jsonify(status)
 
 
+@app.route('/api/debug/memory')
+def debug_memory():
+    """内存诊断: 当前 RSS、tracemalloc 状态和进程内缓存/队列大小（反映处理本请求的进程）"""
+    return jsonify(mem_debug.memory_summary())
+
+
+@app.route('/api/debug/memory/tracemalloc/<action>', methods=['POST'])
+def debug_tracemalloc(action):
+    """开关 tracemalloc: start / stop"""
+    if action == "start":
+        changed = mem_debug.start_tracing()
+    elif action == "stop":
+        changed = mem_debug.stop_tracing()
+    else:
+        return jsonify({"success": False, "message": f"不支持的操作: {action}"}), 400
+    return jsonify({"success": True, "changed": changed, "tracing": action == "start"})
+
+
+@app.route('/api/debug/memory/top')
+def debug_memory_top():
+    """分配最多的代码位置及其相对上一次调用的增长"""
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 200)
+    key_type = request.args.get("key", "lineno")
+    if key_type not in ("lineno", "filename", "traceback"):
+        key_type = "lineno"
+    return jsonify(mem_debug.top_allocations(limit, key_type))
+
+
+@app.route('/api/debug/memory/rss')
+def debug_memory_rss():
+    """导出 RSS 采样环形缓冲区，format=csv 时返回 CSV"""
+    samples = mem_debug.get_rss_samples()
+    if request.args.get("format") == "csv":
+        lines = ["time,rss"] + [f"{sample['time']},{sample['rss']}" for sample in samples]
+        return Response("\n".join(lines) + "\n", mimetype="text/csv")
+    return jsonify({"interval": mem_debug.MEM_SAMPLE_INTERVAL, "samples": samples})
+
+
+@app.route('/api/message_history/compact', methods=['POST'])
+def compact_message_history():
+    """按存储模式压缩已推送消息正文，并返回节省的字节数"""
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
+
+    mode = request.form.get("mode") or request.args.get("mode")
+    if mode:
+        if mode not in use_sql.MESSAGE_STORAGE_MODES:
+            return jsonify({"success": False, "message": f"不支持的存储模式: {mode}"})
+        use_sql.set_system_config("MESSAGE_STORAGE_MODE", mode, "消息正文存储模式 full/hash/zlib")
+
+    report = use_sql.compact_pushed_messages()
+    return jsonify({"success": True, "report": report})
+
+
+@app.route('/search')
+def admin_search():
+    """消息全文检索页"""
+    if not ensure_database_integrity():
+        return redirect(url_for("init_gateway"))
+    return render_template("search.html", page_size=SEARCH_PAGE_SIZE)
+
+
+@app.route('/api/messages/search')
+def api_search_messages():
+    """
+    全文检索已记录的消息，返回按相关度排序的结果及投递到的推送用户
+
+    参数: q（多个词以空格分隔），channel_id，since / until（时间戳或 YYYY-MM-DD[ HH:MM:SS]），user，page，page_size
+    """
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"success": False, "message": "请输入检索内容"}), 400
+    try:
+        since = parse_time(request.args.get("since"))
+        until = parse_time(request.args.get("until"))
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"时间格式错误: {e}"}), 400
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = min(max(request.args.get("page_size", SEARCH_PAGE_SIZE, type=int), 1), SEARCH_PAGE_SIZE_MAX)
+    started = time.monotonic()
+    try:
+        results, has_more = use_sql.search_messages(
+            query,
+            channel_id=request.args.get("channel_id") or None,
+            since=since,
+            until=until,
+            user_name=request.args.get("user") or None,
+            limit=page_size,
+            offset=(page - 1) * page_size,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({
+        "success": True,
+        "results": results,
+        "page": page,
+        "page_size": page_size,
+        "has_more": has_more,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+    })
+
+
+@app.route('/api/export/<table>')
+def export_table(table):
+    """
+    流式导出消息记录（messages）或投递记录（deliveries）
+
+    参数: format=ndjson|csv，since / until（时间戳或 YYYY-MM-DD[ HH:MM:SS]），channel_id
+    """
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
+
+    fmt = request.args.get("format", "ndjson")
+    try:
+        lines = export_lines(
+            table, fmt,
+            since=parse_time(request.args.get("since")),
+            until=parse_time(request.args.get("until")),
+            channel_id=request.args.get("channel_id") or None,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{table}_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(lines, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.route('/webhook/synology', methods=['POST'])
+def synology_webhook():
+    """接收 Synology Chat 外发 Webhook 和机器人回调，直接进入推送流程"""
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"}), 503
+
+    post = request.form.to_dict() or request.get_json(silent=True) or {}
+    if not verify_webhook_token(post.get("token")):
+        logger.warning("Webhook token 校验失败")
+        return jsonify({"success": False, "message": "token 无效"}), 403
+
+    try:
+        pushed = ingest_webhook_post(post)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify({"success": True, "pushed": pushed})
+
+
+def verify_webhook_token(token):
+    """校验 Webhook token，允许的 token 以逗号分隔保存在 WEBHOOK_TOKENS 配置中"""
+    if not token:
+        return False
+    allowed = use_sql.get_system_config("WEBHOOK_TOKENS", "") or ""
+    return any(hmac.compare_digest(token, item.strip()) for item in allowed.split(",") if item.strip())
+
+
 # 原有的路由保持不变
 @app.route("/")
 def index():
     if is_db_exist() and ensure_database_integrity():
-        logger.info("Database exists and integrity ok, redirecting to admin")
+        logger.debug("Database exists and integrity ok, redirecting to admin")
         return redirect(url_for("admin_users"))
     else:
-        logger.info("Database does not exist or integrity failed, redirecting to init")
+        logger.debug("Database does not exist or integrity failed, redirecting to init")
         return redirect(url_for("init_gateway"))
 
 
@@ -128,18 +431,82 @@ def index():
 def admin_users():
     if not ensure_database_integrity():
         return redirect(url_for("init_gateway"))
-    users = use_sql.get_all_users()
-    users_no_password = []
 
-    for user in users:
-        user2 = list(user)
+    FIELDS = ["ID", "是否启用", "用户名", "推送后端", "gotify_url", "gotify_token"]
+    return render_template("users.html", fields=FIELDS, page_size=USERS_PAGE_SIZE, backends=PUSH_BACKENDS)
 
-        del user2[3]
-        users_no_password.append(user2)
 
+@app.route('/api/users')
+def api_users():
+    """分页、排序、按用户名搜索的用户列表接口（不返回密码）"""
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = min(max(request.args.get("page_size", USERS_PAGE_SIZE, type=int), 1), USERS_PAGE_SIZE_MAX)
+    users, total = use_sql.search_push_users(
+        keyword=request.args.get("q", "").strip(),
+        sort=request.args.get("sort", "id"),
+        order=request.args.get("order", "asc"),
+        limit=page_size,
+        offset=(page - 1) * page_size,
+    )
+    return jsonify({
+        "success": True,
+        "users": users,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "has_more": page * page_size < total,
+    })
+
+
+@app.route('/api/channels/<channel_id>/mute', methods=['POST'])
+def mute_channel(channel_id):
+    """设置频道对所有推送用户静音（mute=1）或取消静音（mute=0），静音的频道不再获取消息和推送"""
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
 
-    FIELDS = ["ID", "是否启用", "用户名", "gotify_url", "gotify_token"]
-    return render_template("users.html", users=users_no_password, fields=FIELDS )
+    mute = (request.form.get("mute") or request.args.get("mute", "1")) != "0"
+    if not use_sql.set_channel_banned(channel_id, mute):
+        return jsonify({"success": False, "message": "频道不存在"}), 404
+    return jsonify({"success": True, "channel_id": channel_id, "muted": mute})
+
+
+@app.route('/monitor_runs')
+def admin_monitor_runs():
+    """监控运行统计图表页"""
+    if not ensure_database_integrity():
+        return redirect(url_for("init_gateway"))
+    return render_template("monitor_runs.html")
+
+
+@app.route('/api/monitor_runs')
+def api_monitor_runs():
+    """最近 hours 小时内每轮监控的运行统计"""
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
+
+    hours = min(max(request.args.get("hours", 6, type=float), 0.1), 24 * 31)
+    runs = get_storage().runs.recent(since=time.time() - hours * 3600, limit=MONITOR_RUNS_MAX)
+    return jsonify({"success": True, "hours": hours, "runs": runs})
+
+
+@app.route('/api/monitor_runs/hourly')
+def api_monitor_runs_hourly():
+    """最近 days 天内按小时汇总的监控运行统计"""
+    if not ensure_database_integrity():
+        return jsonify({"success": False, "message": "数据库未初始化"})
+
+    days = min(max(request.args.get("days", 14, type=int), 1), MONITOR_ROLLUP_DAYS)
+    rollups = get_storage().runs.hourly(since=time.time() - days * 86400)
+    return jsonify({"success": True, "days": days, "rollups": rollups})
+
+
+def get_form_backend():
+    """读取表单中的推送后端，未知的值按默认后端处理"""
+    push_backend = request.form.get("push_backend") or DEFAULT_BACKEND
+    return push_backend if push_backend in PUSH_BACKENDS else DEFAULT_BACKEND
 
 
 @app.route("/add_user", methods=["POST"])
@@ -152,7 +519,11 @@ def add_user():
     sid = request.form.get("sid")
     gotify_url = request.form.get("gotify_url")
     gotify_token = request.form.get("gotify_token")
-    use_sql.add_push_users_info(username, password, sid, gotify_url, gotify_token)
+    push_backend = get_form_backend()
+    use_sql.add_push_users_info(username, password, sid, gotify_url, gotify_token, push_backend)
+    user = use_sql.get_user_by_name(username)
+    if user:
+        publish_user_change(user[0], "add")
     return redirect(url_for("admin_users"))
 
 
@@ -162,8 +533,9 @@ def toggle_ban_ajax(user_id):
         user = use_sql.get_user_by_id(user_id)
         if not user:
             return jsonify({"success": False, "message": "用户不存在"})
-        new_status = 0 if user[1] == 1 else 1
+        new_status = 0 if user['is_banned'] == 1 else 1
         use_sql.update_user_status(user_id, new_status)
+        publish_user_change(user_id, "update")
         return jsonify({"success": True, "new_status": new_status})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
@@ -178,6 +550,7 @@ def edit_user(user_id):
     password = request.form.get("password")
     gotify_url = request.form.get("gotify_url")
     gotify_token = request.form.get("gotify_token")
+    push_backend = get_form_backend()
 
     # 获取当前用户信息
     user = use_sql.get_user_by_id(user_id)
@@ -187,12 +560,10 @@ def edit_user(user_id):
 
     # 如果密码为空，保持原密码
     if not password:
-        print(user)
         password = user.get('user_password')  # ⚠️ 用 key 访问
-    use_sql.update_push_users_info(user_id, username, password, gotify_url, gotify_token)
-
     # 更新数据库
-    use_sql.update_push_users_info(user_id, username, password, gotify_url, gotify_token)
+    use_sql.update_push_users_info(user_id, username, password, gotify_url, gotify_token, push_backend)
+    publish_user_change(user_id, "update")
 
     logger.info(f"用户 {user_id} 已更新")
     return redirect(url_for("admin_users"))
@@ -215,7 +586,7 @@ def initialize():
         logger.info(f"开始初始化系统，DSM地址: {dsm_url}, 用户: {dsm_user}")
 
         # 执行数据库初始化
-        if not init_sql.init_app():
+        if not prepare_database(create=True):
             raise Exception("数据库初始化失败")
 
         # 保存系统配置到数据库
@@ -225,6 +596,9 @@ def initialize():
         # 获取SID并创建管理员用户
         admin_sid = get_syno_sid(dsm_user, dsm_pass)
         use_sql.add_push_users_info(dsm_user, dsm_pass, admin_sid)
+        admin_user = use_sql.get_user_by_name(dsm_user)
+        if admin_user:
+            publish_user_change(admin_user[0], "add")
 
         # 同步用户和频道信息
         get_user_info(admin_sid)
@@ -232,6 +606,7 @@ def initialize():
 
         # 初始化完成后启动监控线程
         start_monitor_thread()
+        startup_tracker.mark_ready()
 
         logger.info("系统初始化完成")
         return redirect(url_for('admin_users'))
@@ -243,29 +618,51 @@ def initialize():
 
 # 应用启动时的初始化
 def initialize_app():
-    """应用启动初始化"""
+    """
+    应用启动初始化
+
+    快速阶段只检查并迁移数据库，完成后即可处理请求；数据清理、目录同步和监控启动在后台线程中依次执行，
+    执行期间 /api/status 的 status 为 starting
+    """
     logger.info("应用启动初始化...")
+    mem_debug.start_rss_sampler()
 
-    if is_db_exist() and ensure_database_integrity():
-        logger.info("数据库完整性检查通过")
-        # 清理旧消息
-        try:
-            cleanup_old_messages(days=7)
-        except Exception as e:
-            logger.warning(f"清理旧消息失败: {e}，但继续启动")
-
-        # 启动监控线程
-        start_monitor_thread()
-    else:
+    if not prepare_database():
         logger.info("数据库不存在或完整性检查失败，等待初始化")
+        startup_tracker.fast_path_done()
+        startup_tracker.mark_uninitialized()
+        return
+
+    logger.info("数据库完整性检查通过")
+    init_storage()
+    tasks = []
+    # 数据维护和监控线程只在 all 角色下运行，避免多个 Web worker 重复执行
+    if GATEWAY_ROLE == "all":
+        tasks.append(("maintenance", run_maintenance))
+        if STARTUP_DIRECTORY_SYNC:
+            tasks.append(("directory_sync", sync_directory))
+        tasks.append(("monitor_start", start_monitor_thread))
+
+    startup_tracker.fast_path_done()
+    startup_tracker.run_deferred(tasks)
 
 
 if __name__ == "__main__":
+    # 收到 SIGTERM/SIGINT（如 docker stop）时停止监控并等待推送队列发送完成后退出；
+    # SIGTERM 的默认处理不会执行 atexit
+    def handle_signal(signum, frame):
+        logger.info(f"收到信号 {signum}，准备停止监控")
+        stop_monitor_thread()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
     # 应用启动初始化
     initialize_app()
 
-    # 启动 Flask 应用
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # 启动 Flask 应用（关闭自动重载，避免重载子进程再启动一个监控线程）
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1", use_reloader=False, host='0.0.0.0', port=5000)
 else:
-    # 当使用 flask run 命令时也会执行初始化
+    # 当使用 flask run 或 WSGI 服务器（GATEWAY_ROLE=web）加载时也会执行初始化
     initialize_app()
\ No newline at end of file
@@ -0,0 +1,18 @@
+#!/bin/sh
+# 根据 GATEWAY_ROLE 选择启动方式:
+#   all     - 单进程运行 Web 服务和监控线程（默认）
+#   web     - 使用 gunicorn 以 WEB_WORKERS 个 worker 运行 Web 服务，不启动监控
+#   monitor - 只运行独立的监控进程
+set -e
+
+case "${GATEWAY_ROLE:-all}" in
+    web)
+        exec gunicorn --workers "${WEB_WORKERS:-2}" --bind "0.0.0.0:${PORT:-5000}" app:app
+        ;;
+    monitor)
+        exec python monitor_worker.py
+        ;;
+    *)
+        exec python app.py
+        ;;
+esac
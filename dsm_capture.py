@@ -0,0 +1,267 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+DSM 流量录制与回放
+设置环境变量 DSM_CAPTURE_FILE 后，get_channels / get_channel_messages / get_user_info 的请求和响应
+脱敏后逐行写入该文件（JSON Lines）；回放服务器按录制时的响应耗时（或加速后）返回这些响应，
+用于离线复现和压测真实的 main_run 流程
+
+用法:
+    python dsm_capture.py replay capture.jsonl [--host 127.0.0.1] [--port 5001] [--speed 10]
+
+回放时将测试数据库中的 BASE_URL 设置为 http://127.0.0.1:5001 即可
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_FILE = os.environ.get("DSM_CAPTURE_FILE")
+
+# 请求参数中不录制的字段
+SECRET_PARAMS = {"_sid", "passwd", "account", "otp_code"}
+# 替换为等长占位符的字段（消息正文等），保留数据规模
+REDACT_TEXT_KEYS = {"message", "content"}
+# 替换为稳定化名的字段，同一原值总是得到同一化名，保留关联关系
+PSEUDONYM_KEYS = {"username", "nickname", "name", "email", "display_name"}
+
+
+def pseudonym(key: str, value: str) -> str:
+    """根据原值生成稳定的化名"""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{key}_{digest}"
+
+
+def sanitize(value: Any, key: str = "") -> Any:
+    """
+    递归脱敏响应内容
+
+    消息正文替换为等长的 x，用户名、昵称、频道名等替换为稳定化名，其余字段保持不变
+    """
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item, key) for item in value]
+    if isinstance(value, str) and value:
+        if key in REDACT_TEXT_KEYS:
+            return "x" * len(value)
+        if key in PSEUDONYM_KEYS:
+            return pseudonym(key, value)
+    return value
+
+
+def request_key(params: Dict[str, Any]) -> Tuple[str, str, str]:
+    """回放时用于匹配请求的键: (api, method, channel_id)"""
+    return str(params.get("api", "")), str(params.get("method", "")), str(params.get("channel_id", ""))
+
+
+class CaptureRecorder:
+    """把 DSM 请求和响应追加写入录制文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+        logger.warning(f"DSM 流量录制已开启，写入: {path}")
+
+    def record(self, params: Dict[str, Any], status: int, elapsed: float, body: Any) -> None:
+        """
+        录制一次请求
+
+        Args:
+            params: 请求参数（会去除 SID 等敏感字段）
+            status: HTTP 状态码
+            elapsed: 响应耗时（秒）
+            body: 解析后的响应 JSON
+        """
+        entry = {
+            "offset": round(time.monotonic() - self.started_at - elapsed, 3),
+            "elapsed": round(elapsed, 3),
+            "params": {k: v for k, v in params.items() if k not in SECRET_PARAMS},
+            "status": status,
+            "body": sanitize(body),
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.error(f"写入 DSM 录制文件失败: {e}")
+
+    def tee(self, chunks: Iterable[bytes], params: Dict[str, Any], status: int,
+            started: float) -> Iterator[bytes]:
+        """
+        透传流式响应的数据块，读取完成后录制完整响应
+
+        Args:
+            chunks: 响应数据块
+            params: 请求参数
+            status: HTTP 状态码
+            started: 请求开始时间（time.monotonic()）
+        """
+        buffer = bytearray()
+        for chunk in chunks:
+            buffer.extend(chunk)
+            yield chunk
+        try:
+            body = json.loads(buffer.decode("utf-8"))
+        except ValueError:
+            body = None
+        self.record(params, status, time.monotonic() - started, body)
+
+
+recorder: Optional[CaptureRecorder] = CaptureRecorder(CAPTURE_FILE) if CAPTURE_FILE else None
+
+
+def load_capture(path: str) -> Dict[Tuple[str, str, str], List[Dict[str, Any]]]:
+    """
+    读取录制文件，按请求键分组
+
+    Returns:
+        dict: 请求键 -> 按录制顺序排列的响应列表
+    """
+    exchanges = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                exchanges[request_key(entry["params"])].append(entry)
+    return exchanges
+
+
+class ReplayState:
+    """回放进度：同一请求键的响应按录制顺序依次返回，用完后重复最后一条"""
+
+    def __init__(self, exchanges: Dict[Tuple[str, str, str], List[Dict[str, Any]]], speed: float):
+        self.exchanges = exchanges
+        self.speed = speed
+        self.positions: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.served = 0
+        self.missed = 0
+        self._lock = threading.Lock()
+
+    def next_response(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = request_key(params)
+        entries = self.exchanges.get(key)
+        with self._lock:
+            if not entries:
+                self.missed += 1
+                return None
+            index = min(self.positions[key], len(entries) - 1)
+            self.positions[key] += 1
+            self.served += 1
+            return entries[index]
+
+
+def make_handler(state: ReplayState):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _params(self) -> Dict[str, Any]:
+            params = parse_qs(urlsplit(self.path).query)
+            if self.command == "POST":
+                length = int(self.headers.get("Content-Length") or 0)
+                params.update(parse_qs(self.rfile.read(length).decode("utf-8")))
+            return {k: v[-1] for k, v in params.items()}
+
+        def _reply(self, status: int, body: Any) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self) -> None:
+            params = self._params()
+            # 登录请求直接返回固定的 SID
+            if urlsplit(self.path).path.endswith("/auth.cgi"):
+                self._reply(200, {"success": True, "data": {"sid": "replay-sid"}})
+                return
+
+            entry = state.next_response(params)
+            if entry is None:
+                logger.warning(f"录制中没有匹配的请求: {request_key(params)}")
+                self._reply(200, {"success": False, "error": {"code": 404}})
+                return
+            if state.speed > 0:
+                time.sleep(entry["elapsed"] / state.speed)
+            self._reply(entry.get("status", 200), entry["body"])
+
+        do_GET = _handle
+        do_POST = _handle
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ReplayHandler
+
+
+def serve_replay(path: str, host: str = "127.0.0.1", port: int = 5001, speed: float = 1.0) -> None:
+    """
+    启动回放服务器
+
+    Args:
+        path: 录制文件
+        host: 监听地址
+        port: 监听端口
+        speed: 回放倍速，1 为原始耗时，10 为十倍速，0 为不等待
+    """
+    exchanges = load_capture(path)
+    state = ReplayState(exchanges, speed)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    total = sum(len(entries) for entries in exchanges.values())
+    logger.info(f"回放服务器已启动: http://{host}:{port}，共 {total} 条录制，{len(exchanges)} 种请求，倍速 {speed}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"回放结束，命中 {state.served} 次，未命中 {state.missed} 次")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="群晖消息推送网关 - DSM 流量回放")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay = subparsers.add_parser("replay", help="启动回放服务器")
+    replay.add_argument("capture_file", help="DSM_CAPTURE_FILE 录制的文件")
+    replay.add_argument("--host", default="127.0.0.1", help="监听地址")
+    replay.add_argument("--port", type=int, default=5001, help="监听端口")
+    replay.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示不等待")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    serve_replay(args.capture_file, args.host, args.port, args.speed)
+
+
+if __name__ == "__main__":
+    main()
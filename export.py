@@ -0,0 +1,155 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+消息记录和投递记录的流式导出
+按 id 分批读取数据库并逐行输出 NDJSON 或 CSV，内存占用与表大小无关；
+Web 接口 /api/export/<messages|deliveries> 与命令行共用这里的实现
+
+用法:
+    python export.py messages --format csv --since 2026-01-01 --until 2026-02-01 --channel 12 -o messages.csv
+    python export.py deliveries --format ndjson > deliveries.ndjson
+"""
+
+import io
+import sys
+import csv
+import json
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import use_sql
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_CHUNK_SIZE = 1000  # 每批从数据库读取的记录数
+
+# 导出类型 -> (遍历函数, 字段)
+EXPORT_TABLES: Dict[str, Tuple[Callable[..., Iterator[Dict[str, Any]]], Tuple[str, ...]]] = {
+    "messages": (use_sql.iter_message_history, use_sql.MESSAGE_EXPORT_FIELDS),
+    "deliveries": (use_sql.iter_message_deliveries, use_sql.DELIVERY_EXPORT_FIELDS),
+}
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """
+    解析时间参数，支持时间戳（秒）、YYYY-MM-DD 和 YYYY-MM-DD HH:MM:SS / ISO 8601（按本地时间）
+
+    Raises:
+        ValueError: 格式无法识别
+    """
+    if value is None or not str(value).strip():
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_ndjson(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def format_csv(rows: Iterable[Dict[str, Any]], fields: Tuple[str, ...]) -> Iterator[str]:
+    """逐行输出 CSV，首行为表头"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take() -> str:
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(fields)
+    yield take()
+    for row in rows:
+        writer.writerow(["" if row.get(field) is None else row.get(field) for field in fields])
+        yield take()
+
+
+def export_lines(table: str, fmt: str = "ndjson", since: Optional[float] = None, until: Optional[float] = None,
+                 channel_id: Optional[str] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    生成导出内容
+
+    Args:
+        table: messages / deliveries
+        fmt: ndjson / csv
+        since: 时间下限（时间戳，秒）
+        until: 时间上限（时间戳，秒）
+        channel_id: 只导出该频道
+        chunk_size: 每批读取的记录数
+
+    Returns:
+        Iterator[str]: 逐行的导出内容
+
+    Raises:
+        ValueError: 导出类型或格式不支持
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"不支持的导出类型: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+    iterate, fields = EXPORT_TABLES[table]
+    rows = iterate(since=since, until=until, channel_id=channel_id, chunk_size=chunk_size)
+    if fmt == "csv":
+        return format_csv(rows, fields)
+    return format_ndjson(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="群晖消息推送网关 - 导出消息记录和投递记录")
+    parser.add_argument("table", choices=tuple(EXPORT_TABLES), help="messages: 消息记录；deliveries: 投递记录")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", help="导出格式")
+    parser.add_argument("--since", help="开始时间（包含），时间戳或 YYYY-MM-DD[ HH:MM:SS]")
+    parser.add_argument("--until", help="结束时间（不包含），时间戳或 YYYY-MM-DD[ HH:MM:SS]")
+    parser.add_argument("--channel", help="只导出该频道ID")
+    parser.add_argument("--db", default=use_sql.DB_FILE, help="数据库文件")
+    parser.add_argument("-o", "--output", help="输出文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S', stream=sys.stderr)
+    try:
+        since, until = parse_time(args.since), parse_time(args.until)
+    except ValueError as e:
+        parser.error(f"时间格式错误: {e}")
+    use_sql.DB_FILE = args.db
+
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    count = 0
+    try:
+        for line in export_lines(args.table, args.format, since, until, args.channel):
+            output.write(line)
+            count += 1
+    finally:
+        if args.output:
+            output.close()
+    if args.format == "csv":
+        count -= 1
+    logger.info(f"导出完成，共 {max(count, 0)} 条记录")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+频道静音与关键词过滤规则
+规则保存在 system_config 的 FILTER_RULES 中（JSON 数组），不带 user 的规则对所有推送用户生效；
+channel_info.is_banned = 1 的频道对所有用户静音。
+静音在获取频道消息之前判断，被静音的频道不会请求 DSM，也不会推送；
+关键词和仅提及规则在推送前逐条判断，被过滤的消息记录到 message_filtered（不计入投递），不会在下一轮重复处理
+"""
+
+import re
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Optional, Pattern, Tuple
+
+from message_render import get_cached_config
+from push_dispatcher import message_mentions_user
+
+logger = logging.getLogger(__name__)
+
+
+def _keywords(value: Any) -> FrozenSet[str]:
+    """关键词字段可以是字符串或字符串数组"""
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        return frozenset()
+    return frozenset(str(keyword) for keyword in value if str(keyword))
+
+
+@lru_cache(maxsize=256)
+def compile_keywords(keywords: FrozenSet[str]) -> Optional[Pattern]:
+    """
+    将关键词集合编译为一个正则（各关键词按长度降序组成分支，忽略大小写），一次扫描即可判断是否命中任意关键词
+
+    Returns:
+        Pattern: 关键词集合为空时返回 None
+    """
+    if not keywords:
+        return None
+    alternatives = sorted(keywords, key=len, reverse=True)
+    return re.compile("|".join(re.escape(keyword) for keyword in alternatives), re.IGNORECASE)
+
+
+@lru_cache(maxsize=8)
+def parse_filter_rules(raw: Optional[str]) -> Tuple[Dict[str, Any], ...]:
+    """
+    解析 FILTER_RULES 配置（按原始字符串缓存，配置不变时不会重复解析）
+
+    格式为JSON数组，所有命中的规则叠加生效，例如:
+        [{"channel_type": "chatbot", "mute": true},
+         {"user": "alice", "channel_id": "12", "mute": true},
+         {"channel_id": "34", "include": ["告警", "error"]},
+         {"exclude": ["[广告]"]},
+         {"user": "bob", "channel_type": "channel", "mention_only": true}]
+    """
+    if not raw:
+        return ()
+    try:
+        rules = json.loads(raw)
+    except (TypeError, ValueError):
+        logger.warning("FILTER_RULES 不是有效的JSON，忽略")
+        return ()
+    if not isinstance(rules, list):
+        logger.warning("FILTER_RULES 应为JSON数组，忽略")
+        return ()
+    return tuple(rule for rule in rules if isinstance(rule, dict))
+
+
+def rule_matches(rule: Dict[str, Any], user_name: str, channel_id: str, channel_type: Optional[str]) -> bool:
+    """规则的作用范围（user / channel_id / channel_type）是否覆盖该用户和频道，未设置的字段不限制"""
+    if "user" in rule and str(rule["user"]) != user_name:
+        return False
+    if "channel_id" in rule and str(rule["channel_id"]) != str(channel_id):
+        return False
+    if "channel_type" in rule and rule["channel_type"] != channel_type:
+        return False
+    return True
+
+
+class ChannelPolicy:
+    """某个推送用户在某个频道上生效的规则合集"""
+
+    def __init__(self, muted: bool = False, include: Optional[Pattern] = None,
+                 exclude: Optional[Pattern] = None, mention_only: bool = False):
+        self.muted = muted
+        self.include = include
+        self.exclude = exclude
+        self.mention_only = mention_only
+
+    @property
+    def filters_messages(self) -> bool:
+        """是否需要逐条判断消息"""
+        return bool(self.include or self.exclude or self.mention_only)
+
+    def allows(self, message: str, dsm_user: Optional[tuple] = None) -> bool:
+        """
+        消息是否应该推送
+
+        Args:
+            message: 消息正文
+            dsm_user: 推送用户对应的 DSM 用户 (id, user_id, nickname, username, user_type)，仅提及规则使用
+
+        Returns:
+            bool: 是否推送
+        """
+        if self.muted:
+            return False
+        message = message or ""
+        if self.exclude and self.exclude.search(message):
+            return False
+        if self.include and not self.include.search(message):
+            return False
+        if self.mention_only and not message_mentions_user(message, dsm_user):
+            return False
+        return True
+
+
+ALLOW_ALL = ChannelPolicy()
+
+
+@lru_cache(maxsize=4096)
+def _build_policy(raw: Optional[str], user_name: str, channel_id: str, channel_type: Optional[str],
+                  channel_banned: bool) -> ChannelPolicy:
+    if channel_banned:
+        return ChannelPolicy(muted=True)
+
+    muted = mention_only = False
+    include: FrozenSet[str] = frozenset()
+    exclude: FrozenSet[str] = frozenset()
+    for rule in parse_filter_rules(raw):
+        if not rule_matches(rule, user_name, channel_id, channel_type):
+            continue
+        muted = muted or bool(rule.get("mute"))
+        mention_only = mention_only or bool(rule.get("mention_only"))
+        include |= _keywords(rule.get("include"))
+        exclude |= _keywords(rule.get("exclude"))
+
+    if not (muted or mention_only or include or exclude):
+        return ALLOW_ALL
+    return ChannelPolicy(muted, compile_keywords(include), compile_keywords(exclude), mention_only)
+
+
+def channel_policy(user_name: str, channel_id: str, channel_type: Optional[str],
+                   channel_banned: bool = False) -> ChannelPolicy:
+    """
+    获取推送用户在频道上生效的规则
+
+    结果按 (配置, 用户, 频道, 频道类型, 是否禁用) 缓存，FILTER_RULES 修改后随配置缓存刷新自动失效
+
+    Args:
+        user_name: 推送用户名
+        channel_id: 频道ID
+        channel_type: 频道类型 anonymous / chatbot / channel 等
+        channel_banned: channel_info.is_banned 是否为 1
+
+    Returns:
+        ChannelPolicy: 生效的规则
+    """
+    raw = get_cached_config().get("FILTER_RULES")
+    return _build_policy(raw, user_name, str(channel_id), channel_type, bool(channel_banned))
+
+
+def policy_cache_size() -> int:
+    return _build_policy.cache_info().currsize
@@ -15,119 +15,404 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import zlib
 import sqlite3
 import logging
 
 DB_FILE = "push_gateway.db"
+MIGRATION_LOCK_TIMEOUT = 120  # 等待其他进程完成迁移的最长时间（秒）
 logger = logging.getLogger(__name__)
 
 
-# 初始化表（如果还没建）
-def init_db():
+# ======================== 数据库迁移 ======================== #
+def migration_001_base_tables(cursor):
+    """初始表结构"""
+    # push_users 表
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS push_users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        is_banned INTEGER DEFAULT 0,
+        user_name TEXT UNIQUE,
+        user_password TEXT,
+        sid TEXT,
+        GOTIFY_URL TEXT,
+        GOTIFY_TOKEN TEXT
+    )
+    """)
+
+    # channel_info 表
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS channel_info (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        is_banned INTEGER DEFAULT 0,
+        channel_id TEXT UNIQUE,
+        channel_name TEXT,
+        members TEXT,
+        channel_member TEXT,
+        channel_type TEXT
+    )
+    """)
+
+    # user_info 表
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_info (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT UNIQUE,
+        nickname TEXT,
+        username TEXT,
+        user_type TEXT
+    )
+    """)
+
+    # 消息推送记录表
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS message_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id TEXT,
+        message_id TEXT,
+        message_content TEXT,
+        creator_id TEXT,
+        create_at INTEGER,
+        is_pushed INTEGER DEFAULT 0,
+        push_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(channel_id, message_id)
+    )
+    """)
+
+    # 系统配置表
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS system_config (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        config_key TEXT UNIQUE,
+        config_value TEXT,
+        description TEXT,
+        updated_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def migration_002_channel_members(cursor):
+    """频道成员表（channel_info.members 的规范化存储）"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS channel_members (
+        channel_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        PRIMARY KEY (channel_id, user_id)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_channel_members_user ON channel_members(user_id)")
+    migrate_channel_members(cursor)
+
+
+def migration_003_message_compact_storage(cursor):
+    """message_history 紧凑存储字段"""
+    ensure_column(cursor, 'message_history', 'content_hash', 'TEXT')
+    ensure_column(cursor, 'message_history', 'content_zlib', 'BLOB')
+
+
+def migration_004_user_change_log(cursor):
+    """推送用户变更日志（管理界面 -> 监控进程）"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_change_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        change_type TEXT NOT NULL,
+        created_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def migration_005_webhook_channels(cursor):
+    """通过 Synology Chat 外发 Webhook 推送消息的频道"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS webhook_channels (
+        channel_id TEXT PRIMARY KEY,
+        last_event_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def migration_006_message_deliveries(cursor):
+    """按推送用户记录消息投递，群组消息可以分别推送给每个成员"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS message_deliveries (
+        channel_id TEXT NOT NULL,
+        message_id TEXT NOT NULL,
+        push_user_id INTEGER NOT NULL,
+        delivered_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (channel_id, message_id, push_user_id)
+    )
+    """)
+    # 已推送的历史消息视为已投递给所有用户，避免升级后重复推送
+    cursor.execute("""
+    INSERT OR IGNORE INTO message_deliveries (channel_id, message_id, push_user_id)
+    SELECT h.channel_id, h.message_id, p.id FROM message_history h, push_users p
+    WHERE h.is_pushed = 1
+    """)
+
+
+def migration_007_push_backend(cursor):
+    """推送用户可选择推送后端（gotify / webhook / ntfy）"""
+    ensure_column(cursor, 'push_users', 'push_backend', "TEXT DEFAULT 'gotify'")
+
+
+def migration_008_monitor_runs(cursor):
+    """监控每轮运行统计（保留最近若干轮）及按小时汇总（保留更长时间）"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS monitor_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at REAL NOT NULL,
+        duration REAL NOT NULL,
+        users_polled INTEGER DEFAULT 0,
+        unread_channels INTEGER DEFAULT 0,
+        dsm_calls INTEGER DEFAULT 0,
+        pushes INTEGER DEFAULT 0,
+        push_failures INTEGER DEFAULT 0,
+        failures INTEGER DEFAULT 0,
+        sid_refreshes INTEGER DEFAULT 0
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS monitor_run_rollups (
+        hour INTEGER PRIMARY KEY,
+        cycles INTEGER DEFAULT 0,
+        total_duration REAL DEFAULT 0,
+        max_duration REAL DEFAULT 0,
+        users_polled INTEGER DEFAULT 0,
+        unread_channels INTEGER DEFAULT 0,
+        dsm_calls INTEGER DEFAULT 0,
+        pushes INTEGER DEFAULT 0,
+        push_failures INTEGER DEFAULT 0,
+        failures INTEGER DEFAULT 0,
+        sid_refreshes INTEGER DEFAULT 0
+    )
+    """)
+
+
+def migration_009_message_fts(cursor):
+    """消息正文全文索引（FTS5），由触发器随 message_history 写入和删除同步"""
+    # trigram 分词支持中文任意子串检索，旧版本 SQLite（< 3.34）不支持时退回 unicode61
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        logger.warning("SQLite 不支持 trigram 分词，全文索引使用 unicode61 分词")
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content)")
+
+    # zlib 压缩不更新索引，索引中保留原文；hash 模式压缩时由 use_sql 删除对应索引；MESSAGE_SEARCH_INDEX=0 时新消息不建索引
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message_history
+    WHEN new.message_content IS NOT NULL AND new.message_content != ''
+        AND COALESCE((SELECT config_value FROM system_config WHERE config_key = 'MESSAGE_SEARCH_INDEX'), '1') != '0'
+    BEGIN
+        INSERT INTO message_fts (rowid, content) VALUES (new.id, new.message_content);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message_history
+    BEGIN
+        DELETE FROM message_fts WHERE rowid = old.id;
+    END
+    """)
+
+    # 为已有消息建立索引，zlib 模式压缩过的正文先解压
+    cursor.execute("""
+    INSERT INTO message_fts (rowid, content)
+    SELECT id, message_content FROM message_history WHERE message_content IS NOT NULL AND message_content != ''
+    """)
+    reader = cursor.connection.cursor()
+    reader.execute("SELECT id, content_zlib FROM message_history WHERE message_content IS NULL AND content_zlib IS NOT NULL")
+    while True:
+        rows = reader.fetchmany(1000)
+        if not rows:
+            break
+        cursor.executemany("INSERT INTO message_fts (rowid, content) VALUES (?, ?)",
+                           [(row_id, zlib.decompress(data).decode("utf-8")) for row_id, data in rows])
+
+
+def migration_010_drop_channel_members_channel_index(cursor):
+    """删除 channel_members 上与主键前导列重复的 channel_id 索引"""
+    cursor.execute("DROP INDEX IF EXISTS idx_channel_members_channel")
+
+
+def migration_011_message_filtered(cursor):
+    """被过滤规则跳过的消息按推送用户单独记录，不计入投递"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS message_filtered (
+        channel_id TEXT NOT NULL,
+        message_id TEXT NOT NULL,
+        push_user_id INTEGER NOT NULL,
+        filtered_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (channel_id, message_id, push_user_id)
+    )
+    """)
+
+
+# 按版本号顺序执行的迁移列表，新增表/索引/字段时在末尾追加
+MIGRATIONS = [
+    (1, migration_001_base_tables),
+    (2, migration_002_channel_members),
+    (3, migration_003_message_compact_storage),
+    (4, migration_004_user_change_log),
+    (5, migration_005_webhook_channels),
+    (6, migration_006_message_deliveries),
+    (7, migration_007_push_backend),
+    (8, migration_008_monitor_runs),
+    (9, migration_009_message_fts),
+    (10, migration_010_drop_channel_members_channel_index),
+    (11, migration_011_message_filtered),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cursor):
+    """获取数据库当前的结构版本"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def run_migrations():
+    """
+    执行所有未应用的迁移
 
-        # push_users 表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS push_users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            is_banned INTEGER DEFAULT 0,
-            user_name TEXT UNIQUE,
-            user_password TEXT,
-            sid TEXT,
-            GOTIFY_URL TEXT,
-            GOTIFY_TOKEN TEXT
-        )
-        """)
-
-        # channel_info 表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS channel_info (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            is_banned INTEGER DEFAULT 0,
-            channel_id TEXT UNIQUE,
-            channel_name TEXT,
-            members TEXT,
-            channel_member TEXT,
-            channel_type TEXT
-        )
-        """)
-
-        # user_info 表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_info (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT UNIQUE,
-            nickname TEXT,
-            username TEXT,
-            user_type TEXT
-        )
-        """)
-
-        # 消息推送记录表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS message_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            channel_id TEXT,
-            message_id TEXT,
-            message_content TEXT,
-            creator_id TEXT,
-            create_at INTEGER,
-            is_pushed INTEGER DEFAULT 0,
-            push_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(channel_id, message_id)
-        )
-        """)
-
-        # 系统配置表
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS system_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            config_key TEXT UNIQUE,
-            config_value TEXT,
-            description TEXT,
-            updated_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
+    每个迁移在独立的 BEGIN IMMEDIATE 事务中执行并记录到 schema_version 表，失败时回滚并抛出异常；
+    多个进程同时启动时，事务内会重新读取结构版本，已被其他进程应用的迁移直接跳过
 
+    Returns:
+        int: 迁移后的结构版本
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_FILE, timeout=MIGRATION_LOCK_TIMEOUT)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        current_version = get_schema_version(cursor)
         conn.commit()
-        logger.info("所有数据库表结构初始化完成")
 
-        # 检查表是否创建成功
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
-        logger.info(f"数据库中的表: {[table[0] for table in tables]}")
+        for version, migration in MIGRATIONS:
+            if version <= current_version:
+                continue
+            description = (migration.__doc__ or migration.__name__).strip()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                current_version = get_schema_version(cursor)
+                if version <= current_version:
+                    conn.rollback()
+                    logger.debug(f"数据库迁移 {version} 已由其他进程完成")
+                    continue
+                logger.info(f"执行数据库迁移 {version}: {description}")
+                migration(cursor)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                               (version, description))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            current_version = version
+
+        return current_version
 
-    except sqlite3.Error as e:
-        logger.error(f"数据库初始化错误: {e}")
-        raise
     finally:
         if conn:
             conn.close()
 
 
+# 初始化表（如果还没建）
+def init_db():
+    try:
+        version = run_migrations()
+        logger.info(f"所有数据库表结构初始化完成，结构版本: {version}")
+    except sqlite3.Error as e:
+        logger.error(f"数据库初始化错误: {e}")
+        raise
+
+
+def get_table_columns(cursor, table):
+    """获取表的所有字段名"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
+
+
+def ensure_column(cursor, table, column, column_type):
+    """字段不存在时通过 ALTER TABLE 补充"""
+    if column not in get_table_columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        logger.info(f"表 {table} 已新增字段: {column}")
+
+
+def parse_member_list(value):
+    """
+    解析 channel_info 中以 str(list) 形式保存的成员列表
+
+    Args:
+        value: 字段值，例如 "[1, 2, 3]"
+
+    Returns:
+        list: 成员ID字符串列表，无法解析（如成员数量）时返回空列表
+    """
+    if not value:
+        return []
+    value = str(value).strip()
+    if not (value.startswith("[") and value.endswith("]")):
+        return []
+    return [x.strip().strip("'\"") for x in value[1:-1].split(",") if x.strip()]
+
+
+def migrate_channel_members(cursor):
+    """
+    将 channel_info 中的成员字符串迁移到 channel_members 表
+
+    旧版本更新频道时会把 members 和 channel_member 两列写反，
+    因此两列都尝试解析，取能解析出列表的那一列。
+    """
+    cursor.execute("SELECT COUNT(*) FROM channel_members")
+    if cursor.fetchone()[0] > 0:
+        return
+
+    cursor.execute("SELECT channel_id, members, channel_member FROM channel_info")
+    rows = []
+    for channel_id, members, channel_member in cursor.fetchall():
+        member_ids = parse_member_list(members) or parse_member_list(channel_member)
+        rows.extend((str(channel_id), member_id) for member_id in member_ids)
+
+    if rows:
+        cursor.executemany("INSERT OR IGNORE INTO channel_members (channel_id, user_id) VALUES (?, ?)", rows)
+        logger.info(f"频道成员迁移完成，共写入 {len(rows)} 条记录")
+
+
 def check_tables_exist():
-    """检查所有必要的表是否存在"""
+    """检查所有必要的表是否存在，且结构版本为最新"""
+    conn = None
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
 
-        required_tables = ['push_users', 'channel_info', 'user_info', 'message_history', 'system_config']
-        existing_tables = []
+        required_tables = ['push_users', 'channel_info', 'channel_members', 'user_info', 'message_history',
+                           'system_config', 'schema_version', 'user_change_log',
+                           'webhook_channels', 'message_deliveries', 'monitor_runs', 'monitor_run_rollups',
+                           'message_fts', 'message_filtered']
 
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = cursor.fetchall()
-        existing_tables = [table[0] for table in tables]
+        existing_tables = [table[0] for table in cursor.fetchall()]
 
         missing_tables = [table for table in required_tables if table not in existing_tables]
-
         if missing_tables:
             logger.warning(f"缺少表: {missing_tables}")
             return False
-        else:
-            logger.info("所有必要的表都存在")
-            return True
+
+        version = get_schema_version(cursor)
+        if version < SCHEMA_VERSION:
+            logger.warning(f"数据库结构版本 {version} 低于当前版本 {SCHEMA_VERSION}")
+            return False
+
+        logger.debug("所有必要的表都存在")
+        return True
 
     except sqlite3.Error as e:
         logger.error(f"检查表存在性失败: {e}")
@@ -138,7 +423,7 @@ def check_tables_exist():
 
 
 def init_app():
-    """应用初始化，确保数据库表结构完整"""
+    """应用初始化，执行数据库迁移并确保表结构完整"""
     try:
         init_db()
         if check_tables_exist():
@@ -149,4 +434,4 @@ def init_app():
             return False
     except Exception as e:
         logger.error(f"应用初始化失败: {e}")
-        return False
\ No newline at end of file
+        return False
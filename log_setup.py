@@ -0,0 +1,174 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+日志配置
+日志记录先放入队列，由后台线程格式化并写出，监控线程不会阻塞在标准输出上；
+同一位置的重复日志按时间窗口限流，被丢弃的条数附加在窗口结束后的下一条日志中；
+LOG_FORMAT=json 时每条日志输出为一行 JSON
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import atexit
+import logging
+import threading
+import logging.handlers
+from queue import SimpleQueue
+from typing import Dict, Optional, Tuple
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # text / json
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", 10))  # 限流窗口（秒），0 表示不限流
+LOG_RATE_BURST = int(os.environ.get("LOG_RATE_BURST", 20))  # 同一位置每个窗口内最多输出的条数
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按代码位置（文件 + 行号）限流
+
+    ERROR 及以上级别不限流；被过滤的记录不会被格式化
+    """
+
+    def __init__(self, window: float = LOG_RATE_WINDOW, burst: int = LOG_RATE_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        # 位置 -> [窗口开始时间, 本窗口已输出条数, 被丢弃条数]
+        self._counters: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.window <= 0 or record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                suppressed = counter[2] if counter else 0
+                self._counters[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if counter[1] < self.burst:
+                counter[1] += 1
+                return True
+            counter[2] += 1
+            return False
+
+
+class SuppressedFormatter(logging.Formatter):
+    """文本格式，在日志末尾注明此前被限流丢弃的条数"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f"（此前 {LOG_RATE_WINDOW:g} 秒内相同日志已省略 {suppressed} 条）"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+            "location": f"{record.module}:{record.lineno}",
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    只在调用线程中合并消息参数和异常堆栈，时间戳、级别等格式化留给后台线程
+
+    默认的 QueueHandler.prepare() 会用完整的 Formatter 格式化，输出端的 JSON 格式就无法拿到原始字段
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> None:
+    """
+    配置根日志记录器（重复调用无副作用）
+
+    Args:
+        level: 日志级别
+        log_format: text / json
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(sys.stderr)
+        if log_format == "json":
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(SuppressedFormatter(TEXT_FORMAT, DATE_FORMAT))
+
+        log_queue = SimpleQueue()
+        handler = DeferredQueueHandler(log_queue)
+        handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(getattr(logging, level, logging.INFO))
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """停止后台线程，写出队列中剩余的日志"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,202 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+内存诊断模块
+后台线程按固定间隔采样进程 RSS 保存到环形缓冲区；可按需开关 tracemalloc，
+报告内存分配最多的代码位置及其相对上一次快照的增长；各模块通过 register_size() 登记缓存和队列的大小
+"""
+
+import os
+import time
+import logging
+import threading
+import tracemalloc
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MEM_SAMPLE_INTERVAL = int(os.environ.get("MEM_SAMPLE_INTERVAL", 60))  # RSS 采样间隔（秒），0 表示不采样
+MEM_SAMPLES = int(os.environ.get("MEM_SAMPLES", 1440))  # 环形缓冲区保留的采样数（默认 60 秒 × 1440 = 24 小时）
+TRACEMALLOC_FRAMES = 10  # tracemalloc 记录的调用栈深度
+
+_rss_samples: Deque[Tuple[float, int]] = deque(maxlen=MEM_SAMPLES)
+_sampler_thread: Optional[threading.Thread] = None
+_size_providers: Dict[str, Callable[[], Any]] = {}
+_snapshot_lock = threading.Lock()
+_last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+
+def get_rss() -> Optional[int]:
+    """
+    获取当前进程的 RSS（字节）
+
+    Linux 下读取 /proc/self/statm，其他平台返回 None
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _sample_loop() -> None:
+    while True:
+        rss = get_rss()
+        if rss is not None:
+            _rss_samples.append((time.time(), rss))
+        time.sleep(MEM_SAMPLE_INTERVAL)
+
+
+def start_rss_sampler() -> None:
+    """启动 RSS 采样线程（重复调用无副作用）"""
+    global _sampler_thread
+    if MEM_SAMPLE_INTERVAL <= 0 or (_sampler_thread and _sampler_thread.is_alive()):
+        return
+    _sampler_thread = threading.Thread(target=_sample_loop, daemon=True, name="RssSampler")
+    _sampler_thread.start()
+
+
+def get_rss_samples() -> List[Dict[str, Any]]:
+    """导出环形缓冲区中的 RSS 采样"""
+    return [{"time": round(ts, 3), "rss": rss} for ts, rss in list(_rss_samples)]
+
+
+def register_size(name: str, provider: Callable[[], Any]) -> None:
+    """
+    登记一个进程内缓存或队列的大小
+
+    Args:
+        name: 名称
+        provider: 返回当前大小（数量或字典）的函数
+    """
+    _size_providers[name] = provider
+
+
+def get_sizes() -> Dict[str, Any]:
+    """读取所有已登记的缓存和队列大小"""
+    sizes = {}
+    for name, provider in list(_size_providers.items()):
+        try:
+            sizes[name] = provider()
+        except Exception as e:
+            sizes[name] = f"error: {e}"
+    return sizes
+
+
+def start_tracing(frames: int = TRACEMALLOC_FRAMES) -> bool:
+    """
+    开启 tracemalloc
+
+    Returns:
+        bool: 是否由本次调用开启（已开启时返回 False）
+    """
+    global _last_snapshot
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    with _snapshot_lock:
+        _last_snapshot = None
+    logger.info("tracemalloc 已开启")
+    return True
+
+
+def stop_tracing() -> bool:
+    """
+    关闭 tracemalloc 并丢弃快照
+
+    Returns:
+        bool: 是否由本次调用关闭
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    with _snapshot_lock:
+        _last_snapshot = None
+    logger.info("tracemalloc 已关闭")
+    return True
+
+
+def _format_stat(stat) -> Dict[str, Any]:
+    frame = stat.traceback[0]
+    item = {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size": stat.size,
+        "count": stat.count,
+    }
+    if hasattr(stat, "size_diff"):
+        item["size_diff"] = stat.size_diff
+        item["count_diff"] = stat.count_diff
+    return item
+
+
+def top_allocations(limit: int = 20, key_type: str = "lineno") -> Dict[str, Any]:
+    """
+    获取分配最多的代码位置，以及相对上一次调用时快照的增长
+
+    每次调用都会保存新快照作为下一次比较的基准
+
+    Args:
+        limit: 返回的条目数
+        key_type: 分组方式 lineno / filename / traceback
+
+    Returns:
+        dict: top 为当前占用最多的位置，growth 为增长最多的位置（首次调用时为空）
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return {"tracing": False, "top": [], "growth": []}
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    with _snapshot_lock:
+        previous, _last_snapshot = _last_snapshot, snapshot
+
+    top = [_format_stat(stat) for stat in snapshot.statistics(key_type)[:limit]]
+    growth = []
+    if previous is not None:
+        diffs = [stat for stat in snapshot.compare_to(previous, key_type) if stat.size_diff > 0]
+        growth = [_format_stat(stat) for stat in diffs[:limit]]
+
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": True,
+        "traced_current": current,
+        "traced_peak": peak,
+        "compared_to_previous": previous is not None,
+        "top": top,
+        "growth": growth,
+    }
+
+
+def memory_summary() -> Dict[str, Any]:
+    """当前 RSS、tracemalloc 状态和各缓存/队列大小"""
+    summary = {
+        "rss": get_rss(),
+        "rss_samples": len(_rss_samples),
+        "sample_interval": MEM_SAMPLE_INTERVAL,
+        "tracing": tracemalloc.is_tracing(),
+        "sizes": get_sizes(),
+    }
+    if tracemalloc.is_tracing():
+        summary["traced_current"], summary["traced_peak"] = tracemalloc.get_traced_memory()
+    return summary
@@ -0,0 +1,202 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+推送消息渲染模块
+按频道类型使用 system_config 中的模板生成 Gotify 标题和正文，并对正文做长度截断；
+合并发送的多条消息使用 digest 模板渲染为一条摘要通知
+"""
+
+import time
+import string
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional
+
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# 频道类型对应的默认模板，可通过 system_config 中的 TEMPLATE_<类型>_TITLE / TEMPLATE_<类型>_BODY 覆盖
+# 可用变量: {channel_name} {sender} {message}
+DEFAULT_TEMPLATES = {
+    "anonymous": ("{sender}", "来自{sender}的消息：{message}"),
+    "chatbot": ("机器人 - {channel_name}", "{message}"),
+    "channel": ("{channel_name} - {sender}", "{message}"),
+    "channel_no_sender": ("频道: {channel_name}", "{message}"),
+}
+DEFAULT_CHATBOT_NO_NAME_TITLE = "机器人频道"  # 未自定义标题模板且频道名称为空时机器人频道使用的标题
+
+# 合并通知的默认模板，可通过 TEMPLATE_DIGEST_TITLE / TEMPLATE_DIGEST_BODY 覆盖
+# 可用变量: {channel_name} {count} {message}（最近几条消息，每行一条）
+DEFAULT_DIGEST_TEMPLATE = ("{channel_name}：{count} 条新消息", "{message}")
+DEFAULT_DIGEST_LINES = 5  # 合并通知中显示的最近消息条数
+
+DEFAULT_PRIORITY = 8
+DEFAULT_BODY_MAX_BYTES = 2000   # 正文最大字节数（UTF-8）
+DEFAULT_TITLE_MAX_BYTES = 200   # 标题最大字节数（UTF-8）
+TRUNCATE_SUFFIX = "…（内容过长已截断）"
+CONFIG_TTL = 60  # 模板配置缓存时间（秒）
+
+_config_lock = threading.Lock()
+_config_cache: Dict[str, str] = {}
+_config_loaded_at = 0.0
+
+
+def get_cached_config() -> Dict[str, str]:
+    """读取系统配置，按 CONFIG_TTL 缓存，避免每条消息都查询数据库"""
+    global _config_cache, _config_loaded_at
+
+    with _config_lock:
+        if time.monotonic() - _config_loaded_at > CONFIG_TTL:
+            _config_cache = get_storage().config.get_all()
+            _config_loaded_at = time.monotonic()
+        return _config_cache
+
+
+def reload_templates() -> None:
+    """使模板配置缓存失效，下次渲染时重新读取"""
+    global _config_loaded_at
+    with _config_lock:
+        _config_loaded_at = 0.0
+
+
+@lru_cache(maxsize=64)
+def compile_template(template: str, fallback: Optional[str] = None) -> Tuple[Tuple[str, Optional[str]], ...]:
+    """
+    将模板字符串预编译为 (字面量, 变量名) 片段序列
+
+    Args:
+        template: str.format 风格的模板
+        fallback: 模板格式错误（如未闭合的 "{"）时改用的默认模板
+
+    Returns:
+        tuple: 预编译后的片段
+
+    Raises:
+        ValueError: 模板格式错误且没有默认模板
+    """
+    try:
+        return tuple((literal, field) for literal, field, _, _ in string.Formatter().parse(template))
+    except ValueError as e:
+        if fallback is None:
+            raise
+        # 结果按模板缓存，同一个错误模板只记录一次
+        logger.warning(f"模板格式错误，使用默认模板: {template!r}（{e}）")
+        return compile_template(fallback)
+
+
+def _render(template: str, values: Dict[str, str], fallback: Optional[str] = None) -> str:
+    parts = []
+    for literal, field in compile_template(template, fallback):
+        parts.append(literal)
+        if field is not None:
+            parts.append(str(values.get(field, "")))
+    return "".join(parts)
+
+
+def truncate_utf8(text: str, max_bytes: int, suffix: str = "") -> str:
+    """
+    按 UTF-8 字节数截断文本，不会截断半个字符
+
+    Args:
+        text: 原始文本
+        max_bytes: 最大字节数，<=0 表示不限制
+        suffix: 截断后追加的提示
+
+    Returns:
+        str: 截断后的文本
+    """
+    if max_bytes <= 0:
+        return text
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    suffix_bytes = len(suffix.encode("utf-8"))
+    if suffix_bytes >= max_bytes:
+        suffix, suffix_bytes = "", 0
+    keep = max_bytes - suffix_bytes
+    return data[:keep].decode("utf-8", errors="ignore") + suffix
+
+
+def int_config(config: Dict[str, str], key: str, default: int) -> int:
+    try:
+        return int(config.get(key, default))
+    except (TypeError, ValueError):
+        logger.warning(f"配置 {key} 不是有效整数，使用默认值: {default}")
+        return default
+
+
+def render_notification(kind: str, channel_name: str = "", sender: str = "",
+                        message: str = "") -> Tuple[str, str, int]:
+    """
+    渲染推送通知
+
+    Args:
+        kind: 模板类型 (anonymous / chatbot / channel / channel_no_sender)
+        channel_name: 频道名称
+        sender: 发送者显示名称
+        message: 消息正文
+
+    Returns:
+        tuple: (标题, 正文, Gotify优先级)
+    """
+    config = get_cached_config()
+    default_title, default_body = DEFAULT_TEMPLATES.get(kind, DEFAULT_TEMPLATES["channel"])
+    prefix = f"TEMPLATE_{kind.upper()}"
+    if kind == "chatbot" and not channel_name:
+        default_title = DEFAULT_CHATBOT_NO_NAME_TITLE
+    title_template = config.get(f"{prefix}_TITLE") or default_title
+    body_template = config.get(f"{prefix}_BODY") or default_body
+
+    values = {"channel_name": channel_name, "sender": sender, "message": message}
+    title = truncate_utf8(_render(title_template, values, default_title),
+                          int_config(config, "TITLE_MAX_BYTES", DEFAULT_TITLE_MAX_BYTES), "…")
+    body = truncate_utf8(_render(body_template, values, default_body),
+                         int_config(config, "BODY_MAX_BYTES", DEFAULT_BODY_MAX_BYTES), TRUNCATE_SUFFIX)
+    priority = int_config(config, f"PRIORITY_{kind.upper()}",
+                          int_config(config, "PRIORITY_DEFAULT", DEFAULT_PRIORITY))
+    return title, body, priority
+
+
+def render_digest(channel_name: str, count: int, lines: List[str]) -> Tuple[str, str]:
+    """
+    渲染合并通知
+
+    Args:
+        channel_name: 频道名称
+        count: 合并的消息数量
+        lines: 按时间顺序排列的消息摘要行
+
+    Returns:
+        tuple: (标题, 正文)
+    """
+    config = get_cached_config()
+    title_template = config.get("TEMPLATE_DIGEST_TITLE") or DEFAULT_DIGEST_TEMPLATE[0]
+    body_template = config.get("TEMPLATE_DIGEST_BODY") or DEFAULT_DIGEST_TEMPLATE[1]
+
+    max_lines = max(1, int_config(config, "DIGEST_LINES", DEFAULT_DIGEST_LINES))
+    recent = [line.replace("\n", " ") for line in lines[-max_lines:]]
+    if len(lines) > max_lines:
+        recent.insert(0, f"…（仅显示最近 {max_lines} 条）")
+
+    values = {"channel_name": channel_name, "count": count, "message": "\n".join(recent)}
+    title = truncate_utf8(_render(title_template, values, DEFAULT_DIGEST_TEMPLATE[0]),
+                          int_config(config, "TITLE_MAX_BYTES", DEFAULT_TITLE_MAX_BYTES), "…")
+    body = truncate_utf8(_render(body_template, values, DEFAULT_DIGEST_TEMPLATE[1]),
+                         int_config(config, "BODY_MAX_BYTES", DEFAULT_BODY_MAX_BYTES), TRUNCATE_SUFFIX)
+    return title, body
@@ -0,0 +1,108 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+独立的消息监控进程入口
+只运行监控循环，不启动 Web 服务，配合以 GATEWAY_ROLE=web 运行的多 worker WSGI 服务使用
+
+用法:
+    python monitor_worker.py [--wait-interval 10]
+"""
+
+import os
+import signal
+import argparse
+import logging
+
+import use_sql
+import init_sql
+import mem_debug
+from syno_func import main_run, cleanup_old_messages, request_monitor_stop, monitor_stop_event, push_dispatcher, \
+    sync_directory, MONITOR_DRAIN_TIMEOUT
+from startup import startup_tracker
+from log_setup import setup_logging
+from storage import init_storage
+
+logger = logging.getLogger(__name__)
+
+# 启动时是否使用管理员会话同步一次 DSM 用户和频道目录
+STARTUP_DIRECTORY_SYNC = os.environ.get("STARTUP_DIRECTORY_SYNC", "1") == "1"
+
+
+def run_maintenance() -> None:
+    """启动时的数据维护：清理旧消息、压缩已推送消息正文"""
+    try:
+        cleanup_old_messages(days=7)
+    except Exception as e:
+        logger.warning(f"清理旧消息失败: {e}，但继续启动")
+
+    # 按存储模式压缩已推送消息的正文
+    use_sql.compact_pushed_messages()
+
+    # 清理已被监控应用过的用户变更记录
+    use_sql.cleanup_user_changes(days=7)
+
+
+def wait_for_database(wait_interval: int) -> bool:
+    """
+    等待 Web 端完成系统初始化并迁移数据库
+
+    Returns:
+        bool: 数据库是否就绪，等待期间收到停止请求时返回 False
+    """
+    while not monitor_stop_event.is_set():
+        if os.path.exists(init_sql.DB_FILE) and init_sql.init_app():
+            return True
+        logger.info(f"数据库尚未初始化，{wait_interval} 秒后重试")
+        monitor_stop_event.wait(wait_interval)
+    return False
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="群晖消息推送网关 - 独立监控进程")
+    parser.add_argument("--wait-interval", type=int, default=10, help="等待数据库初始化的重试间隔（秒）")
+    args = parser.parse_args()
+
+    setup_logging()
+
+    # 收到 SIGTERM/SIGINT 时完成正在进行的推送后退出
+    def handle_signal(signum, frame):
+        logger.info(f"收到信号 {signum}，准备停止监控")
+        request_monitor_stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    logger.info("独立监控进程启动")
+    mem_debug.start_rss_sampler()
+    if not wait_for_database(args.wait_interval):
+        return
+    init_storage()
+    startup_tracker.fast_path_done()
+
+    # 独立监控进程没有 Web 服务需要尽快就绪，维护任务在启动监控循环前同步执行
+    tasks = [("maintenance", run_maintenance)]
+    if STARTUP_DIRECTORY_SYNC:
+        tasks.append(("directory_sync", sync_directory))
+    startup_tracker.run_deferred(tasks, background=False)
+    main_run()
+
+    # 监控循环退出后，等待已排队的推送发送完成
+    push_dispatcher.drain(MONITOR_DRAIN_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
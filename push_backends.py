@@ -0,0 +1,180 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+推送后端模块
+每个推送用户可选择 gotify / webhook / ntfy 后端，推送地址和令牌沿用 push_users 的 GOTIFY_URL、GOTIFY_TOKEN 字段；
+每个后端持有一个连接池化的 requests.Session，避免每条推送都新建连接
+"""
+
+import os
+import base64
+import logging
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 30  # 推送请求超时时间（秒）
+POOL_MAXSIZE = int(os.environ.get("PUSH_POOL_MAXSIZE", 10))  # 每个主机保持的最大连接数
+EMPTY_MESSAGE = '[请打开群晖chat查看]'
+
+
+def is_blank(value: Optional[str]) -> bool:
+    """字段为空或为写入数据库时 str(None) 产生的 'None'"""
+    return not value or value == 'None'
+
+
+class PushBackend:
+    """
+    推送后端基类
+
+    子类实现 build_request() 描述请求，发送和连接复用由基类统一处理
+    """
+
+    name = ""
+    requires_token = False  # 是否必须配置令牌
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def build_request(self, url: str, token: str, title: str, message: str, priority: int) -> Dict:
+        """
+        构造请求参数
+
+        Returns:
+            dict: 传给 session.post 的关键字参数（url / json / data / headers）
+        """
+        raise NotImplementedError
+
+    def send(self, url: str, token: str, title: str, message: str, priority: int = 8) -> bool:
+        """
+        发送一条推送
+
+        Args:
+            url: 推送地址
+            token: 令牌，可为空
+            title: 标题
+            message: 正文，为空时使用默认提示
+            priority: Gotify 风格的优先级（0-10）
+
+        Returns:
+            bool: 是否发送成功
+        """
+        if not message:
+            message = EMPTY_MESSAGE
+        token = "" if is_blank(token) else token
+
+        try:
+            resp = self.session.post(timeout=REQUEST_TIMEOUT,
+                                     **self.build_request(url, token, title, message, priority))
+            if 200 <= resp.status_code < 300:
+                logger.info("%s 消息发送成功: %s", self.name, title)
+                return True
+            logger.error(f"{self.name} 消息发送失败: HTTP {resp.status_code} {resp.text[:200]}")
+            return False
+        except requests.exceptions.RequestException as e:
+            logger.error(f"{self.name} 请求失败: {str(e)}")
+            return False
+        except Exception as e:
+            logger.error(f"{self.name} 发送时发生未知错误: {str(e)}")
+            return False
+
+
+class GotifyBackend(PushBackend):
+    """Gotify: POST {url}，令牌通过 X-Gotify-Key 请求头传递，不出现在 URL 中"""
+
+    name = "gotify"
+    requires_token = True
+
+    def build_request(self, url, token, title, message, priority):
+        return {
+            "url": url,
+            "json": {"title": title, "message": message, "priority": priority},
+            "headers": {"X-Gotify-Key": token},
+        }
+
+
+class WebhookBackend(PushBackend):
+    """通用 Webhook: POST JSON {title, message, priority}，配置了令牌时以 Bearer 方式传递"""
+
+    name = "webhook"
+
+    def build_request(self, url, token, title, message, priority):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return {
+            "url": url,
+            "json": {"title": title, "message": message, "priority": priority},
+            "headers": headers,
+        }
+
+
+class NtfyBackend(PushBackend):
+    """ntfy: POST 正文到 {服务器}/{主题}，标题和优先级通过请求头传递"""
+
+    name = "ntfy"
+
+    @staticmethod
+    def map_priority(priority: int) -> int:
+        """Gotify 优先级（0-10）转换为 ntfy 优先级（1-5）"""
+        if priority >= 10:
+            return 5
+        if priority >= 8:
+            return 4
+        if priority >= 4:
+            return 3
+        if priority >= 2:
+            return 2
+        return 1
+
+    def build_request(self, url, token, title, message, priority):
+        headers = {
+            # HTTP 头只能使用 latin-1，中文标题按 RFC 2047 编码，ntfy 会自动解码
+            "Title": f"=?UTF-8?B?{base64.b64encode(title.encode('utf-8')).decode('ascii')}?=",
+            "Priority": str(self.map_priority(priority)),
+        }
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return {"url": url, "data": message.encode("utf-8"), "headers": headers}
+
+
+BACKENDS: Dict[str, PushBackend] = {backend.name: backend for backend in
+                                    (GotifyBackend(), WebhookBackend(), NtfyBackend())}
+DEFAULT_BACKEND = "gotify"
+PUSH_BACKENDS = tuple(BACKENDS)
+
+
+def get_backend(name: Optional[str]) -> PushBackend:
+    """获取推送后端，未知或未设置时使用 Gotify"""
+    return BACKENDS.get(name or DEFAULT_BACKEND) or BACKENDS[DEFAULT_BACKEND]
+
+
+def has_push_target(backend: Optional[str], url: Optional[str], token: Optional[str]) -> bool:
+    """推送用户是否配置了可用的推送地址（Gotify 还需要令牌）"""
+    if is_blank(url):
+        return False
+    return not (get_backend(backend).requires_token and is_blank(token))
+
+
+def send_notification(backend: Optional[str], url: str, token: str, title: str, message: str,
+                      priority: int = 8) -> bool:
+    """通过指定后端发送推送"""
+    return get_backend(backend).send(url, token, title, message, priority)
@@ -0,0 +1,529 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+推送调度模块
+按优先级通道（high / normal / bulk）排队发送推送，高优先级通道总是先于批量消息发送，
+并统计每个通道的排队延迟；同一用户同一频道在合并窗口内的消息合并为一条通知发送；
+发送前经过按 Gotify 服务器和 Token 的令牌桶限流，超出速率的推送留在队列中等待
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from message_render import get_cached_config, int_config, render_digest
+from rate_limit import RateLimiter, server_key
+
+logger = logging.getLogger(__name__)
+
+# 通道按服务顺序排列
+LANES = ("high", "normal", "bulk")
+
+# 各通道默认的 Gotify 优先级，可通过 LANE_PRIORITY_<通道> 配置覆盖；
+# normal 通道默认沿用模板渲染得到的优先级
+DEFAULT_LANE_PRIORITIES = {"high": 10, "bulk": 4}
+
+LATENCY_SAMPLES = 500  # 每个通道保留的延迟样本数
+PUSH_WORKERS = int(os.environ.get("PUSH_WORKERS", 4))  # 并发发送推送的线程数
+PUSH_MAX_PER_SERVER = int(os.environ.get("PUSH_MAX_PER_SERVER", 2))  # 每个推送服务器同时发送的最大批次数
+PUSH_BATCH_SIZE = int(os.environ.get("PUSH_BATCH_SIZE", 20))  # 一个线程连续发往同一目标的最大推送数
+DEFAULT_DIGEST_INTERVAL = 3600  # 摘要模式默认的发送间隔（秒）
+
+
+@dataclass
+class PushJob:
+    """一条待发送的推送"""
+    key: Tuple[str, str, int]  # (频道ID, 消息ID, 推送用户ID)，用于去重
+    lane: str
+    gotify_url: str  # 推送地址，沿用 push_users 的字段名，所有后端通用
+    token: str
+    title: str
+    message: str
+    priority: int
+    on_sent: Optional[Callable[[], None]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # 合并发送: group 相同的任务在 hold 秒内合并为一条通知，hold 为 0 时立即发送
+    group: Optional[Tuple[str, int]] = None
+    hold: float = 0
+    channel_name: str = ""
+    summary: str = ""  # 合并通知中代表这条消息的一行文字
+    members: List["PushJob"] = field(default_factory=list)  # 合并后的任务包含的原始任务
+    throttled: bool = False  # 是否因限流等待过
+    backend: str = "gotify"  # 推送后端，见 push_backends.BACKENDS
+
+    def all_keys(self) -> List[Tuple[str, str, int]]:
+        return [self.key] + [member.key for member in self.members]
+
+
+def job_target(job: PushJob) -> Tuple[str, str, str]:
+    """推送目标: (后端, 服务器, 令牌)，同一目标的推送由同一线程按顺序发送"""
+    return job.backend, server_key(job.gotify_url), job.token
+
+
+def message_mentions_user(message: str, dsm_user: Optional[tuple]) -> bool:
+    """
+    判断消息是否提及了目标用户
+
+    Args:
+        message: 消息正文
+        dsm_user: 目标用户在 user_info 表中的记录 (id, user_id, nickname, username, user_type)
+
+    Returns:
+        bool: 是否包含 @用户、@u:用户ID 或 @all
+    """
+    if not message or "@" not in message:
+        return False
+    if "@all" in message or "@channel" in message:
+        return True
+    if not dsm_user:
+        return False
+
+    tokens = [f"@u:{dsm_user[1]}"]
+    tokens.extend(f"@{name}" for name in (dsm_user[2], dsm_user[3]) if name)
+    return any(token in message for token in tokens)
+
+
+def load_priority_rules(config: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    解析 PRIORITY_RULES 配置
+
+    格式为JSON数组，按顺序匹配，第一条命中的规则生效，例如:
+        [{"channel_id": "12", "lane": "high"},
+         {"channel_type": "chatbot", "keyword": "告警", "lane": "high"}]
+    """
+    raw = config.get("PRIORITY_RULES")
+    if not raw:
+        return []
+    try:
+        rules = json.loads(raw)
+        return [rule for rule in rules if isinstance(rule, dict) and rule.get("lane") in LANES]
+    except (TypeError, ValueError):
+        logger.warning("PRIORITY_RULES 不是有效的JSON，忽略")
+        return []
+
+
+def classify_message(channel_id: str, channel_type: Optional[str], message: str,
+                     dsm_user: Optional[tuple]) -> str:
+    """
+    为消息选择优先级通道
+
+    先匹配 PRIORITY_RULES，未命中时：私聊和提及目标用户的消息为 high，
+    机器人频道为 bulk，其他为 normal
+
+    Returns:
+        str: 通道名称
+    """
+    config = get_cached_config()
+    for rule in load_priority_rules(config):
+        if "channel_id" in rule and str(rule["channel_id"]) != str(channel_id):
+            continue
+        if "channel_type" in rule and rule["channel_type"] != channel_type:
+            continue
+        if "keyword" in rule and rule["keyword"] not in (message or ""):
+            continue
+        return rule["lane"]
+
+    if channel_type == "anonymous" or message_mentions_user(message, dsm_user):
+        return "high"
+    if channel_type == "chatbot":
+        return "bulk"
+    return "normal"
+
+
+def load_coalesce_rules(config: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    解析 COALESCE_RULES 配置
+
+    格式为JSON数组，按顺序匹配，第一条命中的规则生效，例如:
+        [{"channel_id": "12", "window": 120},
+         {"channel_type": "chatbot", "mode": "digest"}]
+    """
+    raw = config.get("COALESCE_RULES")
+    if not raw:
+        return []
+    try:
+        rules = json.loads(raw)
+        return [rule for rule in rules if isinstance(rule, dict)]
+    except (TypeError, ValueError):
+        logger.warning("COALESCE_RULES 不是有效的JSON，忽略")
+        return []
+
+
+def seconds_until_digest(interval: int) -> float:
+    """距离下一个摘要发送时刻的秒数，摘要按整点间隔（如每小时整点）发送"""
+    now = time.time()
+    return (now // interval + 1) * interval - now
+
+
+def coalesce_hold(channel_id: str, channel_type: Optional[str], lane: str) -> float:
+    """
+    计算消息在合并缓冲区中等待的时间
+
+    先匹配 COALESCE_RULES；未命中时 DIGEST_BULK=1 的 bulk 通道消息按摘要模式发送，
+    其余非 high 通道的消息使用 COALESCE_WINDOW_<频道类型> 或 COALESCE_WINDOW 作为合并窗口。
+    high 通道（私聊、提及）只有在规则明确指定时才会合并
+
+    Returns:
+        float: 等待秒数，0 表示立即发送
+    """
+    config = get_cached_config()
+    digest_interval = max(1, int_config(config, "DIGEST_INTERVAL", DEFAULT_DIGEST_INTERVAL))
+
+    for rule in load_coalesce_rules(config):
+        if "channel_id" in rule and str(rule["channel_id"]) != str(channel_id):
+            continue
+        if "channel_type" in rule and rule["channel_type"] != channel_type:
+            continue
+        if rule.get("mode") == "digest":
+            return seconds_until_digest(digest_interval)
+        try:
+            return max(0.0, float(rule.get("window", 0)))
+        except (TypeError, ValueError):
+            return 0
+
+    if lane == "high":
+        return 0
+    if lane == "bulk" and config.get("DIGEST_BULK") == "1":
+        return seconds_until_digest(digest_interval)
+
+    default_window = int_config(config, "COALESCE_WINDOW", 0)
+    return max(0, int_config(config, f"COALESCE_WINDOW_{(channel_type or 'channel').upper()}", default_window))
+
+
+def merge_jobs(jobs: List[PushJob]) -> PushJob:
+    """
+    将同一分组的多个任务合并为一条通知
+
+    只有一个任务时原样返回；合并后的通知使用最高的通道和优先级，发送成功后标记所有消息为已推送
+    """
+    if len(jobs) == 1:
+        return jobs[0]
+
+    first, last = jobs[0], jobs[-1]
+    title, message = render_digest(last.channel_name, len(jobs), [job.summary or job.message for job in jobs])
+
+    def on_sent():
+        for job in jobs:
+            if job.on_sent:
+                job.on_sent()
+
+    return PushJob(
+        key=first.key,
+        lane=min((job.lane for job in jobs), key=LANES.index),
+        gotify_url=last.gotify_url,
+        token=last.token,
+        backend=last.backend,
+        title=title,
+        message=message,
+        priority=max(job.priority for job in jobs),
+        on_sent=on_sent,
+        enqueued_at=first.enqueued_at,
+        group=first.group,
+        channel_name=last.channel_name,
+        members=jobs[1:],
+    )
+
+
+def lane_priority(lane: str, rendered_priority: int) -> int:
+    """获取通道对应的 Gotify 优先级"""
+    default = DEFAULT_LANE_PRIORITIES.get(lane, rendered_priority)
+    return int_config(get_cached_config(), f"LANE_PRIORITY_{lane.upper()}", default)
+
+
+class LaneStats:
+    """单个通道的发送统计"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0  # 被合并进其他通知、没有单独发送的消息数
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def record(self, success: bool, latency: float) -> None:
+        if success:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.latencies.append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "latency_avg": round(sum(samples) / len(samples), 3) if samples else None,
+            "latency_p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3) if samples else None,
+            "latency_max": round(samples[-1], 3) if samples else None,
+        }
+
+
+class PushDispatcher:
+    """
+    优先级推送调度器
+
+    每个通道一个队列，发送线程总是从优先级最高的非空队列取任务；
+    同一 (频道, 消息, 用户) 在发送完成前只会排队一次。
+    设置了 hold 的任务先放入合并缓冲区，分组的第一条消息到期时整组合并后入队。
+    取任务时跳过令牌桶已空的服务器/Token，限流的任务不会丢弃，只是推迟发送。
+    多个发送线程共享各后端的连接池：一个线程一次取出发往同一目标的一批任务按顺序发送，
+    同一目标同时只有一个线程在发送，每个服务器的并发批次数不超过 max_per_server
+    """
+
+    def __init__(self, send: Callable[..., bool], workers: int = PUSH_WORKERS,
+                 max_per_server: int = PUSH_MAX_PER_SERVER, batch_size: int = PUSH_BATCH_SIZE):
+        """
+        Args:
+            send: 发送函数 send(backend, url, token, title, message, priority) -> bool
+            workers: 发送线程数
+            max_per_server: 每个服务器同时发送的最大批次数
+            batch_size: 每批最多的推送数
+        """
+        self._send = send
+        self._worker_count = max(1, workers)
+        self._max_per_server = max(1, max_per_server)
+        self._batch_size = max(1, batch_size)
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[PushJob]] = {lane: deque() for lane in LANES}
+        self._stats: Dict[str, LaneStats] = {lane: LaneStats() for lane in LANES}
+        self._pending: set = set()
+        # 合并缓冲区: 分组 -> (到期时间, 任务列表)
+        self._held: Dict[Tuple[str, int], Tuple[float, List[PushJob]]] = {}
+        self._flush_all = False
+        self._limiter = RateLimiter()
+        self._busy = 0
+        self._batches = 0
+        self._active_targets: set = set()
+        self._server_in_flight: Dict[str, int] = {}
+        self._workers: List[threading.Thread] = []
+
+    def submit(self, job: PushJob) -> bool:
+        """
+        提交推送任务
+
+        Returns:
+            bool: 是否已加入队列（重复的任务返回 False）
+        """
+        with self._cond:
+            if job.key in self._pending:
+                logger.debug("推送任务已在队列中，跳过: %s", job.key)
+                return False
+            self._pending.add(job.key)
+            if job.hold > 0 and job.group is not None and not self._flush_all:
+                self._held.setdefault(job.group, (job.enqueued_at + job.hold, []))[1].append(job)
+            else:
+                self._queues[job.lane].append(job)
+            self._ensure_worker()
+            self._cond.notify()
+        return True
+
+    def is_pending(self, key: Tuple[str, str, int]) -> bool:
+        """任务是否已在队列或合并缓冲区中"""
+        with self._cond:
+            return key in self._pending
+
+    def _release_held(self) -> Optional[float]:
+        """
+        将到期的分组合并后移入发送队列（需持有锁）
+
+        Returns:
+            float: 距离下一个分组到期的秒数，没有等待中的分组时返回 None
+        """
+        now = time.monotonic()
+        next_due = None
+        for group in list(self._held):
+            due, jobs = self._held[group]
+            if self._flush_all or due <= now:
+                del self._held[group]
+                merged = merge_jobs(jobs)
+                self._stats[merged.lane].coalesced += len(merged.members)
+                self._queues[merged.lane].append(merged)
+            elif next_due is None or due < next_due:
+                next_due = due
+        return None if next_due is None else max(0.0, next_due - now)
+
+    def _ensure_worker(self) -> None:
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        while len(self._workers) < self._worker_count:
+            worker = threading.Thread(target=self._run, daemon=True,
+                                      name=f"PushDispatcher-{len(self._workers) + 1}")
+            worker.start()
+            self._workers.append(worker)
+
+    def _acquire(self, job: PushJob) -> float:
+        """为任务获取限流令牌，返回需要等待的秒数（需持有锁）"""
+        wait = self._limiter.try_acquire(job.gotify_url, job.token, count_throttle=not job.throttled)
+        if wait > 0:
+            job.throttled = True
+        return wait
+
+    def _collect_batch(self, batch: List[PushJob], target: Tuple[str, str, str]) -> None:
+        """把队列中发往同一目标的后续任务加入批次，直到达到批次上限或被限流（需持有锁）"""
+        for lane in LANES:
+            queue = self._queues[lane]
+            taken = []
+            for index, job in enumerate(queue):
+                if len(batch) + len(taken) >= self._batch_size:
+                    break
+                if job_target(job) != target:
+                    continue
+                if self._acquire(job) > 0:
+                    break
+                taken.append(index)
+            batch.extend(queue[index] for index in taken)
+            for index in reversed(taken):
+                del queue[index]
+            if len(batch) >= self._batch_size:
+                return
+
+    def _take_batch(self) -> Tuple[List[PushJob], Optional[float]]:
+        """
+        按通道优先级取出第一条可发送的任务及发往同一目标的后续任务（需持有锁）
+
+        跳过正在被其他线程发送的目标、并发已满的服务器以及令牌桶已空的服务器/Token
+
+        Returns:
+            tuple: (任务批次, 最近的限流等待秒数)，没有可发送的任务时批次为空
+        """
+        next_wait = None
+        for lane in LANES:
+            queue = self._queues[lane]
+            blocked = set()
+            for index, job in enumerate(queue):
+                target = job_target(job)
+                if target in blocked:
+                    continue
+                if target in self._active_targets or \
+                        self._server_in_flight.get(target[1], 0) >= self._max_per_server:
+                    blocked.add(target)
+                    continue
+                wait = self._acquire(job)
+                if wait > 0:
+                    blocked.add(target)
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+                del queue[index]
+                batch = [job]
+                self._collect_batch(batch, target)
+                return batch, None
+        return [], next_wait
+
+    def _next_batch(self) -> List[PushJob]:
+        with self._cond:
+            while True:
+                wait = self._release_held()
+                batch, throttle_wait = self._take_batch()
+                if batch:
+                    target = job_target(batch[0])
+                    self._active_targets.add(target)
+                    self._server_in_flight[target[1]] = self._server_in_flight.get(target[1], 0) + 1
+                    self._busy += len(batch)
+                    self._batches += 1
+                    return batch
+                if throttle_wait is not None:
+                    wait = throttle_wait if wait is None else min(wait, throttle_wait)
+                self._cond.wait(wait)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            for job in batch:
+                success = False
+                try:
+                    success = self._send(job.backend, job.gotify_url, job.token, job.title, job.message,
+                                         job.priority)
+                    if success and job.on_sent:
+                        job.on_sent()
+                except Exception as e:
+                    logger.error(f"推送任务执行失败: {e}")
+                finally:
+                    with self._cond:
+                        self._stats[job.lane].record(success, time.monotonic() - job.enqueued_at)
+                        self._pending.difference_update(job.all_keys())
+                        self._busy -= 1
+                        self._cond.notify_all()
+
+            target = job_target(batch[0])
+            with self._cond:
+                self._active_targets.discard(target)
+                self._server_in_flight[target[1]] -= 1
+                if not self._server_in_flight[target[1]]:
+                    del self._server_in_flight[target[1]]
+                self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            queued = sum(len(queue) for queue in self._queues.values())
+            return queued + sum(len(jobs) for _, jobs in self._held.values())
+
+    def totals(self) -> Tuple[int, int]:
+        """所有通道累计的 (发送成功数, 发送失败数)"""
+        with self._cond:
+            return (sum(stats.sent for stats in self._stats.values()),
+                    sum(stats.failed for stats in self._stats.values()))
+
+    def drain(self, timeout: float) -> bool:
+        """
+        等待队列中的推送全部发送完成，合并缓冲区中的消息立即合并发送
+
+        Returns:
+            bool: 是否在超时前发送完成
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_all = True
+            self._cond.notify_all()
+            try:
+                while self._busy or self._held or any(self._queues.values()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning(f"推送队列未能在 {timeout} 秒内发送完成，剩余 {self.queue_depth()} 条")
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_all = False
+        return True
+
+    def sizes(self) -> Dict[str, int]:
+        """内部队列和缓存的大小，用于内存诊断"""
+        with self._cond:
+            return {
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "held": sum(len(jobs) for _, jobs in self._held.values()),
+                "pending_keys": len(self._pending),
+                "rate_limit_buckets": self._limiter.bucket_count(),
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各通道的队列长度和延迟统计、合并缓冲区中等待的消息数以及限流器状态"""
+        with self._cond:
+            snapshot = {
+                lane: dict(self._stats[lane].snapshot(), queued=len(self._queues[lane]))
+                for lane in LANES
+            }
+            snapshot["held"] = sum(len(jobs) for _, jobs in self._held.values())
+            snapshot["held_groups"] = len(self._held)
+            snapshot["rate_limits"] = self._limiter.snapshot()
+            snapshot["workers"] = self._worker_count
+            snapshot["in_flight"] = self._busy
+            snapshot["batches"] = self._batches
+            return snapshot
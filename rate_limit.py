@@ -0,0 +1,174 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+推送限流模块
+按 Gotify 服务器和应用 Token 分别维护令牌桶，避免积压消息一次性涌向自建的 Gotify 服务
+"""
+
+import time
+import hashlib
+from typing import Any, Dict, Tuple
+from urllib.parse import urlsplit
+
+from message_render import get_cached_config
+
+# 默认限流参数，可通过 system_config 覆盖:
+# RATE_LIMIT_SERVER_BURST / RATE_LIMIT_SERVER_RATE（每个 Gotify 服务器）
+# RATE_LIMIT_TOKEN_BURST / RATE_LIMIT_TOKEN_RATE（每个应用 Token）
+# RATE 为每秒补充的令牌数，设置为 0 表示不限流
+DEFAULT_LIMITS = {
+    "SERVER": (20, 5.0),
+    "TOKEN": (10, 1.0),
+}
+
+
+class TokenBucket:
+    """令牌桶，容量为 burst，每秒补充 rate 个令牌"""
+
+    def __init__(self, burst: int, rate: float):
+        self.burst = burst
+        self.rate = rate
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.allowed = 0
+        self.throttled = 0
+
+    def configure(self, burst: int, rate: float) -> None:
+        """更新限流参数，已有令牌数不超过新容量"""
+        self._refill()
+        self.burst = burst
+        self.rate = rate
+        self.tokens = min(self.tokens, float(burst))
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """
+        距离有可用令牌还需等待的秒数
+
+        Returns:
+            float: 0 表示可以立即发送
+        """
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+        self.allowed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        if self.rate > 0:
+            self._refill()
+        return {
+            "burst": self.burst,
+            "rate": self.rate,
+            "tokens": round(self.tokens, 2) if self.rate > 0 else None,
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+        }
+
+
+def server_key(gotify_url: str) -> str:
+    """以 Gotify 服务器地址（协议 + 主机 + 端口）作为限流键"""
+    parts = urlsplit(gotify_url or "")
+    return f"{parts.scheme}://{parts.netloc}" if parts.netloc else (gotify_url or "")
+
+
+def mask_token(token: str) -> str:
+    """指标中不暴露完整 Token，只显示前几位和摘要"""
+    token = token or ""
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=3).hexdigest()
+    return f"{token[:4]}***{digest}"
+
+
+def _float_config(config: Dict[str, str], key: str, default: float) -> float:
+    try:
+        return float(config.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RateLimiter:
+    """
+    推送限流器
+
+    每条推送需要同时从所属服务器和所属 Token 的令牌桶各取一个令牌；
+    本身不加锁，由 PushDispatcher 在持有调度锁时调用
+    """
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def _limits(self, scope: str) -> Tuple[int, float]:
+        config = get_cached_config()
+        default_burst, default_rate = DEFAULT_LIMITS[scope]
+        burst = max(1, int(_float_config(config, f"RATE_LIMIT_{scope}_BURST", default_burst)))
+        rate = max(0.0, _float_config(config, f"RATE_LIMIT_{scope}_RATE", default_rate))
+        return burst, rate
+
+    def _bucket(self, scope: str, key: str) -> TokenBucket:
+        burst, rate = self._limits(scope)
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[(scope, key)] = TokenBucket(burst, rate)
+        elif (bucket.burst, bucket.rate) != (burst, rate):
+            bucket.configure(burst, rate)
+        return bucket
+
+    def try_acquire(self, gotify_url: str, token: str, count_throttle: bool = True) -> float:
+        """
+        尝试为一条推送获取令牌
+
+        Args:
+            gotify_url: Gotify 推送地址
+            token: Gotify 应用 Token
+            count_throttle: 获取失败时是否计入 throttled 统计（同一条推送只计一次）
+
+        Returns:
+            float: 0 表示已获取令牌可以发送，否则为需要等待的秒数（此时不消耗令牌）
+        """
+        buckets = (self._bucket("SERVER", server_key(gotify_url)), self._bucket("TOKEN", token or ""))
+        wait = max(bucket.wait_time() for bucket in buckets)
+        if wait > 0:
+            for bucket in buckets:
+                if count_throttle and bucket.wait_time() > 0:
+                    bucket.throttled += 1
+            return wait
+        for bucket in buckets:
+            bucket.consume()
+        return 0.0
+
+    def bucket_count(self) -> int:
+        """当前令牌桶的数量"""
+        return len(self._buckets)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各令牌桶的状态"""
+        return {
+            "servers": {key: bucket.snapshot() for (scope, key), bucket in self._buckets.items()
+                        if scope == "SERVER"},
+            "tokens": {mask_token(key): bucket.snapshot() for (scope, key), bucket in self._buckets.items()
+                       if scope == "TOKEN"},
+        }
@@ -0,0 +1,132 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+启动过程跟踪
+启动分为快速阶段（数据库迁移检查，完成后即可提供 Web 服务）和后台延迟任务（数据清理、目录同步、启动监控），
+记录每个阶段的耗时供 /api/status 展示
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTracker:
+    """
+    启动状态: starting（延迟任务执行中） -> ready；数据库未初始化时为 uninitialized，初始化完成后为 ready
+
+    单个延迟任务失败只记录错误，不影响后续任务；任务返回 False 表示未执行（如没有用户、会话不可用），记为 skipped
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._monotonic_start = time.monotonic()
+        self._phase = "starting"
+        self._fast_path_seconds: Optional[float] = None
+        self._ready_seconds: Optional[float] = None
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def _elapsed(self) -> float:
+        return round(time.monotonic() - self._monotonic_start, 3)
+
+    def fast_path_done(self) -> None:
+        """快速阶段完成，Web 服务可以开始处理请求"""
+        with self._lock:
+            self._fast_path_seconds = self._elapsed()
+        logger.info(f"启动快速阶段完成，耗时 {self._fast_path_seconds} 秒")
+
+    def _run_task(self, name: str, task: Callable[[], Any]) -> None:
+        with self._lock:
+            self._tasks[name] = {"status": "running", "duration": None}
+        started = time.monotonic()
+        try:
+            if task() is False:
+                logger.info(f"启动任务 {name} 未执行")
+                status, error = "skipped", None
+            else:
+                status, error = "done", None
+        except Exception as e:
+            logger.error(f"启动任务 {name} 失败: {e}")
+            status, error = "failed", str(e)
+        with self._lock:
+            self._tasks[name] = {"status": status, "duration": round(time.monotonic() - started, 3)}
+            if error:
+                self._tasks[name]["error"] = error
+
+    def _run_all(self, tasks: List[Tuple[str, Callable[[], Any]]]) -> None:
+        for name, task in tasks:
+            self._run_task(name, task)
+        self.mark_ready()
+
+    def mark_uninitialized(self) -> None:
+        """数据库尚未初始化，不执行延迟任务，等待通过初始化页面完成初始化"""
+        with self._lock:
+            self._phase = "uninitialized"
+        logger.info("数据库未初始化，跳过启动任务")
+
+    def mark_ready(self) -> None:
+        """启动完成（延迟任务执行完毕，或通过初始化页面完成了初始化）"""
+        with self._lock:
+            self._phase = "ready"
+            self._ready_seconds = self._elapsed()
+        logger.info(f"启动完成，总耗时 {self._ready_seconds} 秒")
+
+    def run_deferred(self, tasks: List[Tuple[str, Callable[[], Any]]], background: bool = True) -> None:
+        """
+        按顺序执行延迟任务
+
+        Args:
+            tasks: [(任务名, 函数), ...]
+            background: 是否在后台线程中执行
+        """
+        with self._lock:
+            for name, _ in tasks:
+                self._tasks[name] = {"status": "pending", "duration": None}
+        if not background or not tasks:
+            self._run_all(tasks)
+            return
+        self._thread = threading.Thread(target=self._run_all, args=(tasks,), daemon=True, name="StartupTasks")
+        self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._phase == "ready"
+
+    @property
+    def phase(self) -> str:
+        with self._lock:
+            return self._phase
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "phase": self._phase,
+                "started_at": self._started_at,
+                "uptime": self._elapsed(),
+                "fast_path_seconds": self._fast_path_seconds,
+                "ready_seconds": self._ready_seconds,
+                "tasks": {name: dict(info) for name, info in self._tasks.items()},
+            }
+
+
+startup_tracker = StartupTracker()
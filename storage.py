@@ -0,0 +1,619 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+存储后端抽象
+监控流水线通过 get_storage() 访问推送用户、DSM 目录、消息记录、系统配置和运行统计五个仓库；
+sqlite 实现委托给 use_sql 中的函数，memory 实现完全在内存中运行，用于不受磁盘 I/O 影响地测量流水线吞吐。
+启动时通过环境变量 STORAGE_BACKEND 选择（默认 sqlite）
+
+各方法返回的元组结构与 use_sql 中对应函数相同
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import use_sql
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKENDS = ("sqlite", "memory")
+MONITOR_RUNS_MAX = int(os.environ.get("MONITOR_RUNS_MAX", 17280))  # 保留的监控运行记录数（默认 5 秒一轮至少 24 小时，覆盖页面上最长的每轮视图）
+MONITOR_ROLLUP_DAYS = int(os.environ.get("MONITOR_ROLLUP_DAYS", 365))  # 按小时汇总保留的天数
+
+
+# ======================== 仓库接口 ======================== #
+class UserRepository(ABC):
+    """推送用户及其变更日志"""
+
+    @abstractmethod
+    def all(self) -> List[tuple]:
+        """所有推送用户 (id, is_banned, user_name, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend)"""
+
+    @abstractmethod
+    def get_by_ids(self, user_ids: List[int]) -> List[tuple]:
+        ...
+
+    @abstractmethod
+    def get_by_name(self, user_name: str) -> Optional[tuple]:
+        """完整的用户记录 (id, is_banned, user_name, user_password, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend)"""
+
+    @abstractmethod
+    def update_sid(self, user_name: str, sid: str) -> bool:
+        ...
+
+    @abstractmethod
+    def last_change_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def changes_since(self, change_id: int) -> List[tuple]:
+        """变更记录 [(id, user_id, change_type), ...]"""
+
+    @abstractmethod
+    def in_channel(self, channel_id: str) -> List[tuple]:
+        """频道中已启用的推送用户，见 use_sql.get_push_users_in_channel"""
+
+
+class DirectoryRepository(ABC):
+    """DSM 用户、频道、频道成员以及 Webhook 频道"""
+
+    @abstractmethod
+    def upsert_users(self, users: List[tuple]) -> int:
+        ...
+
+    @abstractmethod
+    def upsert_channels(self, channels: List[tuple]) -> int:
+        ...
+
+    @abstractmethod
+    def user_by_username(self, username: str) -> Optional[tuple]:
+        """DSM 用户 (id, user_id, nickname, username, user_type)"""
+
+    @abstractmethod
+    def user_by_id(self, user_id: str) -> Optional[tuple]:
+        ...
+
+    @abstractmethod
+    def channel_by_id(self, channel_id: str) -> Optional[tuple]:
+        """频道 (id, is_banned, channel_id, channel_name, members, channel_member, channel_type)"""
+
+    @abstractmethod
+    def channel_peer(self, channel_id: str, user_id: str) -> Optional[tuple]:
+        ...
+
+    @abstractmethod
+    def touch_webhook_channel(self, channel_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def webhook_channel_ids(self, hours: int = 24) -> Set[str]:
+        ...
+
+
+class MessageRepository(ABC):
+    """消息记录和按用户的投递记录"""
+
+    @abstractmethod
+    def add(self, channel_id, message_id, message_content, creator_id, create_at) -> bool:
+        ...
+
+    @abstractmethod
+    def is_pushed(self, channel_id, message_id, push_user_id=None) -> bool:
+        ...
+
+    @abstractmethod
+    def mark_pushed(self, channel_id, message_id, push_user_id=None) -> bool:
+        ...
+
+    @abstractmethod
+    def mark_filtered(self, channel_id, message_id, push_user_id) -> bool:
+        """记录消息被过滤规则跳过，is_pushed 对该用户返回 True，但不计入投递"""
+
+    @abstractmethod
+    def cleanup(self, days: int = 7) -> int:
+        """删除过期记录，返回删除的消息数"""
+
+
+class ConfigRepository(ABC):
+    """系统配置"""
+
+    @abstractmethod
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def get_all(self) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str, description: str = "") -> bool:
+        ...
+
+
+class RunRepository(ABC):
+    """监控每轮运行统计"""
+
+    @abstractmethod
+    def add(self, run: Dict[str, Any]) -> bool:
+        """记录一轮统计，字段见 use_sql.add_monitor_run"""
+
+    @abstractmethod
+    def recent(self, since: float = 0, limit: int = MONITOR_RUNS_MAX) -> List[Dict[str, Any]]:
+        """最近的每轮统计（按时间正序）"""
+
+    @abstractmethod
+    def hourly(self, since: float = 0) -> List[Dict[str, Any]]:
+        """按小时汇总的统计（按时间正序）"""
+
+
+class Storage:
+    """一组仓库"""
+
+    name = ""
+
+    def __init__(self, users: UserRepository, directory: DirectoryRepository,
+                 messages: MessageRepository, config: ConfigRepository, runs: RunRepository):
+        self.users = users
+        self.directory = directory
+        self.messages = messages
+        self.config = config
+        self.runs = runs
+
+
+# ======================== SQLite 实现 ======================== #
+class SqliteUserRepository(UserRepository):
+    def all(self):
+        return use_sql.get_user_info()
+
+    def get_by_ids(self, user_ids):
+        return use_sql.get_user_info_by_ids(user_ids)
+
+    def get_by_name(self, user_name):
+        return use_sql.get_user_by_name(user_name)
+
+    def update_sid(self, user_name, sid):
+        return use_sql.update_user_sid(user_name, sid)
+
+    def last_change_id(self):
+        return use_sql.get_last_user_change_id()
+
+    def changes_since(self, change_id):
+        return use_sql.get_user_changes_since(change_id)
+
+    def in_channel(self, channel_id):
+        return use_sql.get_push_users_in_channel(channel_id)
+
+
+class SqliteDirectoryRepository(DirectoryRepository):
+    def upsert_users(self, users):
+        return use_sql.upsert_dsm_users_batch(users)
+
+    def upsert_channels(self, channels):
+        return use_sql.upsert_dsm_channels_batch(channels)
+
+    def user_by_username(self, username):
+        return use_sql.search_dsm_user_id_by_username(username)
+
+    def user_by_id(self, user_id):
+        return use_sql.search_dsm_user_id_by_id(user_id)
+
+    def channel_by_id(self, channel_id):
+        return use_sql.search_channel_by_id(channel_id)
+
+    def channel_peer(self, channel_id, user_id):
+        return use_sql.get_channel_peer(channel_id, user_id)
+
+    def touch_webhook_channel(self, channel_id):
+        use_sql.touch_webhook_channel(channel_id)
+
+    def webhook_channel_ids(self, hours=24):
+        return use_sql.get_webhook_channel_ids(hours)
+
+
+class SqliteMessageRepository(MessageRepository):
+    def add(self, channel_id, message_id, message_content, creator_id, create_at):
+        return use_sql.add_message_history(channel_id, message_id, message_content, creator_id, create_at)
+
+    def is_pushed(self, channel_id, message_id, push_user_id=None):
+        return use_sql.is_message_pushed(channel_id, message_id, push_user_id)
+
+    def mark_pushed(self, channel_id, message_id, push_user_id=None):
+        return use_sql.mark_message_as_pushed(channel_id, message_id, push_user_id)
+
+    def mark_filtered(self, channel_id, message_id, push_user_id):
+        return use_sql.mark_message_filtered(channel_id, message_id, push_user_id)
+
+    def cleanup(self, days=7):
+        return use_sql.delete_old_messages(days)
+
+
+class SqliteConfigRepository(ConfigRepository):
+    def get(self, key, default=None):
+        return use_sql.get_system_config(key, default)
+
+    def get_all(self):
+        return use_sql.get_all_system_config()
+
+    def set(self, key, value, description=""):
+        return use_sql.set_system_config(key, value, description)
+
+
+class SqliteRunRepository(RunRepository):
+    def add(self, run):
+        return use_sql.add_monitor_run(run, MONITOR_RUNS_MAX, MONITOR_ROLLUP_DAYS)
+
+    def recent(self, since=0, limit=MONITOR_RUNS_MAX):
+        return use_sql.get_monitor_runs(since, limit)
+
+    def hourly(self, since=0):
+        return use_sql.get_monitor_run_rollups(since)
+
+
+class SqliteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self):
+        super().__init__(SqliteUserRepository(), SqliteDirectoryRepository(),
+                         SqliteMessageRepository(), SqliteConfigRepository(), SqliteRunRepository())
+
+
+# ======================== 内存实现 ======================== #
+class MemoryState:
+    """内存存储的全部数据，所有仓库共享同一把锁"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.push_users: Dict[int, list] = {}  # id -> [id, is_banned, user_name, user_password, sid, url, token, backend]
+        self.user_changes: List[tuple] = []
+        self.dsm_users: Dict[str, tuple] = {}  # user_id -> (id, user_id, nickname, username, user_type)
+        self.dsm_users_by_name: Dict[str, str] = {}  # username -> user_id
+        self.channels: Dict[str, tuple] = {}  # channel_id -> channel_info 元组
+        self.channel_members: Dict[str, Set[str]] = {}
+        self.webhook_channels: Dict[str, float] = {}
+        self.messages: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.deliveries: Dict[Tuple[str, str, int], float] = {}
+        self.filtered: Dict[Tuple[str, str, int], float] = {}
+        self.config: Dict[str, str] = {}
+        self.runs = deque(maxlen=MONITOR_RUNS_MAX)
+
+
+class MemoryUserRepository(UserRepository):
+    def __init__(self, state: MemoryState):
+        self.state = state
+
+    @staticmethod
+    def _main_fields(row: list) -> tuple:
+        return row[0], row[1], row[2], row[4], row[5], row[6], row[7]
+
+    def all(self):
+        with self.state.lock:
+            return [self._main_fields(row) for row in self.state.push_users.values()]
+
+    def get_by_ids(self, user_ids):
+        with self.state.lock:
+            return [self._main_fields(self.state.push_users[user_id])
+                    for user_id in user_ids if user_id in self.state.push_users]
+
+    def get_by_name(self, user_name):
+        with self.state.lock:
+            for row in self.state.push_users.values():
+                if row[2] == user_name:
+                    return tuple(row)
+        return None
+
+    def update_sid(self, user_name, sid):
+        with self.state.lock:
+            for row in self.state.push_users.values():
+                if row[2] == user_name:
+                    row[4] = sid
+                    return True
+        return False
+
+    def last_change_id(self):
+        with self.state.lock:
+            return self.state.user_changes[-1][0] if self.state.user_changes else 0
+
+    def changes_since(self, change_id):
+        with self.state.lock:
+            return [change for change in self.state.user_changes if change[0] > change_id]
+
+    def in_channel(self, channel_id):
+        with self.state.lock:
+            members = self.state.channel_members.get(str(channel_id), set())
+            result = []
+            for row in self.state.push_users.values():
+                dsm_user_id = self.state.dsm_users_by_name.get(row[2])
+                if row[1] == 0 and dsm_user_id in members:
+                    result.append(self._main_fields(row) + (dsm_user_id,))
+            return result
+
+
+class MemoryDirectoryRepository(DirectoryRepository):
+    def __init__(self, state: MemoryState):
+        self.state = state
+
+    def upsert_users(self, users):
+        with self.state.lock:
+            for user_id, nickname, username, user_type in users:
+                user_id = str(user_id)
+                existing = self.state.dsm_users.get(user_id)
+                row_id = existing[0] if existing else len(self.state.dsm_users) + 1
+                self.state.dsm_users[user_id] = (row_id, user_id, str(nickname), str(username), str(user_type))
+                self.state.dsm_users_by_name[str(username)] = user_id
+        return len(users)
+
+    def upsert_channels(self, channels):
+        with self.state.lock:
+            for channel_id, name, members, member_count, channel_type in channels:
+                channel_id = str(channel_id)
+                existing = self.state.channels.get(channel_id)
+                row_id = existing[0] if existing else len(self.state.channels) + 1
+                is_banned = existing[1] if existing else 0
+                self.state.channels[channel_id] = (row_id, is_banned, channel_id, str(name), str(members),
+                                                   str(member_count), str(channel_type))
+                self.state.channel_members[channel_id] = {str(member) for member in (members or [])}
+        return len(channels)
+
+    def user_by_username(self, username):
+        with self.state.lock:
+            user_id = self.state.dsm_users_by_name.get(username)
+            return self.state.dsm_users.get(user_id) if user_id else None
+
+    def user_by_id(self, user_id):
+        with self.state.lock:
+            return self.state.dsm_users.get(str(user_id))
+
+    def channel_by_id(self, channel_id):
+        with self.state.lock:
+            return self.state.channels.get(str(channel_id))
+
+    def channel_peer(self, channel_id, user_id):
+        with self.state.lock:
+            for member in self.state.channel_members.get(str(channel_id), ()):
+                if member != str(user_id) and member in self.state.dsm_users:
+                    return self.state.dsm_users[member]
+        return None
+
+    def touch_webhook_channel(self, channel_id):
+        with self.state.lock:
+            self.state.webhook_channels[str(channel_id)] = time.time()
+
+    def webhook_channel_ids(self, hours=24):
+        since = time.time() - hours * 3600
+        with self.state.lock:
+            return {channel_id for channel_id, ts in self.state.webhook_channels.items() if ts >= since}
+
+
+class MemoryMessageRepository(MessageRepository):
+    """消息正文始终按原文保存，不做 MESSAGE_STORAGE_MODE 压缩"""
+
+    def __init__(self, state: MemoryState):
+        self.state = state
+
+    def add(self, channel_id, message_id, message_content, creator_id, create_at):
+        key = (str(channel_id), str(message_id))
+        with self.state.lock:
+            if key not in self.state.messages:
+                self.state.messages[key] = {
+                    "message_content": str(message_content),
+                    "creator_id": str(creator_id),
+                    "create_at": create_at,
+                    "is_pushed": 0,
+                    "push_time": time.time(),
+                }
+        return True
+
+    def is_pushed(self, channel_id, message_id, push_user_id=None):
+        with self.state.lock:
+            if push_user_id is not None:
+                key = (str(channel_id), str(message_id), int(push_user_id))
+                return key in self.state.deliveries or key in self.state.filtered
+            message = self.state.messages.get((str(channel_id), str(message_id)))
+            return bool(message and message["is_pushed"] == 1)
+
+    def mark_pushed(self, channel_id, message_id, push_user_id=None):
+        key = (str(channel_id), str(message_id))
+        with self.state.lock:
+            message = self.state.messages.get(key)
+            if message:
+                message["is_pushed"] = 1
+                message["push_time"] = time.time()
+            if push_user_id is not None:
+                self.state.deliveries.setdefault(key + (int(push_user_id),), time.time())
+            return message is not None
+
+    def mark_filtered(self, channel_id, message_id, push_user_id):
+        with self.state.lock:
+            self.state.filtered.setdefault((str(channel_id), str(message_id), int(push_user_id)), time.time())
+        return True
+
+    def cleanup(self, days=7):
+        since = time.time() - days * 86400
+        with self.state.lock:
+            expired = [key for key, message in self.state.messages.items() if message["push_time"] < since]
+            for key in expired:
+                del self.state.messages[key]
+            for key in [key for key, ts in self.state.deliveries.items() if ts < since]:
+                del self.state.deliveries[key]
+            for key in [key for key, ts in self.state.filtered.items() if ts < since]:
+                del self.state.filtered[key]
+        return len(expired)
+
+
+class MemoryConfigRepository(ConfigRepository):
+    def __init__(self, state: MemoryState):
+        self.state = state
+
+    def get(self, key, default=None):
+        with self.state.lock:
+            return self.state.config.get(key, default)
+
+    def get_all(self):
+        with self.state.lock:
+            return dict(self.state.config)
+
+    def set(self, key, value, description=""):
+        with self.state.lock:
+            self.state.config[key] = value
+        return True
+
+
+class MemoryRunRepository(RunRepository):
+    """只保留最近 MONITOR_RUNS_MAX 轮，小时汇总在查询时由保留的记录计算"""
+
+    def __init__(self, state: MemoryState):
+        self.state = state
+
+    def add(self, run):
+        columns = ('started_at', 'duration') + use_sql.MONITOR_RUN_FIELDS
+        with self.state.lock:
+            self.state.runs.append({column: run.get(column, 0) for column in columns})
+        return True
+
+    def recent(self, since=0, limit=MONITOR_RUNS_MAX):
+        with self.state.lock:
+            runs = [dict(run) for run in self.state.runs if run['started_at'] >= since]
+        return runs[-limit:] if limit else []
+
+    def hourly(self, since=0):
+        rollups: Dict[int, Dict[str, Any]] = {}
+        for run in self.recent(since):
+            hour = int(run['started_at'] // 3600 * 3600)
+            rollup = rollups.get(hour)
+            if rollup is None:
+                rollup = {'hour': hour, 'cycles': 0, 'total_duration': 0.0, 'max_duration': 0.0}
+                rollup.update((field, 0) for field in use_sql.MONITOR_RUN_FIELDS)
+                rollups[hour] = rollup
+            rollup['cycles'] += 1
+            rollup['total_duration'] += run['duration']
+            rollup['max_duration'] = max(rollup['max_duration'], run['duration'])
+            for field in use_sql.MONITOR_RUN_FIELDS:
+                rollup[field] += run[field]
+        for rollup in rollups.values():
+            rollup['avg_duration'] = rollup['total_duration'] / rollup['cycles']
+        return [rollups[hour] for hour in sorted(rollups)]
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self):
+        self.state = MemoryState()
+        super().__init__(MemoryUserRepository(self.state), MemoryDirectoryRepository(self.state),
+                         MemoryMessageRepository(self.state), MemoryConfigRepository(self.state),
+                         MemoryRunRepository(self.state))
+
+    def add_push_user(self, user_name: str, user_password: str = "", sid: str = "", gotify_url: str = "",
+                      gotify_token: str = "", push_backend: str = "gotify", is_banned: int = 0) -> int:
+        """添加推送用户（用于压测时直接构造数据）"""
+        with self.state.lock:
+            user_id = max(self.state.push_users, default=0) + 1
+            self.state.push_users[user_id] = [user_id, is_banned, user_name, user_password, sid,
+                                              gotify_url, gotify_token, push_backend]
+            change_id = len(self.state.user_changes) + 1
+            self.state.user_changes.append((change_id, user_id, "add"))
+            return user_id
+
+    def load_from_sqlite(self, db_file: str) -> None:
+        """
+        从 SQLite 数据库复制推送用户、DSM 目录和系统配置，消息记录不复制
+
+        Args:
+            db_file: 数据库文件路径
+        """
+        conn = None
+        try:
+            conn = sqlite3.connect(db_file)
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, is_banned, user_name, user_password, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend
+                FROM push_users
+            """)
+            push_users = {row[0]: list(row) for row in cursor.fetchall()}
+            cursor.execute("SELECT user_id, nickname, username, user_type FROM user_info")
+            dsm_users = cursor.fetchall()
+            cursor.execute("SELECT * FROM channel_info")
+            channels = {str(row[2]): row for row in cursor.fetchall()}
+            cursor.execute("SELECT channel_id, user_id FROM channel_members")
+            members = cursor.fetchall()
+            cursor.execute("SELECT config_key, config_value FROM system_config")
+            config = dict(cursor.fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"从 SQLite 加载内存存储失败: {e}")
+            return
+        finally:
+            if conn:
+                conn.close()
+
+        self.directory.upsert_users(dsm_users)
+        with self.state.lock:
+            self.state.push_users = push_users
+            self.state.channels.update(channels)
+            for channel_id, user_id in members:
+                self.state.channel_members.setdefault(str(channel_id), set()).add(str(user_id))
+            self.state.config = config
+        logger.info(f"内存存储已从 {db_file} 加载 {len(push_users)} 个推送用户、{len(dsm_users)} 个DSM用户、"
+                    f"{len(channels)} 个频道")
+
+
+_storage: Storage = SqliteStorage()
+
+
+def get_storage() -> Storage:
+    """当前使用的存储后端"""
+    return _storage
+
+
+def set_storage(storage: Storage) -> None:
+    """替换存储后端（启动时或压测脚本中调用）"""
+    global _storage
+    _storage = storage
+    logger.info(f"使用存储后端: {storage.name}")
+
+
+def init_storage(backend: Optional[str] = None) -> Storage:
+    """
+    按 STORAGE_BACKEND 环境变量初始化存储后端
+
+    memory 后端会从现有数据库复制推送用户、DSM 目录和系统配置，之后的运行不再读写磁盘，
+    管理界面对数据库的修改不会同步到内存存储
+
+    Args:
+        backend: sqlite / memory，默认读取环境变量
+
+    Returns:
+        Storage: 初始化后的存储后端
+    """
+    backend = backend or os.environ.get("STORAGE_BACKEND", "sqlite")
+    if backend not in STORAGE_BACKENDS:
+        logger.warning(f"不支持的存储后端: {backend}，使用 sqlite")
+        backend = "sqlite"
+
+    if backend == "memory":
+        storage = MemoryStorage()
+        if os.path.exists(use_sql.DB_FILE):
+            storage.load_from_sqlite(use_sql.DB_FILE)
+        set_storage(storage)
+    elif _storage.name != "sqlite":
+        set_storage(SqliteStorage())
+    return _storage
@@ -19,23 +19,50 @@ limitations under the License.
 提供与群晖Chat API的交互、消息监控和推送功能
 """
 
+import os
+import re
 import json
 import time
+import codecs
 import logging
+import threading
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterable, Iterator
 
 import requests
 import urllib3
 
 import use_sql
-from use_sql import add_dsm_users_info
+import mem_debug
+import dsm_capture
+from storage import get_storage
+from log_setup import setup_logging
+from message_render import render_notification, reload_templates, compile_template
+from user_registry import user_registry
+from push_backends import get_backend, has_push_target, send_notification
+from filter_rules import ALLOW_ALL, ChannelPolicy, channel_policy, policy_cache_size
+from push_dispatcher import PushDispatcher, PushJob, classify_message, lane_priority, coalesce_hold
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 # 全局常量
 REQUEST_TIMEOUT = 30  # 请求超时时间（秒）
+STREAM_CHUNK_SIZE = 64 * 1024  # 流式读取响应的块大小（字节）
+SYNC_BATCH_SIZE = 500  # 同步用户/频道时每批写入数据库的数量
+POLL_INTERVAL = 5  # 每轮监控的间隔（秒）
+ERROR_RETRY_INTERVAL = 10  # 监控循环出错后的重试间隔（秒）
+MONITOR_DRAIN_TIMEOUT = int(os.environ.get("MONITOR_DRAIN_TIMEOUT", 30))  # 停止监控时等待推送队列发送完成的最长时间（秒）
+WEBHOOK_COVERAGE_HOURS = 24  # 频道在该时间内收到过 Webhook 推送即视为由 Webhook 覆盖（小时）
+WEBHOOK_RECONCILE_INTERVAL = 300  # Webhook 覆盖的频道对账轮询间隔（秒）
+
+# 监控线程控制：stop 使循环退出，reload 使配置重新加载，wake 打断两轮之间的等待
+monitor_stop_event = threading.Event()
+
+# 本轮监控的频道消息缓存: {频道ID: (获取条数, 消息列表)}，只在监控线程中使用
+_cycle_post_cache: Dict[str, tuple] = {}
+monitor_reload_event = threading.Event()
+monitor_wake_event = threading.Event()
 
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -51,7 +78,7 @@ def get_base_url() -> str:
     Raises:
         Exception: 当BASE_URL未配置时抛出异常
     """
-    base_url = use_sql.get_system_config("BASE_URL")
+    base_url = get_storage().config.get("BASE_URL")
     if not base_url:
         error_msg = "BASE_URL未在系统配置中设置，请先完成系统初始化"
         logger.error(error_msg)
@@ -64,7 +91,7 @@ def get_base_url() -> str:
     # 移除末尾的斜杠
     base_url = base_url.rstrip('/')
 
-    logger.debug(f"使用BASE_URL: {base_url}")
+    logger.debug("使用BASE_URL: %s", base_url)
     return base_url
 
 
@@ -98,11 +125,12 @@ def get_syno_sid(username: str, password: str) -> str:
 
     try:
         resp = requests.get(auth_url, params=params, verify=False, timeout=REQUEST_TIMEOUT)
+        count_cycle("dsm_calls")
         data = resp.json()
 
         if data.get("success"):
             sid = data["data"]["sid"]
-            logger.info(f"获取SID成功: {sid}")
+            logger.info(f"用户 {username} 获取SID成功")
             return sid
         else:
             error_msg = f"群晖登录失败: {data}"
@@ -115,10 +143,87 @@ def get_syno_sid(username: str, password: str) -> str:
         raise Exception(error_msg)
 
 
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """
+    从分块的JSON响应中逐个解析指定数组的元素，不需要把整个响应读入内存
+
+    Args:
+        chunks: 响应内容的字节块（如 resp.iter_content()）
+        key: 数组对应的键名，如 "users"、"channels"
+
+    Yields:
+        数组中的每个元素
+
+    Raises:
+        ValueError: 响应中没有找到该数组，或JSON不完整
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    head = ""
+
+    def read_more() -> bool:
+        nonlocal buf
+        for chunk in chunks:
+            if chunk:
+                buf += text_decoder.decode(chunk)
+                return True
+        return False
+
+    # 定位数组起始位置，未找到时只保留末尾少量字符，避免缓冲区增长
+    while True:
+        match = pattern.search(buf)
+        if match:
+            pos = match.end()
+            break
+        head = (head + buf)[:200]
+        buf = buf[-len(key) - 16:]
+        if not read_more():
+            raise ValueError(f"响应中未找到 {key} 列表: {head}")
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buf):
+            buf, pos = "", 0
+            if not read_more():
+                raise ValueError(f"{key} 列表不完整")
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # 元素跨越了数据块边界，丢弃已解析部分后继续读取
+            buf, pos = buf[pos:], 0
+            if not read_more():
+                raise ValueError(f"{key} 列表不完整")
+            continue
+        yield item
+        pos = end
+
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """将迭代器按固定大小分批"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def get_user_info(sid: str) -> None:
     """
     获取群晖用户信息并保存到数据库
 
+    用户列表按流式解析，每 SYNC_BATCH_SIZE 个用户批量写入一次，内存占用与用户总数无关
+
     Args:
         sid: 会话ID
     """
@@ -134,36 +239,39 @@ def get_user_info(sid: str) -> None:
     }
 
     try:
-        resp = requests.post(url, data=payload, verify=False, timeout=REQUEST_TIMEOUT)
-        data = resp.json()
-
-        if data.get("success"):
-            users = data["data"]["users"]
+        started = time.monotonic()
+        with requests.post(url, data=payload, verify=False, timeout=REQUEST_TIMEOUT, stream=True) as resp:
+            chunks = resp.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            if dsm_capture.recorder:
+                chunks = dsm_capture.recorder.tee(chunks, payload, resp.status_code, started)
+            users = iter_json_array(chunks, "users")
+            # 只处理有效用户（type不为空的用户）
+            rows = (
+                (user['user_id'], user.get('nickname', ''), user.get('username', ''), user.get('type', ''))
+                for user in users if user.get('type') != ""
+            )
             user_count = 0
+            for batch in iter_batches(rows, SYNC_BATCH_SIZE):
+                user_count += get_storage().directory.upsert_users(batch)
+            if dsm_capture.recorder:
+                # 读完数组之后剩余的响应内容，录制完整响应
+                for _ in chunks:
+                    pass
 
-            for user in users:
-                # 只处理有效用户（type不为空的用户）
-                if user.get('type') != "":
-                    add_dsm_users_info(
-                        user['user_id'],
-                        user.get('nickname', ''),
-                        user.get('username', ''),
-                        user.get('type', '')
-                    )
-                    user_count += 1
-
-            logger.info(f"用户信息同步完成，共处理 {user_count} 个用户")
-        else:
-            logger.error(f"获取用户信息失败: {data}")
+        logger.info(f"用户信息同步完成，共处理 {user_count} 个用户")
 
     except requests.exceptions.RequestException as e:
         logger.error(f"请求用户信息失败: {str(e)}")
+    except ValueError as e:
+        logger.error(f"获取用户信息失败: {str(e)}")
 
 
 def write_channel_info_sql(sid: str) -> None:
     """
     获取群晖频道信息并保存到数据库
 
+    频道列表按流式解析，每 SYNC_BATCH_SIZE 个频道批量写入一次
+
     Args:
         sid: 会话ID
     """
@@ -179,21 +287,23 @@ def write_channel_info_sql(sid: str) -> None:
     }
 
     try:
-        resp = requests.post(url, data=payload, verify=False, timeout=REQUEST_TIMEOUT)
-        resp.raise_for_status()
-
-        channels = resp.json()["data"]["channels"]
-        channel_count = 0
-
-        for channel in channels:
-            use_sql.add_dsm_channel_info(
-                channel["channel_id"],
-                channel.get("name", ""),
-                channel.get("members", []),
-                channel["total_member_count"],
-                channel['type']
+        with requests.post(url, data=payload, verify=False, timeout=REQUEST_TIMEOUT, stream=True) as resp:
+            resp.raise_for_status()
+
+            channels = iter_json_array(resp.iter_content(chunk_size=STREAM_CHUNK_SIZE), "channels")
+            rows = (
+                (
+                    channel["channel_id"],
+                    channel.get("name", ""),
+                    channel.get("members", []),
+                    channel["total_member_count"],
+                    channel['type']
+                )
+                for channel in channels
             )
-            channel_count += 1
+            channel_count = 0
+            for batch in iter_batches(rows, SYNC_BATCH_SIZE):
+                channel_count += get_storage().directory.upsert_channels(batch)
 
         logger.info(f"频道信息同步完成，共处理 {channel_count} 个频道")
 
@@ -203,51 +313,24 @@ def write_channel_info_sql(sid: str) -> None:
         logger.error(f"处理频道信息失败: {str(e)}")
 
 
-def message_send(gotify_url: str, token: str, title: str, message: str) -> bool:
+def message_send(gotify_url: str, token: str, title: str, message: str, priority: int = 8) -> bool:
     """
-    通过Gotify发送推送消息
+    通过Gotify发送推送消息（复用 Gotify 后端的连接池）
     """
-    logger.debug(f"准备发送Gotify消息，标题: {title}")
+    return get_backend("gotify").send(gotify_url, token, title, message, priority)
 
-    # 确保消息不为空
-    if not message:
-        message = '[请打开群晖chat查看]'
-        logger.debug("消息为空，使用默认消息")
 
-    payload = {
-        "title": title,
-        "message": message,
-        "priority": 8
-    }
-
-    # 构建完整的URL
-    url = f"{gotify_url}?token={token}"
-
-    logger.debug(f"发送到URL: {url}")
-    logger.debug(f"Payload内容: {payload}")
-
-    try:
-        resp = requests.post(url, json=payload, timeout=REQUEST_TIMEOUT)
+# 推送调度器，所有推送经由优先级队列发送
+push_dispatcher = PushDispatcher(send_notification)
 
-        logger.debug(f"响应状态码: {resp.status_code}")
-        logger.debug(f"响应头: {resp.headers}")
-        logger.debug(f"响应内容: {resp.text}")
+# 登记进程内缓存和队列，供内存诊断接口查看
+mem_debug.register_size("push_dispatcher", push_dispatcher.sizes)
+mem_debug.register_size("cycle_post_cache", lambda: len(_cycle_post_cache))
+mem_debug.register_size("user_registry", user_registry.size)
+mem_debug.register_size("template_cache", lambda: compile_template.cache_info().currsize)
+mem_debug.register_size("filter_policy_cache", policy_cache_size)
 
-        result = resp.json()
 
-        if resp.status_code == 200:
-            logger.info(f"Gotify消息发送成功: {title}")
-            return True
-        else:
-            logger.error(f"Gotify消息发送失败: {result}")
-            return False
-
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Gotify请求失败: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(f"未知错误: {str(e)}")
-        return False
 def get_channels(sid: str) -> List[Dict[str, Any]]:
     """
     获取用户的所有频道信息（包含未读消息数）
@@ -267,8 +350,12 @@ def get_channels(sid: str) -> List[Dict[str, Any]]:
     }
 
     try:
+        started = time.monotonic()
         resp = requests.post(url, data=payload, verify=False, timeout=REQUEST_TIMEOUT)
+        count_cycle("dsm_calls")
         data = resp.json()
+        if dsm_capture.recorder:
+            dsm_capture.recorder.record(payload, resp.status_code, time.monotonic() - started, data)
 
         # 更详细的错误日志
         if not data.get("success"):
@@ -278,7 +365,7 @@ def get_channels(sid: str) -> List[Dict[str, Any]]:
             raise Exception(error_msg)
 
         channels = data["data"]["channels"]
-        logger.debug(f"成功获取 {len(channels)} 个频道")
+        logger.debug("成功获取 %d 个频道", len(channels))
         return channels
 
     except requests.exceptions.RequestException as e:
@@ -322,10 +409,10 @@ def process_single_message(channel_id: str, channel_name: str, message_data: Dic
         message_content = message_data["content"]
         creator_id = message_data["creator_id"]
 
-        logger.info(f"开始处理消息: 频道={channel_name}, 消息ID={message_id}")
+        logger.debug("开始处理消息: 频道=%s, 消息ID=%s", channel_name, message_id)
 
         # 首先获取频道信息来判断频道类型
-        channel_info = use_sql.search_channel_by_id(channel_id)
+        channel_info = get_storage().directory.channel_by_id(channel_id)
 
         if not channel_info:
             logger.warning(f"未找到频道信息: {channel_id}")
@@ -335,84 +422,77 @@ def process_single_message(channel_id: str, channel_name: str, message_data: Dic
         # channel_info 结构: (id, is_banned, channel_id, channel_name, members, channel_member, channel_type)
         channel_type = channel_info[6] if len(channel_info) > 6 else None
 
-        logger.debug(f"频道类型: {channel_type}, 频道名称: {channel_name}")
+        logger.debug("频道类型: %s, 频道名称: %s", channel_type, channel_name)
 
         # 私聊频道处理 (anonymous)
         if channel_type == 'anonymous':
-            logger.debug(f"处理私聊频道: {channel_id}")
-
-            members_str = channel_info[4]  # members字段
-            if members_str:
-                # 解析成员列表
-                members = [int(x.strip()) for x in members_str.strip("[]").split(",")]
-                current_user_id = int(use_sql.search_dsm_user_id_by_username(user_info[2])[1])
-
-                # 检查当前用户是否在频道成员中
-                if current_user_id in members:
-                    # 获取其他成员（排除当前用户）
-                    other_members = [m for m in members if m != current_user_id]
-                    if other_members:
-                        other_user = use_sql.search_dsm_user_id_by_id(other_members[0])
-                        if other_user:
-                            # 使用辅助函数获取显示名称
-                            display_name = get_display_name(other_user)
-                            title = display_name
-                            final_message = f'来自{title}的消息：{message_content}'
-
-                            # 推送消息
-                            if message_send(user_info[4], user_info[5], title, final_message):
-                                use_sql.mark_message_as_pushed(channel_id, message_id)
-                                logger.info(f"私聊频道消息推送成功: {message_id}")
-                                return True
-                        else:
-                            logger.warning(f"未找到对方用户信息: {other_members[0]}")
-                    else:
-                        logger.warning(f"私聊频道 {channel_id} 没有其他成员")
-                else:
-                    logger.warning(f"当前用户 {current_user_id} 不在私聊频道成员中")
-            else:
-                logger.warning(f"私聊频道 {channel_id} 成员信息为空")
+            logger.debug("处理私聊频道: %s", channel_id)
 
-        # 机器人频道处理 (chatbot)
-        elif channel_type == 'chatbot':
-            logger.debug(f"处理机器人频道: {channel_id}")
+            current_user = get_storage().directory.user_by_username(user_info[2])
+            if not current_user:
+                logger.warning(f"未找到当前用户 {user_info[2]} 的DSM用户信息")
+                return False
 
-            # 机器人频道的标题直接使用频道名称
-            title = f"机器人 - {channel_name}" if channel_name else "机器人频道"
-            final_message = message_content
+            # 从 channel_members 表中查找对方用户
+            other_user = get_storage().directory.channel_peer(channel_id, current_user[1])
+            if not other_user:
+                logger.warning(f"私聊频道 {channel_id} 未找到对方用户信息")
+                return False
 
-            # 推送消息
-            if message_send(user_info[4], user_info[5], title, final_message):
-                use_sql.mark_message_as_pushed(channel_id, message_id)
-                logger.info(f"机器人频道消息推送成功: {message_id}")
-                return True
-            else:
-                logger.error(f"机器人频道消息推送失败: {message_id}")
+            kind = "anonymous"
+            sender = get_display_name(other_user)
+
+        # 机器人频道处理 (chatbot)
+        elif channel_type == 'chatbot':
+            logger.debug("处理机器人频道: %s", channel_id)
+            kind = "chatbot"
+            sender = ""
 
         # 普通群组频道处理 (其他类型)
         else:
-            logger.debug(f"处理普通频道: {channel_id}")
+            logger.debug("处理普通频道: %s", channel_id)
 
             # 尝试获取发送者信息
-            sender_info = use_sql.search_dsm_user_id_by_id(creator_id)
-
+            sender_info = get_storage().directory.user_by_id(creator_id)
             if sender_info:
-                # 使用辅助函数获取显示名称
-                display_name = get_display_name(sender_info)
-                title = f"{channel_name} - {display_name}"
+                kind = "channel"
+                sender = get_display_name(sender_info)
             else:
-                title = f"频道: {channel_name}"
-
-            # 构建消息内容
-            final_message = message_content
-
-            # 推送消息
-            if message_send(user_info[4], user_info[5], title, final_message):
-                use_sql.mark_message_as_pushed(channel_id, message_id)
-                logger.info(f"普通频道消息推送成功: {message_id}")
-                return True
+                kind = "channel_no_sender"
+                sender = ""
+
+        title, final_message, priority = render_notification(kind, channel_name, sender, message_content)
+
+        # 按频道类型、是否提及目标用户和自定义规则选择优先级通道
+        dsm_user = None
+        if message_content and "@" in message_content:
+            dsm_user = get_storage().directory.user_by_username(user_info[2])
+        lane = classify_message(channel_id, channel_type, message_content, dsm_user)
+
+        # 加入推送队列，发送成功后标记为已推送；配置了合并窗口的频道先进入合并缓冲区
+        push_user_id = user_info[0]
+        hold = coalesce_hold(channel_id, channel_type, lane)
+        job = PushJob(
+            key=(str(channel_id), str(message_id), push_user_id),
+            lane=lane,
+            gotify_url=user_info[4],
+            token=user_info[5],
+            backend=user_info[6] if len(user_info) > 6 else "gotify",
+            title=title,
+            message=final_message,
+            priority=lane_priority(lane, priority),
+            on_sent=lambda: get_storage().messages.mark_pushed(channel_id, message_id, push_user_id),
+            group=(str(channel_id), push_user_id),
+            hold=hold,
+            channel_name=channel_name,
+            summary=f"{sender}: {message_content}" if sender else message_content,
+        )
+        if push_dispatcher.submit(job):
+            if hold > 0:
+                logger.info("%s 频道消息已加入合并缓冲区，%.0f 秒后发送: %s", kind, hold, message_id)
             else:
-                logger.error(f"普通频道消息推送失败: {message_id}")
+                logger.info("%s 频道消息已加入 %s 推送队列: %s", kind, lane, message_id)
+            return True
 
         logger.warning(f"消息处理失败: {message_id}")
         return False
@@ -436,7 +516,7 @@ def get_channel_messages(sid: str, channel_id: str, limit: int = 10) -> List[Dic
         List[Dict]: 消息列表
     """
     base_url = get_base_url()
-    logger.debug(f"获取频道 {channel_id} 的 {limit} 条消息")
+    logger.debug("获取频道 %s 的 %s 条消息", channel_id, limit)
 
     url = f"{base_url}/webapi/entry.cgi"
     payload = {
@@ -450,11 +530,15 @@ def get_channel_messages(sid: str, channel_id: str, limit: int = 10) -> List[Dic
     }
 
     try:
+        started = time.monotonic()
         resp = requests.post(url, data=payload, verify=False, timeout=REQUEST_TIMEOUT)
+        count_cycle("dsm_calls")
         data = resp.json()
+        if dsm_capture.recorder:
+            dsm_capture.recorder.record(payload, resp.status_code, time.monotonic() - started, data)
         posts = data.get("data", {}).get("posts", [])
 
-        logger.debug(f"获取到 {len(posts)} 条消息")
+        logger.debug("获取到 %d 条消息", len(posts))
         return posts
 
     except requests.exceptions.RequestException as e:
@@ -465,7 +549,43 @@ def get_channel_messages(sid: str, channel_id: str, limit: int = 10) -> List[Dic
         return []
 
 
-def get_unread_messages(sid: str, channel_id: str, unread_count: int) -> List[Dict[str, Any]]:
+def begin_cycle_post_cache() -> None:
+    """开始新一轮监控时清空频道消息缓存"""
+    _cycle_post_cache.clear()
+
+
+def get_cached_channel_messages(sid: str, channel_id: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    获取频道最近 limit 条消息，同一轮监控中同一频道只请求一次
+
+    多个用户在同一频道时，后续用户直接复用本轮已获取的消息；
+    缓存的条数不足时重新获取更多消息并替换缓存
+
+    Args:
+        sid: 会话ID
+        channel_id: 频道ID
+        limit: 需要的消息数量
+
+    Returns:
+        List[Dict]: 消息列表，保持接口返回的顺序
+    """
+    cached = _cycle_post_cache.get(channel_id)
+    if cached and cached[0] >= limit:
+        cached_limit, posts = cached
+        if cached_limit == limit or len(posts) <= limit:
+            return posts
+        # 只保留最新的 limit 条，顺序与接口返回一致
+        latest = {id(post) for post in sorted(posts, key=lambda p: p.get("create_at", 0), reverse=True)[:limit]}
+        return [post for post in posts if id(post) in latest]
+
+    posts = get_channel_messages(sid, channel_id, limit)
+    if posts:
+        _cycle_post_cache[channel_id] = (limit, posts)
+    return posts
+
+
+def get_unread_messages(sid: str, channel_id: str, unread_count: int,
+                        push_user_id: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     获取未读消息
 
@@ -473,13 +593,14 @@ def get_unread_messages(sid: str, channel_id: str, unread_count: int) -> List[Di
         sid: 会话ID
         channel_id: 频道ID
         unread_count: 未读消息数量
+        push_user_id: 推送用户ID，指定时按该用户的投递记录判断是否已推送
 
     Returns:
         List[Dict]: 未读消息列表
     """
     # 获取比未读数稍多一些的消息，确保覆盖所有未读
     limit = min(unread_count + 5, 50)  # 最多获取50条
-    all_messages = get_channel_messages(sid, channel_id, limit)
+    all_messages = get_cached_channel_messages(sid, channel_id, limit)
 
     unread_messages = []
     for message in all_messages:
@@ -492,10 +613,12 @@ def get_unread_messages(sid: str, channel_id: str, unread_count: int) -> List[Di
         create_at = message.get("create_at", 0)
 
         # 记录消息到数据库（如果不存在）
-        use_sql.add_message_history(channel_id, message_id, message_content, creator_id, create_at)
+        get_storage().messages.add(channel_id, message_id, message_content, creator_id, create_at)
 
-        # 检查是否已推送
-        if not use_sql.is_message_pushed(channel_id, message_id):
+        # 检查是否已推送，已在推送队列或合并缓冲区中等待发送的消息同样跳过
+        pending = push_user_id is not None and \
+            push_dispatcher.is_pending((str(channel_id), str(message_id), push_user_id))
+        if not pending and not get_storage().messages.is_pushed(channel_id, message_id, push_user_id):
             # 格式化时间戳
             timestamp = datetime.fromtimestamp(int(create_at) / 1000).strftime("%Y-%m-%d %H:%M:%S")
             formatted_content = f"{message_content}"
@@ -508,15 +631,48 @@ def get_unread_messages(sid: str, channel_id: str, unread_count: int) -> List[Di
                 "is_new": True
             })
 
-            logger.debug(f"发现未推送消息: {message_id}")
+            logger.debug("发现未推送消息: %s", message_id)
         else:
-            logger.debug(f"消息已推送过，跳过: {message_id}")
+            logger.debug("消息已推送过，跳过: %s", message_id)
 
-    logger.info(f"频道 {channel_id} 共有 {len(unread_messages)} 条未推送消息")
+    logger.debug("频道 %s 共有 %d 条未推送消息", channel_id, len(unread_messages))
     return unread_messages
 
 
-def process_channel_messages(sid: str, channel_id: str, channel_name: str, user_info: tuple) -> bool:
+def get_channel_policy(user_name: str, channel_id: str, channel_info: Optional[tuple],
+                       channel_type: Optional[str] = None) -> ChannelPolicy:
+    """
+    获取推送用户在频道上生效的静音和过滤规则
+
+    Args:
+        user_name: 推送用户名
+        channel_id: 频道ID
+        channel_info: 频道记录 (id, is_banned, channel_id, channel_name, members, channel_member, channel_type)，可为空
+        channel_type: 频道记录不存在时使用的频道类型（如频道列表中的 type）
+    """
+    if channel_info:
+        channel_type = channel_info[6]
+    banned = bool(channel_info and channel_info[1] == 1)
+    return channel_policy(user_name, channel_id, channel_type, banned)
+
+
+def filter_message(policy: ChannelPolicy, channel_id: str, message_data: Dict[str, Any], user_info: tuple,
+                   dsm_user: Optional[tuple]) -> bool:
+    """
+    按过滤规则判断消息是否推送，被过滤的消息单独记录（不计入投递），下一轮不会重复处理
+
+    Returns:
+        bool: 消息是否被过滤
+    """
+    if policy.allows(message_data["content"], dsm_user):
+        return False
+    get_storage().messages.mark_filtered(channel_id, message_data["message_id"], user_info[0])
+    logger.debug("消息被过滤规则跳过: 用户=%s, 消息ID=%s", user_info[2], message_data["message_id"])
+    return True
+
+
+def process_channel_messages(sid: str, channel_id: str, channel_name: str, user_info: tuple,
+                             unread_count: Optional[int] = None, policy: ChannelPolicy = ALLOW_ALL) -> bool:
     """
     处理指定频道的消息（处理所有未读消息）
 
@@ -525,51 +681,66 @@ def process_channel_messages(sid: str, channel_id: str, channel_name: str, user_
         channel_id: 频道ID
         channel_name: 频道名称
         user_info: 用户信息元组
+        unread_count: 未读数量，调用方已从频道列表中获得时传入，避免再次请求频道列表
+        policy: 该用户在频道上生效的过滤规则
 
     Returns:
         bool: 是否有新消息被处理
     """
     try:
-        logger.debug(f"开始处理频道消息: {channel_name}({channel_id})")
-
-        # 获取频道信息以确定未读数量
-        channels = get_channels(sid)
-        current_channel = None
-        for channel in channels:
-            if channel.get("channel_id") == channel_id:
-                current_channel = channel
-                break
+        logger.debug("开始处理频道消息: %s(%s)", channel_name, channel_id)
+
+        if unread_count is None:
+            # 获取频道信息以确定未读数量
+            channels = get_channels(sid)
+            current_channel = None
+            for channel in channels:
+                if channel.get("channel_id") == channel_id:
+                    current_channel = channel
+                    break
+
+            if not current_channel:
+                logger.warning(f"未找到频道信息: {channel_id}")
+                return False
 
-        if not current_channel:
-            logger.warning(f"未找到频道信息: {channel_id}")
-            return False
+            unread_count = current_channel.get("unread", 0)
 
-        unread_count = current_channel.get("unread", 0)
         if unread_count == 0:
-            logger.debug(f"频道 {channel_name} 没有未读消息")
+            logger.debug("频道 %s 没有未读消息", channel_name)
             return False
 
-        logger.info(f"开始处理频道 {channel_name} 的 {unread_count} 条未读消息")
+        logger.debug("开始处理频道 %s 的 %s 条未读消息", channel_name, unread_count)
 
         # 获取所有未读消息
-        unread_messages = get_unread_messages(sid, channel_id, unread_count)
-        # print(unread_messages.encode("utf-8", errors="ignore").decode("utf-8"))
+        unread_messages = get_unread_messages(sid, channel_id, unread_count, user_info[0])
 
         if not unread_messages:
-            logger.debug(f"频道 {channel_name} 没有未推送的新消息")
+            logger.debug("频道 %s 没有未推送的新消息", channel_name)
             return False
 
         processed_count = 0
+        filtered_count = 0
+        dsm_user = get_storage().directory.user_by_username(user_info[2]) if policy.mention_only else None
         # 按时间顺序处理消息（从旧到新）
         for message_data in reversed(unread_messages):
+            # 收到停止请求时不再开始新的推送，剩余消息下次启动后继续处理
+            if monitor_stop_event.is_set():
+                logger.info(f"监控停止中，频道 {channel_name} 剩余消息留待下次处理")
+                break
 
+            if policy.filters_messages and filter_message(policy, channel_id, message_data, user_info, dsm_user):
+                filtered_count += 1
+                continue
 
             if process_single_message(channel_id, channel_name, message_data, user_info):
                 processed_count += 1
 
         if processed_count > 0:
-            logger.info(f"频道 {channel_name} 成功处理了 {processed_count} 条新消息")
+            logger.info("频道 %s 成功处理了 %d 条新消息", channel_name, processed_count)
             return True
+        elif filtered_count == len(unread_messages):
+            logger.debug("频道 %s 的 %d 条新消息均被过滤规则跳过", channel_name, filtered_count)
+            return False
         else:
             logger.warning(f"频道 {channel_name} 没有成功处理任何消息")
             return False
@@ -581,6 +752,64 @@ def process_channel_messages(sid: str, channel_id: str, channel_name: str, user_
         return False
 
 
+def ingest_webhook_post(post: Dict[str, Any]) -> int:
+    """
+    处理 Synology Chat 外发 Webhook / 机器人回调推送的消息
+
+    与轮询共用 message_history 去重和 process_single_message 推送流程，
+    消息推送给频道中除发送者以外的所有已启用推送用户
+
+    Args:
+        post: 回调参数（channel_id, channel_name, user_id, post_id, timestamp, text）
+
+    Returns:
+        int: 成功推送的用户数
+    """
+    channel_id = str(post.get("channel_id") or "")
+    message_id = str(post.get("post_id") or "")
+    if not channel_id or not message_id:
+        raise ValueError("缺少 channel_id 或 post_id")
+
+    creator_id = str(post.get("user_id") or "")
+    content = post.get("text") or ""
+    create_at = int(post.get("timestamp") or time.time() * 1000)
+
+    get_storage().directory.touch_webhook_channel(channel_id)
+    get_storage().messages.add(channel_id, message_id, content, creator_id, create_at)
+
+    channel_info = get_storage().directory.channel_by_id(channel_id)
+    channel_name = post.get("channel_name") or (channel_info[3] if channel_info else "") or f"匿名频道 {channel_id}"
+    message_data = {
+        "message_id": message_id,
+        "content": content,
+        "creator_id": creator_id,
+        "create_at": create_at,
+    }
+
+    pushed = 0
+    for recipient in get_storage().users.in_channel(channel_id):
+        # 不推送给发送者本人
+        if str(recipient[7]) == creator_id:
+            continue
+        if not has_push_target(recipient[6], recipient[4], recipient[5]):
+            continue
+        if get_storage().messages.is_pushed(channel_id, message_id, recipient[0]):
+            logger.debug("Webhook 消息已推送给用户 %s，跳过: %s", recipient[2], message_id)
+            continue
+        policy = get_channel_policy(recipient[2], channel_id, channel_info)
+        if policy.muted:
+            continue
+        if policy.filters_messages:
+            dsm_user = get_storage().directory.user_by_id(recipient[7]) if policy.mention_only else None
+            if filter_message(policy, channel_id, message_data, recipient, dsm_user):
+                continue
+        if process_single_message(channel_id, channel_name, message_data, recipient[:7]):
+            pushed += 1
+
+    logger.info("Webhook 消息处理完成: 频道=%s, 消息ID=%s, 推送 %d 个用户", channel_name, message_id, pushed)
+    return pushed
+
+
 def get_channels_with_retry_improved(user_info: tuple) -> List[Dict[str, Any]]:
     """
     改进的获取频道列表函数，自动处理SID过期
@@ -594,7 +823,7 @@ def get_channels_with_retry_improved(user_info: tuple) -> List[Dict[str, Any]]:
 
     try:
         # 第一次尝试使用当前SID
-        logger.debug(f"用户 {username} 使用当前SID获取频道列表: {sid}")
+        logger.debug("用户 %s 使用当前SID获取频道列表", username)
         return get_channels(sid)
 
     except Exception as e:
@@ -606,7 +835,7 @@ def get_channels_with_retry_improved(user_info: tuple) -> List[Dict[str, Any]]:
             logger.warning(f"检测到SID过期(119错误)，为用户 {username} 重新登录")
             try:
                 # 从数据库获取完整的用户信息（包含密码）
-                user_details = use_sql.get_user_by_name(username)
+                user_details = get_storage().users.get_by_name(username)
                 if not user_details or len(user_details) < 5:
                     logger.error(f"无法获取用户 {username} 的完整信息: {user_details}")
                     return []
@@ -622,16 +851,18 @@ def get_channels_with_retry_improved(user_info: tuple) -> List[Dict[str, Any]]:
 
                 # 重新登录获取新的SID
                 new_sid = get_syno_sid(username, password)
+                count_cycle("sid_refreshes")
 
                 # 更新数据库中的SID
-                update_success = use_sql.update_user_sid(username, new_sid)
+                update_success = get_storage().users.update_sid(username, new_sid)
                 if update_success:
-                    logger.info(f"用户 {username} 的SID已更新: {new_sid}")
+                    user_registry.update_sid(username, new_sid)
+                    logger.info(f"用户 {username} 的SID已更新")
                 else:
                     logger.error(f"用户 {username} 的SID更新失败")
 
                 # 使用新的SID重新获取频道列表
-                logger.debug(f"使用新SID重新获取频道列表: {new_sid}")
+                logger.debug("使用新SID重新获取频道列表")
                 return get_channels(new_sid)
 
             except Exception as login_error:
@@ -643,29 +874,185 @@ def get_channels_with_retry_improved(user_info: tuple) -> List[Dict[str, Any]]:
             return []
 
 
+def sync_directory() -> bool:
+    """
+    使用初始化管理员的会话同步 DSM 用户和频道目录
+
+    SID 过期时通过 get_channels_with_retry_improved 重新登录
+
+    Returns:
+        bool: 是否执行了同步
+    """
+    init_user = get_storage().config.get("INIT_USER")
+    admin = get_storage().users.get_by_name(init_user) if init_user else None
+    if not admin:
+        logger.warning("未找到初始化管理员用户，跳过目录同步")
+        return False
+
+    # admin 结构: (id, is_banned, user_name, user_password, sid, ...)
+    if not get_channels_with_retry_improved((admin[0], admin[1], admin[2], admin[4])):
+        logger.warning("管理员会话不可用，跳过目录同步")
+        return False
+    sid = get_storage().users.get_by_name(init_user)[4]
+
+    get_user_info(sid)
+    write_channel_info_sql(sid)
+    return True
+
+
+# 监控线程健康状态快照，由 main_run 每轮更新，供 /api/status 直接读取
+_health_lock = threading.Lock()
+_health: Dict[str, Any] = {
+    "last_cycle_time": None,   # 最近一轮开始时间（时间戳）
+    "cycle_duration": None,    # 最近一轮耗时（秒）
+    "users_polled": 0,         # 最近一轮轮询的用户数
+    "failures": 0,             # 最近一轮失败的用户数
+    "queue_depth": 0,          # 最近一轮结束时推送队列中等待发送的消息数
+    "loop_count": 0,
+}
+
+
+# 本轮监控的计数（DSM 请求数、SID 刷新次数），由 main_run 每轮开始时清零并在结束时写入运行统计
+_cycle_counters_lock = threading.Lock()
+_cycle_counters: Dict[str, int] = {"dsm_calls": 0, "sid_refreshes": 0}
+
+
+def count_cycle(name: str, amount: int = 1) -> None:
+    """累加本轮监控的计数"""
+    with _cycle_counters_lock:
+        _cycle_counters[name] = _cycle_counters.get(name, 0) + amount
+
+
+def take_cycle_counters() -> Dict[str, int]:
+    """取出本轮监控的计数并清零"""
+    with _cycle_counters_lock:
+        counters = dict(_cycle_counters)
+        for name in _cycle_counters:
+            _cycle_counters[name] = 0
+    return counters
+
+
+def update_health(**values: Any) -> None:
+    """更新监控线程健康状态快照"""
+    with _health_lock:
+        _health.update(values)
+
+
+def get_health_snapshot() -> Dict[str, Any]:
+    """获取监控线程健康状态快照的副本"""
+    with _health_lock:
+        return dict(_health)
+
+
+def request_monitor_stop() -> None:
+    """请求监控循环在当前推送完成后退出"""
+    monitor_stop_event.set()
+    monitor_wake_event.set()
+
+
+def request_monitor_reload() -> None:
+    """请求监控循环重新加载配置并立即开始下一轮"""
+    monitor_reload_event.set()
+    monitor_wake_event.set()
+
+
+def wait_next_cycle(timeout: float) -> None:
+    """等待下一轮监控，停止或重载请求会立即打断等待"""
+    monitor_wake_event.wait(timeout)
+    monitor_wake_event.clear()
+
+
+def apply_monitor_reload() -> None:
+    """处理重载请求：清空配置缓存并全量重新加载用户，使新的配置在本轮生效"""
+    if monitor_reload_event.is_set():
+        monitor_reload_event.clear()
+        reload_templates()
+        user_registry.load()
+        logger.info("监控配置已重新加载")
+
+
+def record_cycle(cycle_start: float, users_polled: int, unread_channels: int, failures: int,
+                 sent_before: int, failed_before: int) -> None:
+    """
+    写入一轮监控的运行统计
+
+    推送由调度器异步发送，pushes / push_failures 为本轮期间调度器完成的发送数，可能包含上一轮排队的消息
+
+    Args:
+        cycle_start: 本轮开始时间戳
+        users_polled: 轮询的用户数
+        unread_channels: 有未读消息的频道数
+        failures: 获取频道列表失败或处理出错的用户数
+        sent_before: 本轮开始时调度器累计发送成功数
+        failed_before: 本轮开始时调度器累计发送失败数
+    """
+    sent, failed = push_dispatcher.totals()
+    counters = take_cycle_counters()
+    get_storage().runs.add({
+        "started_at": cycle_start,
+        "duration": round(time.time() - cycle_start, 3),
+        "users_polled": users_polled,
+        "unread_channels": unread_channels,
+        "dsm_calls": counters["dsm_calls"],
+        "pushes": sent - sent_before,
+        "push_failures": failed - failed_before,
+        "failures": failures,
+        "sid_refreshes": counters["sid_refreshes"],
+    })
+
+
 def main_run() -> None:
     """
     主监控循环
+
+    调用 request_monitor_stop() 后，在完成正在进行的推送后退出
     """
     logger.info("消息监控线程启动")
     loop_count = 0
+    # Webhook 频道上次对账时间: {(用户ID, 频道ID): 时间戳}
+    last_reconcile: Dict[tuple, float] = {}
 
-    while True:
+    while not monitor_stop_event.is_set():
         try:
+            apply_monitor_reload()
             loop_count += 1
             logger.info(f"开始第 {loop_count} 轮消息监控")
 
-            users = use_sql.get_user_info()
+            cycle_start = time.time()
+            take_cycle_counters()
+            sent_before, failed_before = push_dispatcher.totals()
+            # 只应用管理界面发布的用户变更，不再每轮全量读取 push_users
+            user_registry.sync()
+            users = user_registry.users()
+            # 同一轮中多个用户共享同一频道的消息获取结果
+            begin_cycle_post_cache()
+            # 最近收到过 Webhook 推送的频道只做低频对账轮询
+            webhook_channels = get_storage().directory.webhook_channel_ids(WEBHOOK_COVERAGE_HOURS)
             total_processed = 0
+            users_polled = 0
+            failures = 0
+            unread_channels = 0
 
             if not users:
                 logger.debug("没有找到用户，跳过本轮监控")
-                time.sleep(5)
+                update_health(last_cycle_time=cycle_start, cycle_duration=time.time() - cycle_start,
+                              users_polled=0, failures=0, queue_depth=push_dispatcher.queue_depth(),
+                              loop_count=loop_count)
+                record_cycle(cycle_start, 0, 0, 0, sent_before, failed_before)
+                wait_next_cycle(POLL_INTERVAL)
                 continue
 
             logger.info(f"本轮检查 {len(users)} 个用户")
 
             for user in users:
+                if monitor_stop_event.is_set():
+                    break
+
+                # 本轮开始后可能有封禁、修改或删除，使用注册表中的最新信息
+                user = user_registry.get(user[0])
+                if not user:
+                    continue
+
                 if len(user) < 6:
                     logger.error(f"用户信息不完整: {user}")
                     continue
@@ -675,15 +1062,16 @@ def main_run() -> None:
 
                 # 跳过被封禁的用户
                 if user[1] == 1:
-                    logger.debug(f"用户 {user_name} 被封禁，跳过")
+                    logger.debug("用户 %s 被封禁，跳过", user_name)
                     continue
 
                 # 检查推送配置是否完整
-                if not user[4] or not user[5] or user[4] == 'None' or user[5] == 'None':
+                if not has_push_target(user[6] if len(user) > 6 else None, user[4], user[5]):
                     logger.warning(f"用户 {user_name} 推送配置不完整，跳过")
                     continue
 
-                logger.info(f"处理用户: {user_name}, SID: {user_sid[:10]}...")
+                logger.debug("处理用户: %s", user_name)
+                users_polled += 1
 
                 try:
                     # 使用改进的SID刷新功能
@@ -693,53 +1081,84 @@ def main_run() -> None:
                     if not channels:
                         logger.warning(f"用户 {user_name} 获取频道列表失败，可能SID无效或网络问题")
                         # 这里可以添加强制刷新SID的逻辑
+                        failures += 1
                         continue
 
-                    logger.debug(f"用户 {user_name} 成功获取 {len(channels)} 个频道")
+                    logger.debug("用户 %s 成功获取 %d 个频道", user_name, len(channels))
 
                     for channel in channels:
+                        if monitor_stop_event.is_set():
+                            break
+
                         channel_id = channel.get("channel_id", "未知频道")
                         channel_name = channel.get("name") or f"匿名频道 {channel_id}"
                         unread_count = channel.get("unread", 0)
 
+                        policy = ALLOW_ALL
+                        if unread_count > 0:
+                            # 静音的频道在获取消息之前跳过，不请求 DSM 也不推送
+                            channel_info = get_storage().directory.channel_by_id(channel_id)
+                            policy = get_channel_policy(user_name, channel_id, channel_info, channel.get("type"))
+                            if policy.muted:
+                                logger.debug("频道 %s 已静音，跳过", channel_name)
+                                continue
+
+                        # DSM 返回的频道ID为整数，Webhook 记录的频道ID为字符串
+                        if unread_count > 0 and str(channel_id) in webhook_channels:
+                            reconcile_key = (user[0], str(channel_id))
+                            if cycle_start - last_reconcile.get(reconcile_key, 0) < WEBHOOK_RECONCILE_INTERVAL:
+                                logger.debug("频道 %s 由 Webhook 推送，跳过本轮轮询", channel_name)
+                                continue
+                            last_reconcile[reconcile_key] = cycle_start
+
                         if unread_count > 0:
-                            logger.info(f"发现未读消息: 用户={user_name}, 频道={channel_name}, 未读数={unread_count}")
+                            unread_channels += 1
+                            logger.debug("发现未读消息: 用户=%s, 频道=%s, 未读数=%s", user_name, channel_name, unread_count)
 
                             # 获取当前用户的最新SID（可能已经刷新）
-                            current_user = use_sql.get_user_by_name(user_name)
-                            current_sid = current_user[4] if current_user and len(current_user) > 4 else user_sid
+                            current_user = user_registry.get(user[0])
+                            current_sid = current_user[3] if current_user else user_sid
 
                             # 处理该频道的所有未读消息
-                            if process_channel_messages(current_sid, channel_id, channel_name, user):
+                            if process_channel_messages(current_sid, channel_id, channel_name, user, unread_count,
+                                                        policy):
                                 user_processed += 1
                                 total_processed += 1
                         else:
-                            logger.debug(f"频道 {channel_name} 无未读消息")
+                            logger.debug("频道 %s 无未读消息", channel_name)
 
                     if user_processed > 0:
-                        logger.info(f"用户 {user_name} 处理了 {user_processed} 个频道的消息")
+                        logger.info("用户 %s 处理了 %d 个频道的消息", user_name, user_processed)
                     else:
-                        logger.debug(f"用户 {user_name} 本轮无新消息处理")
+                        logger.debug("用户 %s 本轮无新消息处理", user_name)
 
                 except Exception as e:
                     logger.error(f"处理用户 {user_name} 时发生错误: {str(e)}")
                     import traceback
                     logger.error(f"详细错误信息: {traceback.format_exc()}")
+                    failures += 1
                     continue
 
             # 本轮监控结果汇总
             if total_processed > 0:
                 logger.info(f"第 {loop_count} 轮监控完成，共处理 {total_processed} 个频道的消息")
             else:
-                logger.debug(f"第 {loop_count} 轮监控完成，无新消息")
+                logger.debug("第 %d 轮监控完成，无新消息", loop_count)
 
-            time.sleep(5)
+            update_health(last_cycle_time=cycle_start, cycle_duration=time.time() - cycle_start,
+                          users_polled=users_polled, failures=failures,
+                          queue_depth=push_dispatcher.queue_depth(), loop_count=loop_count)
+            record_cycle(cycle_start, users_polled, unread_channels, failures, sent_before, failed_before)
+
+            wait_next_cycle(POLL_INTERVAL)
 
         except Exception as e:
             logger.error(f"主监控循环发生错误: {str(e)}")
             import traceback
             logger.error(f"详细错误信息: {traceback.format_exc()}")
-            time.sleep(10)
+            wait_next_cycle(ERROR_RETRY_INTERVAL)
+
+    logger.info("消息监控线程已停止")
 def cleanup_old_messages(days: int = 7) -> None:
     """
     清理指定天数前的消息记录
@@ -749,28 +1168,11 @@ def cleanup_old_messages(days: int = 7) -> None:
     """
     logger.info(f"开始清理 {days} 天前的消息记录")
 
-    try:
-        conn = use_sql.sqlite3.connect(use_sql.DB_FILE)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            DELETE FROM message_history 
-            WHERE datetime(push_time) < datetime('now', ?)
-        """, (f'-{days} days',))
-
-        deleted_count = cursor.rowcount
-        conn.commit()
-
-        if deleted_count > 0:
-            logger.info(f"消息记录清理完成，共删除 {deleted_count} 条记录")
-        else:
-            logger.debug("没有需要清理的过期消息记录")
-
-    except use_sql.sqlite3.Error as e:
-        logger.error(f"清理消息记录失败: {str(e)}")
-    finally:
-        if conn:
-            conn.close()
+    deleted_count = get_storage().messages.cleanup(days)
+    if deleted_count > 0:
+        logger.info(f"消息记录清理完成，共删除 {deleted_count} 条记录")
+    else:
+        logger.debug("没有需要清理的过期消息记录")
 
 
 def update_base_url(new_base_url: str) -> bool:
@@ -800,7 +1202,7 @@ def update_base_url(new_base_url: str) -> bool:
         resp = requests.get(test_url, params=params, verify=False, timeout=REQUEST_TIMEOUT)
         if resp.status_code == 200:
             # 更新数据库配置
-            success = use_sql.set_system_config("BASE_URL", new_base_url, "群晖DSM服务器地址")
+            success = get_storage().config.set("BASE_URL", new_base_url, "群晖DSM服务器地址")
             if success:
                 logger.info(f"BASE_URL更新成功: {new_base_url}")
                 return True
@@ -838,9 +1240,10 @@ def get_channels_with_retry(sid: str, username: str, password: str) -> List[Dict
             try:
                 # 重新登录获取新的SID
                 new_sid = get_syno_sid(username, password)
+                count_cycle("sid_refreshes")
 
                 # 更新数据库中的SID
-                use_sql.update_user_sid(username, new_sid)
+                get_storage().users.update_sid(username, new_sid)
                 logger.info(f"用户 {username} 的SID已更新")
 
                 # 使用新的SID重新获取频道列表
@@ -918,9 +1321,10 @@ def get_user_with_sid_refresh(user_info: tuple) -> tuple:
             try:
                 # 重新登录获取新的SID
                 new_sid = get_syno_sid(username, password)
+                count_cycle("sid_refreshes")
 
                 # 更新数据库中的SID
-                use_sql.update_user_sid(username, new_sid)
+                get_storage().users.update_sid(username, new_sid)
 
                 # 返回更新后的用户信息
                 updated_user = list(user_info)
@@ -938,10 +1342,6 @@ def get_user_with_sid_refresh(user_info: tuple) -> tuple:
 # 模块初始化
 if __name__ == "__main__":
     # 配置日志格式
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    setup_logging()
 
     logger.info("syno_func 模块加载完成")
\ No newline at end of file
@@ -15,15 +15,18 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import html
+import zlib
 import sqlite3
-from typing import Dict
+import hashlib
+from typing import Dict, List, Optional, Tuple
 
 import logging
 logger = logging.getLogger(__name__)
 DB_FILE = "push_gateway.db"
 
 # ======================== 推送用户 ======================== #
-def add_push_users_info(user_name, user_password, sid=None, GOTIFY_URL=None, GOTIFY_TOKEN=None):
+def add_push_users_info(user_name, user_password, sid=None, GOTIFY_URL=None, GOTIFY_TOKEN=None, push_backend='gotify'):
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
@@ -36,21 +39,23 @@ def add_push_users_info(user_name, user_password, sid=None, GOTIFY_URL=None, GOT
             # 用户存在 → 更新
             cursor.execute("""
                 UPDATE push_users 
-                SET user_password = ?, sid = ?, GOTIFY_URL = ?, GOTIFY_TOKEN = ? 
+                SET user_password = ?, sid = ?, GOTIFY_URL = ?, GOTIFY_TOKEN = ?, push_backend = ? 
                 WHERE user_name = ?
-            """, (str(user_password), str(sid), str(GOTIFY_URL), str(GOTIFY_TOKEN), str(user_name)))
-            print(f"用户 {user_name} 更新成功")
+            """, (str(user_password), str(sid), str(GOTIFY_URL), str(GOTIFY_TOKEN), str(push_backend),
+                  str(user_name)))
+            logger.info(f"用户 {user_name} 更新成功")
         else:
             # 不存在 → 插入新用户
             cursor.execute("""
-                INSERT INTO push_users (user_name, user_password, sid, GOTIFY_URL, GOTIFY_TOKEN)
-                VALUES (?, ?, ?, ?, ?)
-            """, (str(user_name), str(user_password), str(sid), str(GOTIFY_URL), str(GOTIFY_TOKEN)))
-            print(f"用户 {user_name} 插入成功")
+                INSERT INTO push_users (user_name, user_password, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (str(user_name), str(user_password), str(sid), str(GOTIFY_URL), str(GOTIFY_TOKEN),
+                  str(push_backend)))
+            logger.info(f"用户 {user_name} 插入成功")
 
         conn.commit()
     except sqlite3.Error as e:
-        print(f"写入用户 {user_name} 失败:", e)
+        logger.error(f"写入用户 {user_name} 失败: {e}")
     finally:
         if conn:
             conn.close()
@@ -108,17 +113,17 @@ def add_channel_info(channel_id, channel_name=None, channel_member=None, channel
                 SET channel_name = ?, channel_member = ?, channel_type = ?
                 WHERE channel_id = ?
             """, (str(channel_name), str(channel_member), str(channel_type), channel_id))
-            print(f"频道号 {channel_id}, 名称 {channel_name} 更新成功")
+            logger.debug("频道号 %s, 名称 %s 更新成功", channel_id, channel_name)
         else:
             cursor.execute("""
                 INSERT INTO channel_info (channel_id, channel_name, channel_member, channel_type)
                 VALUES (?, ?, ?, ?)
             """, (channel_id, str(channel_name), str(channel_member), str(channel_type)))
-            print(f"频道号 {channel_id}, 名称 {channel_name} 插入成功")
+            logger.debug("频道号 %s, 名称 %s 插入成功", channel_id, channel_name)
 
         conn.commit()
     except sqlite3.Error as e:
-        print(f"写入频道 {channel_id} 失败:", e)
+        logger.error(f"写入频道 {channel_id} 失败: {e}")
     finally:
         if conn:
             conn.close()
@@ -132,15 +137,9 @@ def get_all_users():
         cursor.execute("SELECT id, is_banned, user_name, user_password, GOTIFY_URL, GOTIFY_TOKEN FROM push_users")
         users = cursor.fetchall()
 
-        print("所有用户信息：")
-        for user in users:
-            print(
-                f"ID: {user[0]}, 用户名: {user[2]}, 封禁: {user[1]}, 密码: {user[3]}, GOTIFY_URL: {user[4]}, GOTIFY_TOKEN: {user[5]}"
-            )
-
         return users
     except sqlite3.Error as e:
-        print(f"查询所有用户失败:", e)
+        logger.error(f"查询所有用户失败: {e}")
         return []
     finally:
         if conn:
@@ -152,15 +151,9 @@ def get_all_users_no_password():
         cursor.execute("SELECT id, is_banned, user_name, GOTIFY_URL, GOTIFY_TOKEN FROM push_users")
         users = cursor.fetchall()
 
-        print("所有用户信息：")
-        for user in users:
-            print(
-                f"ID: {user[0]}, 用户名: {user[2]}, 封禁: {user[1]}, GOTIFY_URL: {user[3]}, GOTIFY_TOKEN: {user[4]}"
-            )
-
         return users
     except sqlite3.Error as e:
-        print(f"查询所有用户失败:", e)
+        logger.error(f"查询所有用户失败: {e}")
         return []
     finally:
         if conn:
@@ -174,7 +167,7 @@ def get_all_users_password():
         # 就给个password
         return users
     except sqlite3.Error as e:
-        print(f"查询所有用户失败:", e)
+        logger.error(f"查询所有用户失败: {e}")
         return []
     finally:
         if conn:
@@ -183,16 +176,88 @@ def get_user_info():
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
-        cursor.execute("SELECT id, is_banned, user_name,sid, GOTIFY_URL, GOTIFY_TOKEN FROM push_users")
+        cursor.execute("SELECT id, is_banned, user_name,sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend FROM push_users")
         users = cursor.fetchall()
         return users
 
     except sqlite3.Error as e:
-        print(f"查询所有用户主要信息失败:", e)
+        logger.error(f"查询所有用户主要信息失败: {e}")
         return []
     finally:
         if conn:
             conn.close()
+# 用户列表接口允许排序的字段
+USER_SORT_FIELDS = ('id', 'user_name', 'is_banned')
+
+
+def search_push_users(keyword=None, sort='id', order='asc', limit=50, offset=0):
+    """
+    分页查询推送用户（不读取密码和SID）
+
+    Args:
+        keyword: 按用户名模糊搜索
+        sort: 排序字段，见 USER_SORT_FIELDS
+        order: asc / desc
+        limit: 每页数量
+        offset: 偏移量
+
+    Returns:
+        tuple: (当前页用户列表, 符合条件的总数)
+    """
+    sort = sort if sort in USER_SORT_FIELDS else 'id'
+    order = 'DESC' if str(order).lower() == 'desc' else 'ASC'
+
+    where = ""
+    params = []
+    if keyword:
+        escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where = "WHERE user_name LIKE ? ESCAPE '\\'"
+        params.append(f"%{escaped}%")
+
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute(f"SELECT COUNT(*) FROM push_users {where}", params)
+        total = cursor.fetchone()[0]
+
+        cursor.execute(f"""
+            SELECT id, is_banned, user_name, GOTIFY_URL, GOTIFY_TOKEN, push_backend FROM push_users
+            {where}
+            ORDER BY {sort} {order}, id {order}
+            LIMIT ? OFFSET ?
+        """, params + [int(limit), int(offset)])
+        users = [dict(row) for row in cursor.fetchall()]
+        return users, total
+    except sqlite3.Error as e:
+        logger.error(f"分页查询用户失败: {e}")
+        return [], 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def count_push_users():
+    """
+    统计推送用户数量
+
+    Returns:
+        tuple: (用户总数, 启用用户数)
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(is_banned = 0), 0) FROM push_users")
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"统计推送用户数量失败: {e}")
+        return 0, 0
+    finally:
+        if conn:
+            conn.close()
+
+
 def get_user_by_name(user_name):
     try:
         conn = sqlite3.connect(DB_FILE)
@@ -200,7 +265,7 @@ def get_user_by_name(user_name):
         cursor.execute("SELECT * FROM push_users WHERE user_name = ?", (str(user_name),))
         return cursor.fetchone()
     except sqlite3.Error as e:
-        print(f"查询用户 {user_name} 失败:", e)
+        logger.error(f"查询用户 {user_name} 失败: {e}")
         return None
     finally:
         if conn:
@@ -214,7 +279,7 @@ def get_user_by_id(user_id):
         cursor.execute("SELECT * FROM push_users WHERE id = ?", (user_id,))
         return cursor.fetchone()
     except sqlite3.Error as e:
-        print(f"查询用户 {user_id} 失败:", e)
+        logger.error(f"查询用户 {user_id} 失败: {e}")
         return None
     finally:
         if conn:
@@ -229,18 +294,112 @@ def update_user_status(user_id, new_status):
     conn.close()
 
 
-def update_push_users_info(user_id, username, password, gotify_url, gotify_token):
+def update_push_users_info(user_id, username, password, gotify_url, gotify_token, push_backend='gotify'):
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
     cursor.execute("""
         UPDATE push_users 
-        SET user_name = ?, user_password = ?, GOTIFY_URL = ?, GOTIFY_TOKEN = ? 
+        SET user_name = ?, user_password = ?, GOTIFY_URL = ?, GOTIFY_TOKEN = ?, push_backend = ? 
         WHERE id = ?
-    """, (username, password, gotify_url, gotify_token, user_id))
+    """, (username, password, gotify_url, gotify_token, push_backend, user_id))
     conn.commit()
     conn.close()
 
 
+def get_user_info_by_ids(user_ids):
+    """按ID批量获取推送用户主要信息，字段同 get_user_info"""
+    if not user_ids:
+        return []
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(user_ids))
+        cursor.execute(f"""
+            SELECT id, is_banned, user_name, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend FROM push_users
+            WHERE id IN ({placeholders})
+        """, list(user_ids))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"批量查询用户信息失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+# ======================== 用户变更日志 ======================== #
+def add_user_change(user_id, change_type):
+    """记录推送用户变更（add / update / delete）"""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO user_change_log (user_id, change_type) VALUES (?, ?)",
+                       (int(user_id), change_type))
+        conn.commit()
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"记录用户变更失败: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_last_user_change_id():
+    """获取最新一条用户变更的ID"""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM user_change_log")
+        return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"查询用户变更失败: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_user_changes_since(change_id):
+    """
+    获取指定ID之后的用户变更
+
+    Returns:
+        list: [(id, user_id, change_type), ...]
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, user_id, change_type FROM user_change_log
+            WHERE id > ? ORDER BY id
+        """, (change_id,))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"查询用户变更失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def cleanup_user_changes(days=7):
+    """清理指定天数前的用户变更记录"""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM user_change_log WHERE datetime(created_time) < datetime('now', ?)",
+                       (f'-{days} days',))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"清理用户变更记录失败: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
 # ======================== DSM 用户和频道 ======================== #
 def add_dsm_users_info(user_id, nickname, username, user_type):
     try:
@@ -256,17 +415,17 @@ def add_dsm_users_info(user_id, nickname, username, user_type):
                 SET nickname = ?, username = ?, user_type = ?
                 WHERE user_id = ?
             """, (str(nickname), str(username), str(user_type), str(user_id)))
-            print(f"用户 user_id={user_id}, username={username}, nickname={nickname} 更新成功")
+            logger.debug("用户 user_id=%s, username=%s, nickname=%s 更新成功", user_id, username, nickname)
         else:
             cursor.execute("""
                 INSERT INTO user_info (user_id, nickname, username, user_type)
                 VALUES (?, ?, ?, ?)
             """, (str(user_id), str(nickname), str(username), str(user_type)))
-            print(f"用户 user_id={user_id}, username={username}, nickname={nickname} 插入成功")
+            logger.debug("用户 user_id=%s, username=%s, nickname=%s 插入成功", user_id, username, nickname)
 
         conn.commit()
     except sqlite3.Error as e:
-        print(f"写入用户 user_id={user_id} 失败:", e)
+        logger.error(f"写入用户 user_id={user_id} 失败: {e}")
     finally:
         if conn:
             conn.close()
@@ -278,7 +437,7 @@ def search_dsm_user_id_by_username(username):
         cursor.execute("SELECT * FROM user_info WHERE username = ?", (username,))
         return cursor.fetchone()
     except sqlite3.Error as e:
-        print(f"查询用户 {username} 失败:", e)
+        logger.error(f"查询用户 {username} 失败: {e}")
         return None
     finally:
         if conn:
@@ -291,7 +450,7 @@ def search_dsm_user_id_by_id(user_id):
         cursor.execute("SELECT * FROM user_info WHERE user_id = ?", (user_id,))
         return cursor.fetchone()
     except sqlite3.Error as e:
-        print(f"查询用户 {user_id} 失败:", e)
+        logger.error(f"查询用户 {user_id} 失败: {e}")
         return None
     finally:
         if conn:
@@ -312,18 +471,25 @@ def add_dsm_channel_info(channel_id, channel_name, members,channel_member, chann
                 UPDATE channel_info 
                 SET channel_name = ?,members=?, channel_member = ?, channel_type = ?
                 WHERE channel_id = ?
-            """, (str(channel_name), str(channel_member), str(members), str(channel_type), str(channel_id)))
-            print(f"channel_id={channel_id}, channel_name={channel_name} 更新成功")
+            """, (str(channel_name), str(members), str(channel_member), str(channel_type), str(channel_id)))
+            logger.debug("channel_id=%s, channel_name=%s 更新成功", channel_id, channel_name)
         else:
             cursor.execute("""
                 INSERT INTO channel_info (channel_id, channel_name, members,channel_member, channel_type)
                 VALUES (?, ?, ?, ?,?)
             """, (str(channel_id), str(channel_name), str(members), str(channel_member), str(channel_type)))
-            print(f"channel_id={channel_id}, channel_name={channel_name} 插入成功")
+            logger.debug("channel_id=%s, channel_name=%s 插入成功", channel_id, channel_name)
+
+        # 同步频道成员表
+        cursor.execute("DELETE FROM channel_members WHERE channel_id = ?", (str(channel_id),))
+        cursor.executemany(
+            "INSERT OR IGNORE INTO channel_members (channel_id, user_id) VALUES (?, ?)",
+            [(str(channel_id), str(member_id)) for member_id in (members or [])]
+        )
 
         conn.commit()
     except sqlite3.Error as e:
-        print(f"channel_id={channel_id}, channel_name={channel_name} 写入失败:", e)
+        logger.error(f"channel_id={channel_id}, channel_name={channel_name} 写入失败: {e}")
     finally:
         if conn:
             conn.close()
@@ -335,13 +501,203 @@ def search_channel_by_id(channel_id):
         cursor.execute("SELECT * FROM channel_info WHERE channel_id = ?", (channel_id,))
         return cursor.fetchone()
     except sqlite3.Error as e:
-        print(f"查询频道 {channel_id} 失败:", e)
+        logger.error(f"查询频道 {channel_id} 失败: {e}")
         return None
     finally:
         if conn:
             conn.close()
 
 
+def set_channel_banned(channel_id, is_banned):
+    """
+    设置频道是否对所有推送用户静音（channel_info.is_banned）
+
+    Returns:
+        bool: 频道是否存在
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("UPDATE channel_info SET is_banned = ? WHERE channel_id = ?",
+                       (1 if is_banned else 0, str(channel_id)))
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        logger.error(f"设置频道 {channel_id} 静音状态失败: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def upsert_dsm_users_batch(users):
+    """
+    批量写入群晖用户信息
+
+    Args:
+        users: [(user_id, nickname, username, user_type), ...]
+
+    Returns:
+        int: 写入的记录数
+    """
+    if not users:
+        return 0
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO user_info (user_id, nickname, username, user_type)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                nickname = excluded.nickname,
+                username = excluded.username,
+                user_type = excluded.user_type
+        """, [tuple(str(v) for v in user) for user in users])
+        conn.commit()
+        logger.debug(f"批量写入 {len(users)} 个群晖用户")
+        return len(users)
+    except sqlite3.Error as e:
+        logger.error(f"批量写入群晖用户失败: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def upsert_dsm_channels_batch(channels):
+    """
+    批量写入群晖频道信息及成员
+
+    Args:
+        channels: [(channel_id, channel_name, members, channel_member, channel_type), ...]
+
+    Returns:
+        int: 写入的记录数
+    """
+    if not channels:
+        return 0
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO channel_info (channel_id, channel_name, members, channel_member, channel_type)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                channel_name = excluded.channel_name,
+                members = excluded.members,
+                channel_member = excluded.channel_member,
+                channel_type = excluded.channel_type
+        """, [(str(channel_id), str(name), str(members), str(member_count), str(channel_type))
+              for channel_id, name, members, member_count, channel_type in channels])
+
+        cursor.executemany("DELETE FROM channel_members WHERE channel_id = ?",
+                           [(str(channel[0]),) for channel in channels])
+        cursor.executemany(
+            "INSERT OR IGNORE INTO channel_members (channel_id, user_id) VALUES (?, ?)",
+            [(str(channel[0]), str(member_id)) for channel in channels for member_id in (channel[2] or [])]
+        )
+        conn.commit()
+        logger.debug(f"批量写入 {len(channels)} 个群晖频道")
+        return len(channels)
+    except sqlite3.Error as e:
+        logger.error(f"批量写入群晖频道失败: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_channel_peer(channel_id, user_id):
+    """
+    获取私聊频道中对方用户的信息
+
+    Args:
+        channel_id: 频道ID
+        user_id: 当前用户的DSM用户ID
+
+    Returns:
+        tuple: 对方在 user_info 表中的记录，不存在时返回 None
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.* FROM channel_members m
+            JOIN user_info u ON u.user_id = m.user_id
+            WHERE m.channel_id = ? AND m.user_id != ?
+            LIMIT 1
+        """, (str(channel_id), str(user_id)))
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"查询频道 {channel_id} 对方用户失败: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_push_users_in_channel(channel_id):
+    """
+    获取频道中所有已启用的推送用户（按 DSM 用户名关联）
+
+    Returns:
+        list: [(id, is_banned, user_name, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend, dsm_user_id), ...]
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT p.id, p.is_banned, p.user_name, p.sid, p.GOTIFY_URL, p.GOTIFY_TOKEN, p.push_backend, u.user_id
+            FROM channel_members m
+            JOIN user_info u ON u.user_id = m.user_id
+            JOIN push_users p ON p.user_name = u.username
+            WHERE m.channel_id = ? AND p.is_banned = 0
+        """, (str(channel_id),))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"查询频道 {channel_id} 的推送用户失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+# ======================== Webhook 频道 ======================== #
+def touch_webhook_channel(channel_id):
+    """记录频道收到了一次 Webhook 推送"""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO webhook_channels (channel_id, last_event_time) VALUES (?, CURRENT_TIMESTAMP)
+            ON CONFLICT(channel_id) DO UPDATE SET last_event_time = CURRENT_TIMESTAMP
+        """, (str(channel_id),))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"记录 Webhook 频道 {channel_id} 失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_webhook_channel_ids(hours=24):
+    """获取最近指定小时内收到过 Webhook 推送的频道ID集合"""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT channel_id FROM webhook_channels
+            WHERE datetime(last_event_time) >= datetime('now', ?)
+        """, (f'-{hours} hours',))
+        return {row[0] for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"查询 Webhook 频道失败: {e}")
+        return set()
+    finally:
+        if conn:
+            conn.close()
+
+
 # ======================== 消息推送记录 ======================== #
 def add_message_history(channel_id, message_id, message_content, creator_id, create_at):
     """添加消息记录"""
@@ -358,41 +714,155 @@ def add_message_history(channel_id, message_id, message_content, creator_id, cre
         conn.commit()
         return True
     except sqlite3.Error as e:
-        print(f"添加消息记录失败: {e}")
+        logger.error(f"添加消息记录失败: {e}")
         return False
     finally:
         if conn:
             conn.close()
 
 
-def mark_message_as_pushed(channel_id, message_id):
-    """标记消息为已推送"""
+# 消息正文存储模式: full 保留原文 / hash 只保留摘要 / zlib 保留压缩后的原文
+# 全文索引 message_fts 中另存一份原文：hash 模式压缩时同时删除索引（消息不再可检索），
+# zlib 模式保留索引，需要节省空间时可将 MESSAGE_SEARCH_INDEX 设为 0
+MESSAGE_STORAGE_MODES = ('full', 'hash', 'zlib')
+
+
+def get_message_storage_mode(cursor) -> str:
+    """读取 MESSAGE_STORAGE_MODE 配置，默认 full"""
+    cursor.execute("SELECT config_value FROM system_config WHERE config_key = 'MESSAGE_STORAGE_MODE'")
+    result = cursor.fetchone()
+    mode = result[0] if result else 'full'
+    return mode if mode in MESSAGE_STORAGE_MODES else 'full'
+
+
+def compact_message_content(content: str, mode: str) -> Tuple[Optional[str], Optional[bytes], Optional[bytes]]:
+    """
+    按存储模式压缩消息正文
+
+    hash 模式只保留 16 字节摘要；zlib 模式只在压缩后更小时保存压缩数据，否则保留原文
+    （多数短消息压缩后反而变大）
+
+    Args:
+        content: 消息原文
+        mode: 存储模式 (hash / zlib)
+
+    Returns:
+        tuple: (message_content, content_hash, content_zlib)
+    """
+    data = (content or "").encode("utf-8")
+    if mode == 'zlib':
+        compressed = zlib.compress(data, 9)
+        if len(compressed) < len(data):
+            return None, None, compressed
+        return content, None, None
+    return None, hashlib.blake2b(data, digest_size=16).digest(), None
+
+
+def stored_content_size(message_content, content_hash, content_zlib) -> int:
+    """消息正文相关字段占用的字节数"""
+    return (len(message_content.encode("utf-8")) if message_content is not None else 0) \
+        + len(content_hash or b"") + len(content_zlib or b"")
+
+
+def decode_message_content(message_content, content_zlib) -> Optional[str]:
+    """从 message_content 或 content_zlib 中还原消息正文，hash 模式下返回 None"""
+    if message_content is not None:
+        return message_content
+    if content_zlib is not None:
+        return zlib.decompress(content_zlib).decode("utf-8")
+    return None
+
+
+def mark_message_as_pushed(channel_id, message_id, push_user_id=None):
+    """
+    标记消息为已推送，并按 MESSAGE_STORAGE_MODE 压缩正文
+
+    Args:
+        channel_id: 频道ID
+        message_id: 消息ID
+        push_user_id: 推送用户ID，指定时同时记录该用户的投递
+    """
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
 
-        cursor.execute("""
-            UPDATE message_history 
-            SET is_pushed = 1, push_time = CURRENT_TIMESTAMP
-            WHERE channel_id = ? AND message_id = ?
-        """, (str(channel_id), str(message_id)))
+        mode = get_message_storage_mode(cursor)
+        row = None
+        if mode != 'full':
+            cursor.execute("""
+                SELECT message_content FROM message_history
+                WHERE channel_id = ? AND message_id = ?
+            """, (str(channel_id), str(message_id)))
+            row = cursor.fetchone()
+
+        compacted = None
+        if row is not None and row[0] is not None:
+            compacted = compact_message_content(row[0], mode)
+
+        # 正文已压缩过（其他用户先推送过）或压缩后不会更小时只更新推送状态
+        if compacted is None or compacted[0] is not None:
+            cursor.execute("""
+                UPDATE message_history 
+                SET is_pushed = 1, push_time = CURRENT_TIMESTAMP
+                WHERE channel_id = ? AND message_id = ?
+            """, (str(channel_id), str(message_id)))
+            updated = cursor.rowcount > 0
+        else:
+            cursor.execute("""
+                UPDATE message_history 
+                SET is_pushed = 1, push_time = CURRENT_TIMESTAMP,
+                    message_content = ?, content_hash = ?, content_zlib = ?
+                WHERE channel_id = ? AND message_id = ?
+            """, compacted + (str(channel_id), str(message_id)))
+            updated = cursor.rowcount > 0
+            if mode == 'hash':
+                cursor.execute("""
+                    DELETE FROM message_fts WHERE rowid IN (
+                        SELECT id FROM message_history WHERE channel_id = ? AND message_id = ?
+                    )
+                """, (str(channel_id), str(message_id)))
+
+        if push_user_id is not None:
+            cursor.execute("""
+                INSERT OR IGNORE INTO message_deliveries (channel_id, message_id, push_user_id)
+                VALUES (?, ?, ?)
+            """, (str(channel_id), str(message_id), int(push_user_id)))
 
         conn.commit()
-        return cursor.rowcount > 0
+        return updated
     except sqlite3.Error as e:
-        print(f"标记消息为已推送失败: {e}")
+        logger.error(f"标记消息为已推送失败: {e}")
         return False
     finally:
         if conn:
             conn.close()
 
 
-def is_message_pushed(channel_id, message_id):
-    """检查消息是否已推送"""
+def is_message_pushed(channel_id, message_id, push_user_id=None):
+    """
+    检查消息是否已推送
+
+    Args:
+        channel_id: 频道ID
+        message_id: 消息ID
+        push_user_id: 推送用户ID，指定时检查是否已推送给该用户（被过滤规则跳过的消息也视为已处理）
+    """
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
 
+        if push_user_id is not None:
+            params = (str(channel_id), str(message_id), int(push_user_id))
+            cursor.execute("""
+                SELECT 1 FROM message_deliveries
+                WHERE channel_id = ? AND message_id = ? AND push_user_id = ?
+                UNION ALL
+                SELECT 1 FROM message_filtered
+                WHERE channel_id = ? AND message_id = ? AND push_user_id = ?
+                LIMIT 1
+            """, params + params)
+            return cursor.fetchone() is not None
+
         cursor.execute("""
             SELECT is_pushed FROM message_history 
             WHERE channel_id = ? AND message_id = ?
@@ -401,13 +871,73 @@ def is_message_pushed(channel_id, message_id):
         result = cursor.fetchone()
         return result and result[0] == 1
     except sqlite3.Error as e:
-        print(f"检查消息推送状态失败: {e}")
+        logger.error(f"检查消息推送状态失败: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def mark_message_filtered(channel_id, message_id, push_user_id):
+    """
+    记录消息被过滤规则跳过，不修改推送状态和正文，也不记为投递
+
+    Args:
+        channel_id: 频道ID
+        message_id: 消息ID
+        push_user_id: 推送用户ID
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT OR IGNORE INTO message_filtered (channel_id, message_id, push_user_id)
+            VALUES (?, ?, ?)
+        """, (str(channel_id), str(message_id), int(push_user_id)))
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"记录被过滤的消息失败: {e}")
         return False
     finally:
         if conn:
             conn.close()
 
 
+def delete_old_messages(days=7):
+    """
+    删除指定天数前的消息记录、投递记录和过滤记录
+
+    Returns:
+        int: 删除的消息记录数
+    """
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM message_history 
+            WHERE datetime(push_time) < datetime('now', ?)
+        """, (f'-{days} days',))
+        deleted_count = cursor.rowcount
+
+        cursor.execute("""
+            DELETE FROM message_deliveries
+            WHERE datetime(delivered_time) < datetime('now', ?)
+        """, (f'-{days} days',))
+        cursor.execute("""
+            DELETE FROM message_filtered
+            WHERE datetime(filtered_time) < datetime('now', ?)
+        """, (f'-{days} days',))
+        conn.commit()
+        return deleted_count
+    except sqlite3.Error as e:
+        logger.error(f"清理消息记录失败: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
 def get_unpushed_messages(channel_id=None):
     """获取未推送的消息"""
     try:
@@ -429,7 +959,430 @@ def get_unpushed_messages(channel_id=None):
 
         return cursor.fetchall()
     except sqlite3.Error as e:
-        print(f"获取未推送消息失败: {e}")
+        logger.error(f"获取未推送消息失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+# ======================== 消息全文检索 ======================== #
+SEARCH_TRIGRAM_MIN = 3  # trigram 分词下 MATCH 查询词的最短长度，更短的词只在索引命中的结果中做 LIKE 过滤
+_HIGHLIGHT_START, _HIGHLIGHT_END = "\x02", "\x03"
+
+
+def split_search_terms(query: str) -> List[str]:
+    """按空白拆分查询词，多个词之间为 AND 关系"""
+    return [term for term in (query or "").split() if term]
+
+
+def fts_phrase(term: str) -> str:
+    """将查询词转义为 FTS5 短语，避免用户输入被解析为查询语法"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def highlight_html(snippet: str) -> str:
+    """转义摘要中的 HTML，并将高亮标记替换为 <mark>"""
+    return html.escape(snippet or "").replace(_HIGHLIGHT_START, "<mark>").replace(_HIGHLIGHT_END, "</mark>")
+
+
+def search_messages(query: str, channel_id: str = None, since: float = None, until: float = None,
+                    user_name: str = None, limit: int = 50, offset: int = 0) -> Tuple[List[dict], bool]:
+    """
+    全文检索消息正文
+
+    查询词之间为 AND 关系，按 bm25 排序；trigram 分词下 3 个字符及以上的词走 FTS5 索引，
+    更短的词（如两个汉字）只在索引命中的结果中做 LIKE 过滤，因此至少需要一个足够长的词
+
+    Args:
+        query: 查询内容
+        channel_id: 只检索该频道
+        since: 消息创建时间下限（时间戳，秒）
+        until: 消息创建时间上限（时间戳，秒）
+        user_name: 只返回已投递给该推送用户的消息
+        limit: 每页条数
+        offset: 偏移量
+
+    Returns:
+        tuple: (结果列表, 是否还有更多结果)
+
+    Raises:
+        ValueError: 所有查询词都短于 SEARCH_TRIGRAM_MIN，无法使用索引
+    """
+    terms = split_search_terms(query)
+    if not terms:
+        return [], False
+
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'message_fts'")
+        row = cursor.fetchone()
+        trigram = bool(row and "trigram" in row[0])
+        min_length = SEARCH_TRIGRAM_MIN if trigram else 1
+        match_terms = [term for term in terms if len(term) >= min_length]
+        like_terms = [term for term in terms if len(term) < min_length]
+        if not match_terms:
+            # 只有短词时无法使用索引，需要扫描全部索引内容
+            raise ValueError(f"检索词至少需要 {SEARCH_TRIGRAM_MIN} 个字符，较短的词需与更长的词一起使用")
+
+        conditions, params = [], []
+        conditions.append("message_fts MATCH ?")
+        params.append(" ".join(fts_phrase(term) for term in match_terms))
+        for term in like_terms:
+            conditions.append("f.content LIKE ? ESCAPE '\\'")
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if channel_id:
+            conditions.append("h.channel_id = ?")
+            params.append(str(channel_id))
+        if since is not None:
+            conditions.append("h.create_at >= ?")
+            params.append(int(since * 1000))
+        if until is not None:
+            conditions.append("h.create_at < ?")
+            params.append(int(until * 1000))
+        if user_name:
+            conditions.append("""EXISTS (
+                SELECT 1 FROM message_deliveries d JOIN push_users p ON p.id = d.push_user_id
+                WHERE d.channel_id = h.channel_id AND d.message_id = h.message_id AND p.user_name = ?
+            )""")
+            params.append(user_name)
+
+        cursor.execute(f"""
+            SELECT h.id, h.channel_id, c.channel_name, h.message_id, h.creator_id, h.create_at, h.push_time,
+                   snippet(message_fts, 0, '{_HIGHLIGHT_START}', '{_HIGHLIGHT_END}', '…', 24),
+                   (SELECT group_concat(p.user_name, ',') FROM message_deliveries d
+                    JOIN push_users p ON p.id = d.push_user_id
+                    WHERE d.channel_id = h.channel_id AND d.message_id = h.message_id)
+            FROM message_fts f
+            JOIN message_history h ON h.id = f.rowid
+            LEFT JOIN channel_info c ON c.channel_id = h.channel_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY bm25(message_fts)
+            LIMIT ? OFFSET ?
+        """, params + [limit + 1, offset])
+        rows = cursor.fetchall()
+
+        results = []
+        for row in rows[:limit]:
+            results.append({
+                'id': row[0],
+                'channel_id': row[1],
+                'channel_name': row[2],
+                'message_id': row[3],
+                'creator_id': row[4],
+                'create_at': row[5],
+                'push_time': row[6],
+                'snippet_html': highlight_html(row[7]),
+                'delivered_to': row[8].split(',') if row[8] else [],
+            })
+        return results, len(rows) > limit
+    except sqlite3.Error as e:
+        logger.error(f"全文检索消息失败: {e}")
+        return [], False
+    finally:
+        if conn:
+            conn.close()
+
+
+MESSAGE_EXPORT_FIELDS = ('id', 'channel_id', 'message_id', 'creator_id', 'create_at', 'is_pushed', 'push_time',
+                         'content', 'content_hash')
+DELIVERY_EXPORT_FIELDS = ('channel_id', 'message_id', 'push_user_id', 'user_name', 'delivered_time')
+
+
+def iter_message_history(since=None, until=None, channel_id=None, chunk_size=1000):
+    """
+    按 id 分批遍历 message_history，内存占用与表大小无关
+
+    每批是一次独立的短查询，遍历期间不会长时间占用读锁阻塞监控写入
+
+    Args:
+        since: 消息创建时间下限（时间戳，秒），包含
+        until: 消息创建时间上限（时间戳，秒），不包含
+        channel_id: 只导出该频道
+        chunk_size: 每批读取的记录数
+
+    Yields:
+        dict: 字段见 MESSAGE_EXPORT_FIELDS，content 为还原后的正文（hash 模式下为 None）
+    """
+    conditions, params = ["id > ?"], []
+    if since is not None:
+        conditions.append("create_at >= ?")
+        params.append(int(since * 1000))
+    if until is not None:
+        conditions.append("create_at < ?")
+        params.append(int(until * 1000))
+    if channel_id:
+        conditions.append("channel_id = ?")
+        params.append(str(channel_id))
+    sql = f"""
+        SELECT id, channel_id, message_id, creator_id, create_at, is_pushed, push_time,
+               message_content, content_zlib, content_hash
+        FROM message_history WHERE {' AND '.join(conditions)}
+        ORDER BY id LIMIT ?
+    """
+
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        last_id = 0
+        while True:
+            cursor.execute(sql, [last_id] + params + [chunk_size])
+            rows = cursor.fetchall()
+            for row in rows:
+                yield {
+                    'id': row[0],
+                    'channel_id': row[1],
+                    'message_id': row[2],
+                    'creator_id': row[3],
+                    'create_at': row[4],
+                    'is_pushed': row[5],
+                    'push_time': row[6],
+                    'content': decode_message_content(row[7], row[8]),
+                    'content_hash': row[9].hex() if isinstance(row[9], bytes) else row[9],
+                }
+            if len(rows) < chunk_size:
+                break
+            last_id = rows[-1][0]
+    except sqlite3.Error as e:
+        logger.error(f"导出消息记录失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def iter_message_deliveries(since=None, until=None, channel_id=None, chunk_size=1000):
+    """
+    按 rowid 分批遍历 message_deliveries（附带推送用户名）
+
+    Args:
+        since: 投递时间下限（时间戳，秒），包含
+        until: 投递时间上限（时间戳，秒），不包含
+        channel_id: 只导出该频道
+        chunk_size: 每批读取的记录数
+
+    Yields:
+        dict: 字段见 DELIVERY_EXPORT_FIELDS
+    """
+    conditions, params = ["d.rowid > ?"], []
+    if since is not None:
+        conditions.append("d.delivered_time >= datetime(?, 'unixepoch')")
+        params.append(int(since))
+    if until is not None:
+        conditions.append("d.delivered_time < datetime(?, 'unixepoch')")
+        params.append(int(until))
+    if channel_id:
+        conditions.append("d.channel_id = ?")
+        params.append(str(channel_id))
+    sql = f"""
+        SELECT d.rowid, d.channel_id, d.message_id, d.push_user_id, p.user_name, d.delivered_time
+        FROM message_deliveries d LEFT JOIN push_users p ON p.id = d.push_user_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY d.rowid LIMIT ?
+    """
+
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        last_rowid = 0
+        while True:
+            cursor.execute(sql, [last_rowid] + params + [chunk_size])
+            rows = cursor.fetchall()
+            for row in rows:
+                yield dict(zip(DELIVERY_EXPORT_FIELDS, row[1:]))
+            if len(rows) < chunk_size:
+                break
+            last_rowid = rows[-1][0]
+    except sqlite3.Error as e:
+        logger.error(f"导出投递记录失败: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+def compact_pushed_messages(mode: str = None, batch_size: int = 500) -> Dict[str, int]:
+    """
+    将已推送消息的正文迁移为紧凑存储
+
+    Args:
+        mode: 存储模式 (hash / zlib)，为空时读取 MESSAGE_STORAGE_MODE 配置
+        batch_size: 每批处理的记录数
+
+    Returns:
+        Dict: 处理结果 {rows, bytes_before, bytes_after, bytes_saved}
+    """
+    report = {"rows": 0, "bytes_before": 0, "bytes_after": 0, "bytes_saved": 0}
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+
+        mode = mode or get_message_storage_mode(cursor)
+        if mode not in ('hash', 'zlib'):
+            logger.info(f"消息存储模式为 {mode}，无需压缩")
+            return report
+
+        last_id = 0
+        while True:
+            cursor.execute("""
+                SELECT id, message_content FROM message_history
+                WHERE is_pushed = 1 AND message_content IS NOT NULL AND id > ?
+                ORDER BY id LIMIT ?
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row_id, content in rows:
+                compacted = compact_message_content(content, mode)
+                # 压缩后不会更小的消息保留原文
+                if compacted[0] is not None:
+                    continue
+                report["bytes_before"] += len(content.encode("utf-8"))
+                report["bytes_after"] += stored_content_size(*compacted)
+                updates.append(compacted[1:] + (row_id,))
+
+            cursor.executemany("""
+                UPDATE message_history
+                SET message_content = NULL, content_hash = ?, content_zlib = ?
+                WHERE id = ?
+            """, updates)
+            if mode == 'hash':
+                cursor.executemany("DELETE FROM message_fts WHERE rowid = ?", [(update[-1],) for update in updates])
+            conn.commit()
+
+            report["rows"] += len(updates)
+            last_id = rows[-1][0]
+
+        if mode == 'hash':
+            # 清理此前 hash 模式压缩时遗留的索引
+            cursor.execute("""
+                DELETE FROM message_fts WHERE rowid IN (
+                    SELECT id FROM message_history WHERE message_content IS NULL AND content_zlib IS NULL
+                )
+            """)
+            conn.commit()
+
+        report["bytes_saved"] = report["bytes_before"] - report["bytes_after"]
+        logger.info(f"消息正文压缩完成({mode})，共 {report['rows']} 条，节省 {report['bytes_saved']} 字节")
+        return report
+
+    except sqlite3.Error as e:
+        logger.error(f"压缩消息正文失败: {e}")
+        return report
+    finally:
+        if conn:
+            conn.close()
+
+
+# ======================== 监控运行统计 ======================== #
+MONITOR_RUN_FIELDS = ('users_polled', 'unread_channels', 'dsm_calls', 'pushes', 'push_failures', 'failures',
+                      'sid_refreshes')
+
+
+def add_monitor_run(run: dict, max_runs: int, rollup_days: int) -> bool:
+    """
+    记录一轮监控的统计，同时累加到所在小时的汇总，并删除超出保留范围的记录
+
+    Args:
+        run: 包含 started_at、duration 和 MONITOR_RUN_FIELDS 各字段的字典
+        max_runs: monitor_runs 保留的最大记录数
+        rollup_days: 小时汇总保留的天数
+
+    Returns:
+        bool: 是否写入成功
+    """
+    counts = [int(run.get(field, 0)) for field in MONITOR_RUN_FIELDS]
+    hour = int(run['started_at'] // 3600 * 3600)
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO monitor_runs (started_at, duration, {', '.join(MONITOR_RUN_FIELDS)})
+            VALUES (?, ?, {', '.join('?' for _ in MONITOR_RUN_FIELDS)})
+        """, [run['started_at'], run['duration']] + counts)
+        last_id = cursor.lastrowid
+
+        cursor.execute(f"""
+            INSERT INTO monitor_run_rollups (hour, cycles, total_duration, max_duration, {', '.join(MONITOR_RUN_FIELDS)})
+            VALUES (?, 1, ?, ?, {', '.join('?' for _ in MONITOR_RUN_FIELDS)})
+            ON CONFLICT(hour) DO UPDATE SET
+                cycles = cycles + 1,
+                total_duration = total_duration + excluded.total_duration,
+                max_duration = MAX(max_duration, excluded.max_duration),
+                {', '.join(f'{field} = {field} + excluded.{field}' for field in MONITOR_RUN_FIELDS)}
+        """, [hour, run['duration'], run['duration']] + counts)
+
+        cursor.execute("DELETE FROM monitor_runs WHERE id <= ?", (last_id - max_runs,))
+        cursor.execute("DELETE FROM monitor_run_rollups WHERE hour < ?", (hour - rollup_days * 86400,))
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"记录监控运行统计失败: {e}")
+        return False
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_monitor_runs(since: float = 0, limit: int = 1000) -> list:
+    """
+    查询最近的监控运行记录（按时间正序）
+
+    Args:
+        since: 只返回该时间戳之后开始的记录
+        limit: 最多返回的记录数
+
+    Returns:
+        list: 字典列表
+    """
+    columns = ('started_at', 'duration') + MONITOR_RUN_FIELDS
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(columns)} FROM (
+                SELECT * FROM monitor_runs WHERE started_at >= ? ORDER BY id DESC LIMIT ?
+            ) ORDER BY started_at
+        """, (since, limit))
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"查询监控运行记录失败: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_monitor_run_rollups(since: float = 0) -> list:
+    """
+    查询按小时汇总的监控运行统计（按时间正序）
+
+    Args:
+        since: 只返回该时间戳之后的小时
+
+    Returns:
+        list: 字典列表，包含 avg_duration
+    """
+    columns = ('hour', 'cycles', 'total_duration', 'max_duration') + MONITOR_RUN_FIELDS
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(columns)} FROM monitor_run_rollups WHERE hour >= ? ORDER BY hour
+        """, (since,))
+        rollups = []
+        for row in cursor.fetchall():
+            rollup = dict(zip(columns, row))
+            rollup['avg_duration'] = rollup['total_duration'] / rollup['cycles'] if rollup['cycles'] else 0
+            rollups.append(rollup)
+        return rollups
+    except sqlite3.Error as e:
+        logger.error(f"查询监控运行汇总失败: {e}")
         return []
     finally:
         if conn:
@@ -606,7 +1559,8 @@ def get_user_by_id(user_id):
 
         if user:
             # 将结果转换为字典格式便于使用
-            columns = ['id', 'is_banned', 'user_name', 'user_password', 'sid', 'GOTIFY_URL', 'GOTIFY_TOKEN']
+            columns = ['id', 'is_banned', 'user_name', 'user_password', 'sid', 'GOTIFY_URL', 'GOTIFY_TOKEN',
+                       'push_backend']
             user_dict = dict(zip(columns, user))
             return user_dict
         else:
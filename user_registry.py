@@ -0,0 +1,129 @@
+"""
+Synology Chat Push Gateway
+Copyright 2024 leipeng1998
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+"""
+推送用户内存注册表
+监控启动时全量加载一次推送用户，之后只根据 user_change_log 中的变更增量更新，
+管理界面通过 publish_user_change() 发布变更
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import use_sql
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """
+    推送用户注册表
+
+    用户元组结构与 use_sql.get_user_info() 相同: (id, is_banned, user_name, sid, GOTIFY_URL, GOTIFY_TOKEN, push_backend)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users: Dict[int, tuple] = {}
+        self._last_change_id = 0
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self) -> None:
+        """全量加载所有推送用户"""
+        # 先读取变更位置再加载用户，加载期间产生的变更会在下次 sync 时重放
+        last_change_id = get_storage().users.last_change_id()
+        users = get_storage().users.all()
+        with self._lock:
+            self._users = {user[0]: user for user in users}
+            self._last_change_id = last_change_id
+            self._loaded = True
+        logger.info(f"用户注册表已加载 {len(users)} 个用户")
+
+    def sync(self) -> int:
+        """
+        应用 user_change_log 中的新变更
+
+        Returns:
+            int: 应用的变更数量
+        """
+        if not self._loaded:
+            self.load()
+            return 0
+
+        with self._lock:
+            last_change_id = self._last_change_id
+        changes = get_storage().users.changes_since(last_change_id)
+        if not changes:
+            return 0
+
+        changed_ids = {user_id for _, user_id, _ in changes}
+        rows = {user[0]: user for user in get_storage().users.get_by_ids(sorted(changed_ids))}
+        with self._lock:
+            for user_id in changed_ids:
+                if user_id in rows:
+                    self._users[user_id] = rows[user_id]
+                else:
+                    self._users.pop(user_id, None)
+            self._last_change_id = max(self._last_change_id, changes[-1][0])
+
+        logger.info(f"用户注册表已应用 {len(changes)} 条变更，涉及用户: {sorted(changed_ids)}")
+        return len(changes)
+
+    def users(self) -> List[tuple]:
+        """获取所有用户的快照"""
+        with self._lock:
+            return list(self._users.values())
+
+    def get(self, user_id: int) -> Optional[tuple]:
+        """获取用户的最新信息，用户已删除时返回 None"""
+        with self._lock:
+            return self._users.get(user_id)
+
+    def update_sid(self, user_name: str, sid: str) -> None:
+        """SID 刷新后同步更新内存中的用户信息"""
+        with self._lock:
+            for user_id, user in self._users.items():
+                if user[2] == user_name:
+                    self._users[user_id] = user[:3] + (sid,) + user[4:]
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._users)
+
+
+user_registry = UserRegistry()
+
+
+def publish_user_change(user_id: int, change_type: str) -> None:
+    """
+    发布推送用户变更
+
+    变更写入 user_change_log，独立的监控进程在下一轮读取；
+    同一进程内的监控线程立即应用，封禁等操作可以马上生效
+
+    Args:
+        user_id: 推送用户ID
+        change_type: add / update / delete
+    """
+    use_sql.add_user_change(user_id, change_type)
+    if user_registry.loaded:
+        user_registry.sync()